@@ -0,0 +1,229 @@
+import json
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Literal, Optional
+from fastapi import APIRouter, Header, HTTPException, Query, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
+from . import bank
+from .events import HEARTBEAT_SECONDS, Subscription, broker
+from .money import json_amounts, to_cents, to_json_number
+from .sessions import SessionError, check_session
+
+router = APIRouter()
+
+def require_session(authorization: Optional[str], name: str) -> None:
+    """Account views need the account's own session token (no PIN fallback on GET)."""
+    try:
+        if not check_session(authorization, name):
+            raise SessionError("Authentication failed: No session token provided.")
+    except SessionError as e:
+        raise HTTPException(status_code=401, detail=str(e))
+
+def _as_utc(moment: Optional[datetime]) -> Optional[datetime]:
+    # Dates without a timezone are taken as UTC
+    if moment is not None and moment.tzinfo is None:
+        return moment.replace(tzinfo=timezone.utc)
+    return moment
+
+@router.get("/accounts/{name}/balance")
+async def get_balance(
+    name: str,
+    response: Response,
+    authorization: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None),
+):
+    """
+    Retrieves an account's balance and version. The version is also sent as the ETag and
+    changes only when a deposit or transfer touches the account, so a client polling with
+    "If-None-Match: <etag>" gets an empty 304 until the balance changes.
+    Requires the account's session token as "Authorization: Bearer <token>".
+    """
+    require_session(authorization, name)
+    try:
+        balance, version = await bank.get_balance_with_version_async(name)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
+
+    etag = f'"{version}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if if_none_match is not None and etag in (tag.strip() for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return {"name": name, "balance": json_amounts(balance), "version": version}
+
+def _balance_event(name: str, cents: int, version: int) -> str:
+    # Same shape and number format as the balance endpoint
+    data = json.dumps({"name": name, "balance": to_json_number(cents), "version": version})
+    return f"event: balance\nid: {version}\ndata: {data}\n\n"
+
+class BalanceEventStream(StreamingResponse):
+    """
+    Server-Sent Events of one account's balance. It subscribes when the response
+    starts and unsubscribes when it ends, however it ends: a generator's own cleanup
+    is skipped when the client disconnects while an event is being sent.
+    """
+
+    def __init__(self, name: str, authorization: Optional[str], last_event_id: Optional[str]):
+        super().__init__(
+            self._events(),
+            media_type="text/event-stream",
+            # X-Accel-Buffering: a buffering proxy in front would hold events back
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+        self.name = name
+        self.authorization = authorization
+        self.last_event_id = last_event_id
+        self.subscription: Optional[Subscription] = None
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            self.subscription = broker.subscribe(self.name)
+        except OverflowError as e:
+            await _too_many_streams(str(e))(scope, receive, send)
+            return
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            broker.unsubscribe(self.subscription)
+
+    async def _events(self):
+        subscription = self.subscription
+        # Read after subscribing, so no change between the two is missed
+        balance, version = await bank.get_balance_with_version_async(self.name)
+        if self.last_event_id == str(version):
+            subscription.skip_through(version)
+        else:
+            subscription.offer(to_cents(balance), version)
+        while True:
+            event = await subscription.next(HEARTBEAT_SECONDS)
+            try:
+                if not check_session(self.authorization, self.name):
+                    return
+            except SessionError:
+                # Logged out or expired
+                return
+            yield ": keep-alive\n\n" if event is None else _balance_event(self.name, *event)
+
+def _too_many_streams(detail: str) -> JSONResponse:
+    return JSONResponse(
+        status_code=503, content={"detail": detail}, headers={"Retry-After": str(int(HEARTBEAT_SECONDS))}
+    )
+
+@router.get("/accounts/{name}/events")
+async def stream_balance_events(
+    name: str,
+    authorization: Optional[str] = Header(None),
+    last_event_id: Optional[str] = Header(None),
+):
+    """
+    Streams an account's balance as Server-Sent Events: a "balance" event with the
+    current balance, then one each time a deposit or transfer changes it. The event
+    id is the balance version; a client reconnecting with "Last-Event-ID" skips the
+    first event when nothing changed meanwhile. A slow client gets only the latest
+    balance, never a backlog. Idle streams receive a comment every few seconds, and
+    the stream ends when the session does.
+    Requires the account's session token as "Authorization: Bearer <token>".
+    """
+    require_session(authorization, name)
+    if broker.full():
+        return _too_many_streams("Too many open event streams. Try again later.")
+    try:
+        await bank.get_balance_with_version_async(name)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    return BalanceEventStream(name, authorization, last_event_id)
+
+@router.get("/accounts/{name}/transactions")
+async def get_transactions(
+    name: str,
+    cursor: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    limit: int = Query(50, ge=1, le=500),
+    authorization: Optional[str] = Header(None),
+):
+    """
+    Retrieves one page of an account's statement, newest first.
+    `start` and `end` (ISO 8601, UTC unless a timezone is given) limit it to a date range.
+    Pass the returned `next_cursor` as `cursor` to get older entries; it is null on the last page.
+    Requires the account's session token as "Authorization: Bearer <token>".
+    """
+    require_session(authorization, name)
+    try:
+        return json_amounts(await bank.get_transactions_async(name, cursor, _as_utc(start), _as_utc(end), limit))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
+
+class ScheduledTransferRequest(BaseModel):
+    receiver_name: str
+    # Exact decimal amount with at most two decimal places (a JSON number or string)
+    amount: Decimal
+    # ISO 8601, UTC unless a timezone is given
+    first_due: datetime
+    # Omitted for a one-off transfer
+    interval: Optional[Literal["daily", "weekly", "monthly"]] = None
+    end: Optional[datetime] = None
+
+@router.post("/accounts/{name}/scheduled-transfers")
+async def create_scheduled_transfer(
+    name: str,
+    request: ScheduledTransferRequest,
+    authorization: Optional[str] = Header(None),
+):
+    """
+    Schedules a transfer from the account at `first_due`, repeated daily, weekly or
+    monthly until `end` when an `interval` is given. A monthly transfer on the 29th
+    to 31st falls on the last day of shorter months. Each run is checked like a
+    transfer when it is due; a refused run is recorded on the schedule, which moves on.
+    Requires the account's session token as "Authorization: Bearer <token>".
+    """
+    require_session(authorization, name)
+    try:
+        return json_amounts(await bank.schedule_transfer_async(
+            name,
+            request.receiver_name,
+            request.amount,
+            _as_utc(request.first_due),
+            request.interval,
+            _as_utc(request.end),
+        ))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
+
+@router.get("/accounts/{name}/scheduled-transfers")
+async def list_scheduled_transfers(name: str, authorization: Optional[str] = Header(None)):
+    """
+    Lists the account's scheduled transfers with their next run, how many runs were
+    applied or failed, and the outcome of the last one.
+    Requires the account's session token as "Authorization: Bearer <token>".
+    """
+    require_session(authorization, name)
+    try:
+        return {"name": name, "scheduled_transfers": json_amounts(await bank.list_schedules_async(name))}
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
+
+@router.delete("/accounts/{name}/scheduled-transfers/{schedule_id}")
+async def cancel_scheduled_transfer(name: str, schedule_id: str, authorization: Optional[str] = Header(None)):
+    """
+    Cancels a scheduled transfer. Runs that already happened are not undone.
+    Requires the account's session token as "Authorization: Bearer <token>".
+    """
+    require_session(authorization, name)
+    try:
+        await bank.cancel_schedule_async(name, schedule_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
+    return {"message": "Scheduled transfer cancelled."}
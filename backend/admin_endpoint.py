@@ -0,0 +1,100 @@
+from decimal import Decimal
+from typing import Literal, Optional
+from fastapi import APIRouter, Header, HTTPException, Response
+from pydantic import BaseModel, Field
+from . import bank, profiling
+from .money import json_amounts
+from .sessions import SessionError, check_admin
+
+router = APIRouter()
+
+class ProfilingSettings(BaseModel):
+    enabled: Optional[bool] = None
+    # Fraction of requests to profile at random
+    sample_rate: Optional[float] = Field(None, ge=0, le=1)
+    # Keep profiles of requests slower than this many milliseconds (0 turns it off)
+    slow_ms: Optional[float] = Field(None, ge=0)
+
+class BulkOperationRequest(BaseModel):
+    kind: Literal["interest", "fee"]
+    # Interest rate as a fraction of the balance, e.g. 0.0125 for 1.25%
+    rate: Optional[Decimal] = None
+    # Fee per account; an account is never charged more than its balance
+    amount: Optional[Decimal] = None
+    # Only accounts whose balance is within these bounds (inclusive) are changed
+    min_balance: Optional[Decimal] = None
+    max_balance: Optional[Decimal] = None
+    dry_run: bool = False
+
+def require_admin(x_admin_token: Optional[str]) -> None:
+    try:
+        check_admin(x_admin_token)
+    except SessionError as e:
+        raise HTTPException(status_code=401, detail=str(e))
+
+@router.get("/admin/profiling")
+async def get_profiling_settings(x_admin_token: Optional[str] = Header(None)):
+    """
+    Returns the current request profiling settings.
+    """
+    require_admin(x_admin_token)
+    return profiling.settings()
+
+@router.put("/admin/profiling")
+async def update_profiling_settings(request: ProfilingSettings, x_admin_token: Optional[str] = Header(None)):
+    """
+    Turns request profiling on or off and changes its sample rate and latency threshold, without a restart.
+    Fields left out keep their current value.
+    """
+    require_admin(x_admin_token)
+    try:
+        return profiling.configure(request.enabled, request.sample_rate, request.slow_ms)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/admin/profiles")
+async def list_profiles(x_admin_token: Optional[str] = Header(None)):
+    """
+    Lists the stored request profiles, newest first, without their stacks.
+    """
+    require_admin(x_admin_token)
+    return {"profiles": profiling.list_profiles()}
+
+@router.get("/admin/profiles/{profile_id}")
+async def download_profile(
+    profile_id: str,
+    format: Literal["json", "folded"] = "json",
+    x_admin_token: Optional[str] = Header(None),
+):
+    """
+    Downloads one profile. "json" includes the request details; "folded" is the
+    collapsed-stack text that flamegraph.pl and speedscope read.
+    """
+    require_admin(x_admin_token)
+    try:
+        record = profiling.load(profile_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    if format == "folded":
+        return Response(
+            content=profiling.to_folded(record),
+            media_type="text/plain",
+            headers={"Content-Disposition": f'attachment; filename="{profile_id}.folded"'},
+        )
+    return record
+
+@router.post("/admin/bulk-operations")
+async def apply_bulk_operation(request: BulkOperationRequest, x_admin_token: Optional[str] = Header(None)):
+    """
+    Applies interest or a fee to every account in one atomic change and returns the totals.
+    With dry_run the totals are computed without changing anything.
+    """
+    require_admin(x_admin_token)
+    try:
+        return json_amounts(await bank.apply_bulk_async(
+            request.kind, request.rate, request.amount, request.min_balance, request.max_balance, request.dry_run
+        ))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {e}")
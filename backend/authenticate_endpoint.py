@@ -1,6 +1,9 @@
-from fastapi import APIRouter, HTTPException
+from typing import Optional
+from fastapi import APIRouter, Header, HTTPException
 from pydantic import BaseModel
 from . import bank
+from .money import json_amounts
+from .sessions import SESSION_TTL_SECONDS, SessionError, bearer_token, sessions
 
 router = APIRouter()
 
@@ -12,16 +15,24 @@ class AuthRequest(BaseModel):
 async def authenticate_user(request: AuthRequest):
     """
     Authenticates a user with the provided name and PIN number.
-    Returns authentication status, bank balance on success, or an error message on failure.
+    Returns authentication status, bank balance and a session token on success, or an error message on failure.
+    The session token can be sent as "Authorization: Bearer <token>" to deposit and transfer without the PIN.
     """
     try:
         # Authenticate the user
-        authenticated = bank.authenticate(request.name, request.pin_number)
+        authenticated = await bank.authenticate_async(request.name, request.pin_number)
         
         if authenticated:
             # If authenticated, get the bank balance
-            balance = bank.get_balance(request.name)
-            return {"authenticated": True, "bank_balance": balance}
+            balance, version = await bank.get_balance_with_version_async(request.name)
+            return {
+                "authenticated": True,
+                "bank_balance": json_amounts(balance),
+                # Changes whenever the balance does: see GET /accounts/{name}/balance
+                "version": version,
+                "session_token": sessions.issue(request.name),
+                "expires_in": SESSION_TTL_SECONDS,
+            }
         else:
             # This path should ideally not be hit if bank.authenticate raises ValueError
             return {"authenticated": False, "message": "Authentication failed: Unknown reason."}
@@ -32,3 +43,16 @@ async def authenticate_user(request: AuthRequest):
         # Catch any other unexpected errors
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
 
+@router.post("/logout")
+async def logout_user(authorization: Optional[str] = Header(None)):
+    """
+    Revokes the session token sent in the Authorization header.
+    """
+    try:
+        token = bearer_token(authorization)
+    except SessionError as e:
+        raise HTTPException(status_code=401, detail=str(e))
+    if token is None:
+        raise HTTPException(status_code=401, detail="Authentication failed: No session token provided.")
+    sessions.revoke(token)
+    return {"message": "Logged out."}
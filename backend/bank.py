@@ -1,97 +1,452 @@
-import json
-from typing import Dict, Any
+import asyncio
+import copy
+import functools
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Dict, Any, Callable, Optional, Tuple
+from . import pins
+from .events import broker
+from .metrics import GaugeFunc, LOOKUP_SECONDS, SCHEDULED_TRANSFERS, STORAGE_OPERATION_SECONDS
+from .money import Amount, from_cents, to_cents
+from .scheduler import scheduler
+from .storage import SCHEDULE_INTERVALS, ShardNotOwnedError, Storage, STORAGE_BACKEND, SHARD_DIR, SQLITE_FILE, open_storage
+from .store import normalize_name
 
 DATABASE_FILE = "database.json"
 
+# Deposits and transfers wait on journal writes, so the async API runs them on a
+# bounded thread pool instead of the event loop
+IO_WORKERS = int(os.environ.get("BANK_IO_WORKERS", "16"))
+_io_executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="bank-io")
+# PIN hashing is CPU bound (hashlib.scrypt releases the GIL), so it gets its own pool
+HASH_WORKERS = int(os.environ.get("BANK_HASH_WORKERS", str(os.cpu_count() or 4)))
+_hash_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="bank-hash")
+# How far in the past a scheduled transfer may start (for clocks slightly behind ours), in seconds
+SCHEDULE_PAST_TOLERANCE_SECONDS = float(os.environ.get("BANK_SCHEDULE_PAST_TOLERANCE_SECONDS", "60"))
+
+_store: Optional[Storage] = None
+
+def get_store() -> Storage:
+    """Returns the storage backend selected by BANK_STORAGE (database.json by default)."""
+    global _store
+    path = {"sqlite": SQLITE_FILE, "sharded": SHARD_DIR}.get(STORAGE_BACKEND, DATABASE_FILE)
+    if _store is None or _store.path != path:
+        _store = open_storage(STORAGE_BACKEND, DATABASE_FILE, SQLITE_FILE, SHARD_DIR)
+    return _store
+
+def _journal_average_batch_size() -> float:
+    return get_store().journal.stats()["average_batch_size"]
+
+GaugeFunc(
+    "bank_journal_average_batch_size",
+    "Average number of records per journal fsync (above 1 with group commit).",
+    _journal_average_batch_size,
+)
+
+def _shard_unsent_hand_overs() -> int:
+    return get_store().unsent_hand_overs()
+
+GaugeFunc(
+    "bank_shard_unsent_hand_overs",
+    "Cross-shard transfers debited but not yet handed over after a failure, waiting for a retry.",
+    _shard_unsent_hand_overs,
+)
+
 def load_db() -> Dict[str, Any]:
-    """Reads the database file and returns its content."""
-    try:
-        with open(DATABASE_FILE, "r") as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        # If the file doesn't exist or is empty/corrupt, return a default structure
-        return {"users": []}
+    """Returns a copy of the current database content (snapshot plus journal)."""
+    return copy.deepcopy(get_store().data())
 
 def save_db(data: Dict[str, Any]) -> None:
     """Saves the given data to the database file."""
-    with open(DATABASE_FILE, "w") as f:
-        json.dump(data, f, indent=2)
+    get_store().replace(data)
 
 def _find_user(name: str):
     """Helper function to find a user by name."""
-    db = load_db()
-    for user in db.get("users", []):
-        if user["name"].lower() == name.lower():
-            return user
-    return None
+    with LOOKUP_SECONDS.time():
+        return get_store().get(name)
 
 def authenticate(name: str, pin_number: str) -> bool:
     """Authenticates a user based on name and PIN."""
     user = _find_user(name)
     if not user:
         raise ValueError("Authentication failed: User not found.")
-    if user["pin_number"] != pin_number:
+    if not pins.verify_pin(user["pin_number"], pin_number):
         raise ValueError("Authentication failed: Invalid PIN.")
+    if not pins.is_hashed(user["pin_number"]):
+        # Legacy plaintext PIN: now that we know it, store its hash instead
+        get_store().set_pin(user["name"], pins.hash_pin(pin_number))
     return True
 
-def get_balance(name: str) -> float:
+def get_balance(name: str) -> Decimal:
     """Gets the bank balance for a specific user."""
-    user = _find_user(name)
-    if not user:
+    return get_balance_with_version(name)[0]
+
+def get_balance_with_version(name: str) -> Tuple[Decimal, int]:
+    """
+    Gets the committed balance of a user and its version, which changes only when
+    a deposit or transfer touches the account.
+    Reads never wait for writers and never see a transfer half-applied.
+    """
+    with LOOKUP_SECONDS.time():
+        found = get_store().balance(name)
+    if found is None:
         raise ValueError("Cannot get balance: User not found.")
-    return user["bank_balance"]
+    cents, version = found
+    return from_cents(cents), version
 
-def deposit(name: str, amount: float) -> float:
+def _notify(names: list[str]) -> None:
+    """Publishes the committed balances of these accounts to their event stream subscribers."""
+    store = get_store()
+    for name in names:
+        if not broker.has_subscribers(name):
+            continue
+        found = store.balance(name)
+        if found is not None:
+            broker.publish(name, *found)
+
+def deposit(name: str, amount: Amount) -> Decimal:
     """Deposits a given amount into a user's account."""
-    if amount <= 0:
+    cents = to_cents(amount)
+    if cents <= 0:
         raise ValueError("Deposit amount must be positive.")
 
-    db = load_db()
-    user_found = False
-    for user in db.get("users", []):
-        if user["name"].lower() == name.lower():
-            user["bank_balance"] += amount
-            user_found = True
-            break
-    
-    if not user_found:
-        raise ValueError("Deposit failed: User not found.")
-
-    save_db(db)
-    return get_balance(name)
-
-def transfer(sender_name: str, receiver_name: str, amount: float) -> None:
+    with STORAGE_OPERATION_SECONDS.time(operation="deposit"):
+        new_cents = get_store().deposit(name, cents)
+    _notify([name])
+    return from_cents(new_cents)
+
+def transfer(sender_name: str, receiver_name: str, amount: Amount) -> None:
     """Transfers a given amount from one user to another."""
-    if amount <= 0:
+    cents = to_cents(amount)
+    if cents <= 0:
         raise ValueError("Transfer amount must be positive.")
-    
+
     if sender_name.lower() == receiver_name.lower():
         raise ValueError("Sender and receiver cannot be the same person.")
 
-    db = load_db()
-    sender = None
-    receiver = None
+    with STORAGE_OPERATION_SECONDS.time(operation="transfer"):
+        get_store().transfer(sender_name, receiver_name, cents)
+    _notify([sender_name, receiver_name])
+
+def transfer_batch(sender_name: str, items: list[tuple[str, Amount]], atomic: bool = True) -> Dict[str, Any]:
+    """
+    Transfers amounts from one sender to many receivers, validated against a single
+    consistent view and persisted in one step. With atomic=True either every item
+    is applied or none is; otherwise the valid items are applied and the rest reported.
+    """
+    if not items:
+        raise ValueError("Batch transfer must contain at least one item.")
+
+    items_cents = [(receiver_name, to_cents(amount)) for receiver_name, amount in items]
+    with STORAGE_OPERATION_SECONDS.time(operation="transfer_batch"):
+        results, sender_cents = get_store().transfer_batch(sender_name, items_cents, atomic)
+    _notify([sender_name] + [result["receiver_name"] for result in results if result["status"] == "applied"])
+    return {
+        "results": results,
+        "applied": sum(1 for result in results if result["status"] == "applied"),
+        "failed": sum(1 for result in results if result["status"] == "failed"),
+        "sender_new_balance": from_cents(sender_cents),
+    }
+
+def apply_bulk(
+    kind: str,
+    rate: Optional[Amount] = None,
+    amount: Optional[Amount] = None,
+    min_balance: Optional[Amount] = None,
+    max_balance: Optional[Amount] = None,
+    dry_run: bool = False,
+) -> Dict[str, Any]:
+    """
+    Applies interest (`rate`, e.g. "0.0125" for 1.25%) or a fee (`amount`, never
+    more than the balance) to every account whose balance is between `min_balance`
+    and `max_balance`, as one atomic change. Returns the totals; with dry_run
+    they are only computed.
+    """
+    rule: Dict[str, Any] = {"kind": kind}
+    if kind == "interest":
+        if rate is None:
+            raise ValueError("Interest needs a rate.")
+        try:
+            value = rate if isinstance(rate, Decimal) else Decimal(str(rate))
+        except ArithmeticError:
+            raise ValueError(f"Invalid rate: {rate}")
+        if not value.is_finite() or not -1 < value <= 1:
+            raise ValueError("Rate must be above -1 and at most 1.")
+        rule["rate"] = str(value)
+    elif kind == "fee":
+        if amount is None:
+            raise ValueError("A fee needs an amount.")
+        rule["cents"] = to_cents(amount)
+        if rule["cents"] <= 0:
+            raise ValueError("Fee amount must be positive.")
+    else:
+        raise ValueError(f"Unknown bulk operation: {kind}")
+    if min_balance is not None:
+        rule["min_balance_cents"] = to_cents(min_balance)
+    if max_balance is not None:
+        rule["max_balance_cents"] = to_cents(max_balance)
 
-    for user in db.get("users", []):
-        if user["name"].lower() == sender_name.lower():
-            sender = user
-        if user["name"].lower() == receiver_name.lower():
-            receiver = user
+    with STORAGE_OPERATION_SECONDS.time(operation="bulk"):
+        summary = get_store().apply_bulk(rule, dry_run)
+    if summary["changed"] and not dry_run:
+        _notify(broker.subscribed_names())
+    return {
+        "kind": kind,
+        "dry_run": dry_run,
+        "accounts": summary["accounts"],
+        "changed": summary["changed"],
+        "total_before": from_cents(summary["before_cents"]),
+        "total_change": from_cents(summary["change_cents"]),
+        "total_after": from_cents(summary["after_cents"]),
+    }
 
+def _timestamp(value: Optional[float]) -> Optional[datetime]:
+    return datetime.fromtimestamp(value, timezone.utc) if value is not None else None
+
+def _schedule_view(schedule: Dict[str, Any]) -> Dict[str, Any]:
+    last_run = schedule["last_run"]
+    return {
+        "id": schedule["id"],
+        "sender_name": schedule["sender"],
+        "receiver_name": schedule["receiver"],
+        "amount": from_cents(schedule["cents"]),
+        "first_due": _timestamp(schedule["start"]),
+        "interval": schedule["interval"],
+        "end": _timestamp(schedule["end"]),
+        "next_due": _timestamp(schedule["next_due"]),
+        "applied": schedule["applied"],
+        "failed": schedule["failed"],
+        "last_run": {
+            "due": _timestamp(last_run["due"]),
+            "ran_at": _timestamp(last_run["ts"]),
+            "status": last_run["status"],
+            "message": last_run["message"],
+        } if last_run else None,
+    }
+
+def schedule_transfer(
+    sender_name: str,
+    receiver_name: str,
+    amount: Amount,
+    first_due: datetime,
+    interval: Optional[str] = None,
+    end: Optional[datetime] = None,
+) -> Dict[str, Any]:
+    """
+    Schedules a transfer for `first_due`, repeated every day, week or month
+    (`interval`) until `end` when given. Each run is checked like a transfer when
+    it is due; a refused run (e.g. insufficient funds) is recorded and the
+    schedule moves on to its next occurrence.
+    """
+    cents = to_cents(amount)
+    if cents <= 0:
+        raise ValueError("Transfer amount must be positive.")
+    if sender_name.lower() == receiver_name.lower():
+        raise ValueError("Sender and receiver cannot be the same person.")
+    if interval is not None and interval not in SCHEDULE_INTERVALS:
+        raise ValueError(f"Unknown interval: {interval}")
+    if first_due.timestamp() < time.time() - SCHEDULE_PAST_TOLERANCE_SECONDS:
+        raise ValueError("The first transfer of a schedule can't be in the past.")
+    if end is not None and end < first_due:
+        raise ValueError("The end of a schedule can't be before its first transfer.")
+    sender = _find_user(sender_name)
     if not sender:
         raise ValueError("Transfer failed: Sender not found.")
+    try:
+        receiver = _find_user(receiver_name)
+    except ShardNotOwnedError:
+        # Served by another worker: checked when each run is due, like a cross-shard transfer
+        receiver = {"name": receiver_name}
     if not receiver:
         raise ValueError("Transfer failed: Receiver not found.")
 
-    if sender["bank_balance"] < amount:
-        raise ValueError("Transfer failed: Insufficient funds.")
+    schedule = {
+        "id": uuid.uuid4().hex,
+        "sender": sender["name"],
+        "receiver": receiver["name"],
+        "cents": cents,
+        "start": first_due.timestamp(),
+        "interval": interval,
+        "end": end.timestamp() if end is not None else None,
+        "occurrence": 0,
+        "next_due": first_due.timestamp(),
+        "applied": 0,
+        "failed": 0,
+        "last_run": None,
+        "created": time.time(),
+    }
+    with STORAGE_OPERATION_SECONDS.time(operation="schedule_add"):
+        get_store().add_schedule(schedule)
+    scheduler.add(schedule)
+    return _schedule_view(schedule)
+
+def list_schedules(name: str) -> list[Dict[str, Any]]:
+    """Returns the scheduled transfers an account sends, earliest next run first (finished ones last)."""
+    if not _find_user(name):
+        raise ValueError("User not found.")
+    schedules = get_store().schedules(name)
+    schedules.sort(key=lambda schedule: (schedule["next_due"] is None, schedule["next_due"] or 0, schedule["created"]))
+    return [_schedule_view(schedule) for schedule in schedules]
 
-    sender["bank_balance"] -= amount
-    receiver["bank_balance"] += amount
+def cancel_schedule(name: str, schedule_id: str) -> None:
+    """Deletes a scheduled transfer of an account; runs that already happened stay."""
+    with STORAGE_OPERATION_SECONDS.time(operation="schedule_remove"):
+        get_store().remove_schedule(name, schedule_id)
 
-    save_db(db)
+def run_scheduled_transfers(runs: list[Dict[str, Any]]) -> list[Dict[str, Any]]:
+    """
+    Runs a batch of due scheduled transfers (called by the scheduler). Returns the
+    schedules that ran, as stored, so the scheduler can queue their next runs.
+    """
+    with STORAGE_OPERATION_SECONDS.time(operation="run_schedules"):
+        ran = get_store().run_schedules(runs)
+    for schedule in ran:
+        SCHEDULED_TRANSFERS.inc(status=schedule["last_run"]["status"])
+    _notify([
+        name for schedule in ran if schedule["last_run"]["status"] == "applied"
+        for name in (schedule["sender"], schedule["receiver"])
+    ])
+    return ran
 
 def get_all_user_names() -> list[str]:
     """Returns a list of all user names from the database."""
-    db = load_db()
-    return [user["name"] for user in db.get("users", [])]
+    return get_store().names()
+
+def search_user_names(prefix: str = "", cursor: Optional[str] = None, limit: int = 50) -> Dict[str, Any]:
+    """
+    Returns one page of user names in case-insensitive sorted order, optionally
+    only those starting with `prefix` (case-insensitive). `next_cursor` is passed
+    back as `cursor` to get the following page; it is None on the last page.
+    `version` is the data version at the time of the read.
+    """
+    store = get_store()
+    version = store.version()
+    # One extra name tells whether there is a next page
+    names = store.search_names(prefix, cursor, limit + 1)
+    next_cursor = normalize_name(names[limit - 1]) if len(names) > limit else None
+    return {"users": names[:limit], "next_cursor": next_cursor, "version": version}
+
+def get_transactions(
+    name: str,
+    cursor: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    limit: int = 50,
+) -> Dict[str, Any]:
+    """
+    Returns one page of an account's statement, newest first: each deposit and
+    transfer with its time, counterparty, signed amount and the resulting balance.
+    `start` and `end` limit it to a date range (inclusive). `next_cursor` is passed
+    back as `cursor` to get older entries; it is None on the last page.
+    """
+    if not _find_user(name):
+        raise ValueError("User not found.")
+    try:
+        before = int(cursor) if cursor is not None else None
+    except ValueError:
+        raise ValueError("Invalid cursor.")
+    # One extra entry tells whether there is a next page
+    entries = get_store().transactions(
+        name, before, start.timestamp() if start else None, end.timestamp() if end else None, limit + 1
+    )
+    return {
+        "name": name,
+        "transactions": [
+            {
+                "timestamp": datetime.fromtimestamp(entry["ts"], timezone.utc),
+                "type": entry["type"],
+                "counterparty": entry["counterparty"],
+                "amount": from_cents(entry["cents"]),
+                "balance": from_cents(entry["balance_cents"]),
+            }
+            for entry in entries[:limit]
+        ],
+        "next_cursor": str(entries[limit - 1]["id"]) if len(entries) > limit else None,
+    }
+
+# --- Async API for the endpoints ---
+
+async def _run_blocking(func: Callable, *args, executor: ThreadPoolExecutor = _io_executor):
+    """Runs a function that may touch the disk (or burn CPU) on a thread pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(func, *args))
+
+async def _run_read(func: Callable, *args):
+    """Runs a read in place when it is answered from memory, on the I/O pool otherwise."""
+    store = get_store()
+    if store.in_memory and store.loaded:
+        return func(*args)
+    return await _run_blocking(func, *args)
+
+async def authenticate_async(name: str, pin_number: str) -> bool:
+    store = get_store()
+    if store.in_memory and store.loaded:
+        user = store.get(name)
+        if user and pins.is_hashed(user["pin_number"]) and pins.is_verified(user["pin_number"], pin_number):
+            # Recently verified: no need to hash again
+            return True
+    return await _run_blocking(authenticate, name, pin_number, executor=_hash_executor)
+
+async def get_balance_async(name: str) -> Decimal:
+    return await _run_read(get_balance, name)
+
+async def get_balance_with_version_async(name: str) -> Tuple[Decimal, int]:
+    return await _run_read(get_balance_with_version, name)
+
+async def get_all_user_names_async() -> list[str]:
+    return await _run_read(get_all_user_names)
+
+async def search_user_names_async(prefix: str = "", cursor: Optional[str] = None, limit: int = 50) -> Dict[str, Any]:
+    return await _run_read(search_user_names, prefix, cursor, limit)
+
+async def get_transactions_async(
+    name: str,
+    cursor: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    limit: int = 50,
+) -> Dict[str, Any]:
+    # Statement entries are read from disk
+    return await _run_blocking(get_transactions, name, cursor, start, end, limit)
+
+async def deposit_async(name: str, amount: Amount) -> Decimal:
+    return await _run_blocking(deposit, name, amount)
+
+async def transfer_async(sender_name: str, receiver_name: str, amount: Amount) -> None:
+    await _run_blocking(transfer, sender_name, receiver_name, amount)
+
+async def transfer_batch_async(sender_name: str, items: list[tuple[str, Amount]], atomic: bool = True) -> Dict[str, Any]:
+    return await _run_blocking(transfer_batch, sender_name, items, atomic)
+
+async def apply_bulk_async(
+    kind: str,
+    rate: Optional[Amount] = None,
+    amount: Optional[Amount] = None,
+    min_balance: Optional[Amount] = None,
+    max_balance: Optional[Amount] = None,
+    dry_run: bool = False,
+) -> Dict[str, Any]:
+    return await _run_blocking(apply_bulk, kind, rate, amount, min_balance, max_balance, dry_run)
+
+async def schedule_transfer_async(
+    sender_name: str,
+    receiver_name: str,
+    amount: Amount,
+    first_due: datetime,
+    interval: Optional[str] = None,
+    end: Optional[datetime] = None,
+) -> Dict[str, Any]:
+    return await _run_blocking(schedule_transfer, sender_name, receiver_name, amount, first_due, interval, end)
+
+async def list_schedules_async(name: str) -> list[Dict[str, Any]]:
+    return await _run_read(list_schedules, name)
+
+async def cancel_schedule_async(name: str, schedule_id: str) -> None:
+    return await _run_blocking(cancel_schedule, name, schedule_id)
+
+async def run_scheduled_transfers_async(runs: list[Dict[str, Any]]) -> list[Dict[str, Any]]:
+    return await _run_blocking(run_scheduled_transfers, runs)
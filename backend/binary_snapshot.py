@@ -0,0 +1,236 @@
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from itertools import accumulate
+from typing import Dict, Iterator, List, Optional, Tuple
+from .metrics import BYTES_WRITTEN, SNAPSHOT_LOAD_SECONDS, SNAPSHOT_WRITE_SECONDS
+from .storage import normalize_name
+from .store import AccountTable
+
+MAGIC = b"BANKSNAP"
+FORMAT_VERSION = 1
+# magic, format version, byte order (0 little, 1 big), account count, journal seq, then the section offsets
+_HEADER = struct.Struct("<8sIIQQ9Q")
+_SECTIONS = (
+    "balances",      # int64 per account, in slot order
+    "name_offsets",  # uint64 per account + 1, into the names blob
+    "names",
+    "pin_offsets",
+    "pins",
+    "key_offsets",   # uint64 per account + 1, into the keys blob, in sorted key order
+    "keys",          # normalized names, UTF-8, sorted (byte order is code point order)
+    "key_slots",     # uint64 per account: the slot of each sorted key
+    "extras",        # JSON: scheduled transfers and shard state (outbound credits, inbox offset)
+)
+
+
+class _Strings:
+    """A column of strings stored as an offsets array plus a UTF-8 blob, decoded on access."""
+
+    def __init__(self, buffer: mmap.mmap, offsets: memoryview, start: int, changed: Optional[Dict[int, str]] = None):
+        self._buffer = buffer
+        self._offsets = offsets
+        self._start = start
+        # Values replaced since the snapshot was written (PIN changes)
+        self._changed = changed if changed is not None else {}
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index: int) -> str:
+        changed = self._changed.get(index)
+        if changed is not None:
+            return changed
+        return self._buffer[self._start + self._offsets[index]:self._start + self._offsets[index + 1]].decode()
+
+    def __setitem__(self, index: int, value: str) -> None:
+        self._changed[index] = value
+
+    def __iter__(self) -> Iterator[str]:
+        for index in range(len(self)):
+            yield self[index]
+
+
+class _NameIndex:
+    """
+    Normalized name -> slot, answered by a binary search over the sorted keys of
+    the file. Keys found are remembered, so accounts in use cost a dict lookup.
+    """
+
+    def __init__(self, keys: _Strings, key_slots: memoryview):
+        self._keys = keys
+        self._key_slots = key_slots
+        self._found: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._key_slots)
+
+    def position(self, key: str) -> int:
+        """The position of the first sorted key not below `key`."""
+        encoded = key.encode()
+        buffer, offsets, start = self._keys._buffer, self._keys._offsets, self._keys._start
+        low, high = 0, len(self._key_slots)
+        while low < high:
+            middle = (low + high) // 2
+            if buffer[start + offsets[middle]:start + offsets[middle + 1]] < encoded:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def get(self, key: str, default: Optional[int] = None) -> Optional[int]:
+        slot = self._found.get(key)
+        if slot is not None:
+            return slot
+        position = self.position(key)
+        if position < len(self._key_slots) and self._keys[position] == key:
+            slot = self._found[key] = self._key_slots[position]
+            return slot
+        return default
+
+    def __getitem__(self, key: str) -> int:
+        slot = self.get(key)
+        if slot is None:
+            raise KeyError(key)
+        return slot
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._keys)
+
+
+class MappedAccountTable(AccountTable):
+    """
+    An AccountTable backed by a memory-mapped binary snapshot. Opening it maps the
+    file and copies only the balance column; names, PINs and the name index are
+    read from the mapping when an account is touched, so startup time hardly
+    depends on the number of accounts. Adding an account first copies the names,
+    PINs and name index into memory, like a table read from JSON.
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+        with open(path, "rb") as f:
+            self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, byte_order, count, self.seq, *offsets = _HEADER.unpack_from(self._buffer)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a binary snapshot this version can read.")
+        if byte_order != (sys.byteorder == "big"):
+            raise ValueError(f"{path} was written with another byte order; convert it through JSON.")
+        sections = dict(zip(_SECTIONS, offsets + [len(self._buffer)]))
+        view = memoryview(self._buffer)
+
+        def column(name: str, code: str, length: int) -> memoryview:
+            start = sections[name]
+            return view[start:start + length * 8].cast(code)
+
+        self.balances = array("q")
+        self.balances.frombytes(self._buffer[sections["balances"]:sections["balances"] + count * 8])
+        self.names = _Strings(self._buffer, column("name_offsets", "Q", count + 1), sections["names"])
+        self.pins = _Strings(self._buffer, column("pin_offsets", "Q", count + 1), sections["pins"])
+        self.slots = _NameIndex(
+            _Strings(self._buffer, column("key_offsets", "Q", count + 1), sections["keys"]),
+            column("key_slots", "Q", count),
+        )
+        extras = json.loads(self._buffer[sections["extras"]:]) if sections["extras"] < len(self._buffer) else {}
+        self.outbound = dict(extras.get("outbound", {}))
+        self.inbox_offset = extras.get("inbox_offset", 0)
+        self.add_schedules(extras.get("schedules", ()))
+
+    def add(self, name: str, pin_number: str, balance_cents: int) -> int:
+        if isinstance(self.slots, _NameIndex):
+            self._copy_to_memory()
+        return super().add(name, pin_number, balance_cents)
+
+    def _copy_to_memory(self) -> None:
+        keys, key_slots = self.slots._keys, self.slots._key_slots
+        self.slots = {keys[position]: key_slots[position] for position in range(len(key_slots))}
+        self.names = list(self.names)
+        self.pins = list(self.pins)
+        self._sorted_keys = None
+
+    def search(self, prefix: str, after: Optional[str], limit: int) -> List[str]:
+        if not isinstance(self.slots, _NameIndex):
+            return super().search(prefix, after, limit)
+        prefix = normalize_name(prefix)
+        keys = self.slots._keys
+        start = self.slots.position(prefix)
+        if after is not None:
+            # Past every key equal to `after`: the next key up is `after` plus the smallest character
+            start = max(start, self.slots.position(after + "\0"))
+        names = []
+        for position in range(start, min(start + limit, len(self.slots))):
+            key = keys[position]
+            if not key.startswith(prefix):
+                break
+            names.append(self.names[self.slots._key_slots[position]])
+        return names
+
+
+def _offsets(values: List[bytes]) -> bytes:
+    return array("Q", [0, *accumulate(len(value) for value in values)]).tobytes()
+
+
+def write_binary_snapshot(path: str, table: AccountTable, seq: int) -> None:
+    """
+    Writes an account table as a binary snapshot. Like write_database_file, the
+    content goes to a temporary file that is fsynced and renamed over the original.
+    """
+    names = [name.encode() for name in table.names]
+    pins = [pin.encode() for pin in table.pins]
+    keys = [normalize_name(name) for name in table.names]
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+    sorted_keys = [keys[slot].encode() for slot in order]
+    extras = {}
+    if table.outbound:
+        extras["outbound"] = table.outbound
+    if table.inbox_offset:
+        extras["inbox_offset"] = table.inbox_offset
+    if table.schedules:
+        extras["schedules"] = table.all_schedules()
+    contents = {
+        "balances": array("q", table.balances).tobytes(),
+        "name_offsets": _offsets(names),
+        "names": b"".join(names),
+        "pin_offsets": _offsets(pins),
+        "pins": b"".join(pins),
+        "key_offsets": _offsets(sorted_keys),
+        "keys": b"".join(sorted_keys),
+        "key_slots": array("Q", order).tobytes(),
+        "extras": json.dumps(extras).encode() if extras else b"",
+    }
+
+    offsets = []
+    position = _HEADER.size
+    chunks = []
+    for name in _SECTIONS:
+        # Sections start on 8-byte boundaries so the integer columns can be mapped directly
+        padding = -position % 8
+        chunks.append(b"\0" * padding)
+        position += padding
+        offsets.append(position)
+        chunks.append(contents[name])
+        position += len(contents[name])
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, sys.byteorder == "big", len(names), seq, *offsets)
+
+    tmp_path = path + ".tmp"
+    with SNAPSHOT_WRITE_SECONDS.time():
+        with open(tmp_path, "wb") as f:
+            f.write(header)
+            f.writelines(chunks)
+            f.flush()
+            os.fsync(f.fileno())
+            BYTES_WRITTEN.inc(f.tell(), file="snapshot")
+        os.replace(tmp_path, path)
+
+
+def read_binary_snapshot(path: str) -> Tuple[AccountTable, int]:
+    """Opens a binary snapshot. Returns the table and the journal sequence number it covers."""
+    with SNAPSHOT_LOAD_SECONDS.time():
+        table = MappedAccountTable(path)
+    return table, table.seq
@@ -0,0 +1,46 @@
+"""
+Applies interest or a fee to every account of the configured storage backend
+(BANK_STORAGE) in one atomic change, and prints the totals. Run it while the
+API is stopped, or use POST /api/v1/admin/bulk-operations on a running server:
+the JSON and sharded stores are locked by the process that has them open, and
+it refuses to run while another process holds the lock.
+
+    python -m backend.bulk interest --rate 0.0125
+    python -m backend.bulk fee --amount 5 --max-balance 1000 --dry-run
+"""
+import argparse
+import sys
+import time
+from . import bank
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("kind", choices=("interest", "fee"))
+    parser.add_argument("--rate", help="interest rate as a fraction of the balance, e.g. 0.0125 for 1.25%%")
+    parser.add_argument("--amount", help="fee per account (never more than its balance)")
+    parser.add_argument("--min-balance", help="only change accounts with at least this balance")
+    parser.add_argument("--max-balance", help="only change accounts with at most this balance")
+    parser.add_argument("--dry-run", action="store_true", help="print the totals without changing anything")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    try:
+        summary = bank.apply_bulk(args.kind, args.rate, args.amount, args.min_balance, args.max_balance, args.dry_run)
+    except ValueError as e:
+        parser.error(str(e))
+    except RuntimeError as e:
+        # The store is open in another process, e.g. the API
+        print(f"{parser.prog}: error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        bank.get_store().close()
+    elapsed = time.perf_counter() - started
+
+    print(f"{'Would apply' if args.dry_run else 'Applied'} {args.kind} to {summary['changed']} of {summary['accounts']} accounts in {elapsed:.2f}s.")
+    print(f"Total balance: {summary['total_before']} -> {summary['total_after']} (change {summary['total_change']}).")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
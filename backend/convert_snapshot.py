@@ -0,0 +1,40 @@
+"""
+Converts a snapshot between the database.json layout and the binary format
+that BANK_SNAPSHOT_FORMAT=binary writes and memory-maps at startup. The journal
+sequence number is kept, so a journal written since the snapshot still applies.
+
+    python -m backend.convert_snapshot to-binary --source database.json --target database.snap
+    python -m backend.convert_snapshot to-json --source database.snap --target database.json
+"""
+import argparse
+import os
+import sys
+from .binary_snapshot import read_binary_snapshot, write_binary_snapshot
+from .store import AccountTable, read_snapshot, write_database_file
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("direction", choices=("to-binary", "to-json"))
+    parser.add_argument("--source", help="snapshot to read (default database.json, or database.snap for to-json)")
+    parser.add_argument("--target", help="snapshot to write (default: the source with the other extension)")
+    args = parser.parse_args(argv)
+
+    if args.direction == "to-binary":
+        source = args.source or "database.json"
+        target = args.target or os.path.splitext(source)[0] + ".snap"
+        snapshot = read_snapshot(source)
+        table, seq = AccountTable.from_snapshot(snapshot), snapshot["seq"]
+        write_binary_snapshot(target, table, seq)
+    else:
+        source = args.source or "database.snap"
+        target = args.target or os.path.splitext(source)[0] + ".json"
+        table, seq = read_binary_snapshot(source)
+        write_database_file(target, table.to_snapshot(seq))
+
+    print(f"Converted {len(table.balances)} accounts from {source} into {target} (journal position {seq}).")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,24 +1,41 @@
-from fastapi import APIRouter, HTTPException
+from decimal import Decimal
+from typing import Optional
+from fastapi import APIRouter, Header, HTTPException
 from pydantic import BaseModel
 from . import bank
+from .idempotency import run_idempotent
+from .money import json_amounts
+from .sessions import SessionError, check_session
 
 router = APIRouter()
 
 class DepositRequest(BaseModel):
     name: str
-    amount: float
+    # Exact decimal amount with at most two decimal places (a JSON number or string)
+    amount: Decimal
 
 @router.post("/deposit")
-async def deposit_funds(request: DepositRequest):
+async def deposit_funds(
+    request: DepositRequest,
+    authorization: Optional[str] = Header(None),
+    idempotency_key: Optional[str] = Header(None),
+):
     """
     Handles depositing funds into a user's account.
+    If a session token is sent, it must belong to the account being credited.
+    With an Idempotency-Key header, retries of the same request return the first response instead of depositing again.
     Returns a success message and the new balance, or an error message on failure.
     """
-    try:
-        new_balance = bank.deposit(request.name, request.amount)
-        return {"message": "Deposit successful.", "new_balance": new_balance}
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
+    async def deposit():
+        try:
+            check_session(authorization, request.name)
+            new_balance = await bank.deposit_async(request.name, request.amount)
+            return {"message": "Deposit successful.", "new_balance": json_amounts(new_balance)}
+        except SessionError as e:
+            raise HTTPException(status_code=401, detail=str(e))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
 
+    return await run_idempotent(idempotency_key, "deposit", request.name, request, authorization, deposit)
@@ -0,0 +1,122 @@
+import asyncio
+import os
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+from .metrics import GaugeFunc
+from .storage import normalize_name
+
+MAX_SUBSCRIBERS = int(os.environ.get("BANK_EVENTS_MAX_SUBSCRIBERS", "10000"))
+# Idle streams get a comment line this often, so dead connections are noticed
+HEARTBEAT_SECONDS = float(os.environ.get("BANK_EVENTS_HEARTBEAT_SECONDS", "15"))
+
+
+class Subscription:
+    """
+    One listener for one account's balance changes.
+
+    It holds at most one undelivered event: a balance is state, so a newer event
+    replaces an older one instead of queueing behind it. A slow consumer therefore
+    costs the same memory as a fast one and simply skips intermediate balances.
+    """
+
+    def __init__(self, name: str, loop: asyncio.AbstractEventLoop, lock: threading.Lock):
+        self.name = name
+        self._loop = loop
+        self._lock = lock
+        self._wake = asyncio.Event()
+        self._pending: Optional[Tuple[int, int]] = None
+        # Highest version handed out or pending; older events arriving late are ignored
+        self._version = -1
+        self._wake_scheduled = False
+        self.coalesced = 0
+
+    def offer(self, cents: int, version: int) -> None:
+        """Called from any thread with an account's new balance and version."""
+        with self._lock:
+            if version <= self._version:
+                return
+            if self._pending is not None:
+                self.coalesced += 1
+            self._pending = (cents, version)
+            self._version = version
+            if self._wake_scheduled:
+                return
+            self._wake_scheduled = True
+        self._loop.call_soon_threadsafe(self._wake.set)
+
+    def skip_through(self, version: int) -> None:
+        """Ignores events up to this version, which the client already has."""
+        with self._lock:
+            self._version = max(self._version, version)
+
+    async def next(self, timeout: float) -> Optional[Tuple[int, int]]:
+        """Waits for the next (balance in cents, version), or returns None after `timeout` seconds."""
+        try:
+            await asyncio.wait_for(self._wake.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        with self._lock:
+            self._wake.clear()
+            self._wake_scheduled = False
+            event, self._pending = self._pending, None
+        return event
+
+
+class Broker:
+    """
+    In-process pub/sub of balance changes, fed by the bank's commit path and
+    read by the streaming endpoint. Subscriptions are indexed by account, so a
+    commit only touches the listeners of the accounts it changed.
+    """
+
+    def __init__(self, max_subscribers: int = MAX_SUBSCRIBERS):
+        self.max_subscribers = max_subscribers
+        self.lock = threading.Lock()
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+        self._count = 0
+
+    def full(self) -> bool:
+        return self._count >= self.max_subscribers
+
+    def subscribe(self, name: str) -> Subscription:
+        subscription = Subscription(name, asyncio.get_running_loop(), self.lock)
+        with self.lock:
+            if self._count >= self.max_subscribers:
+                raise OverflowError("Too many open event streams. Try again later.")
+            self._subscribers.setdefault(normalize_name(name), set()).add(subscription)
+            self._count += 1
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        key = normalize_name(subscription.name)
+        with self.lock:
+            listeners = self._subscribers.get(key)
+            if listeners is None or subscription not in listeners:
+                return
+            listeners.discard(subscription)
+            if not listeners:
+                del self._subscribers[key]
+            self._count -= 1
+
+    def has_subscribers(self, name: str) -> bool:
+        # A dict lookup without the lock: at worst one event goes to a listener that just left
+        return normalize_name(name) in self._subscribers
+
+    def subscribed_names(self) -> List[str]:
+        """The normalized names of the accounts that have listeners."""
+        with self.lock:
+            return list(self._subscribers)
+
+    def publish(self, name: str, cents: int, version: int) -> None:
+        with self.lock:
+            listeners = list(self._subscribers.get(normalize_name(name), ()))
+        for subscription in listeners:
+            subscription.offer(cents, version)
+
+    def __len__(self) -> int:
+        return self._count
+
+
+broker = Broker()
+
+GaugeFunc("bank_event_subscribers", "Open balance event streams.", lambda: len(broker))
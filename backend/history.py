@@ -0,0 +1,313 @@
+import json
+import os
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from json.encoder import encode_basestring_ascii
+from typing import Dict, Any, Callable, List, Optional, Set, Tuple
+from .journal import record_cents, record_items_cents
+from .storage import normalize_name
+
+# The index is checkpointed by compaction once the history has grown this much since the last checkpoint
+CHECKPOINT_BYTES = int(float(os.environ.get("BANK_HISTORY_CHECKPOINT_MB", "64")) * 1024 * 1024)
+CHECKPOINT_VERSION = 1
+
+
+def history_entries(record: Dict[str, Any], balance_after: Callable[[str], int]) -> List[Dict[str, Any]]:
+    """
+    Turns a balance-changing journal record into one statement entry per account
+    movement, in order. `balance_after` returns an account's balance once the
+    whole record is applied; the balance after each movement is worked back from it.
+    """
+    op = record["op"]
+    if op == "deposit":
+        moves = [(record["name"], None, "deposit", record_cents(record))]
+    elif op == "transfer":
+        cents = record_cents(record)
+        moves = [
+            (record["sender"], record["receiver"], "transfer_out", -cents),
+            (record["receiver"], record["sender"], "transfer_in", cents),
+        ]
+    elif op == "batch_transfer":
+        moves = []
+        for receiver_name, cents in record_items_cents(record):
+            moves.append((record["sender"], receiver_name, "transfer_out", -cents))
+            moves.append((receiver_name, record["sender"], "transfer_in", cents))
+        # Receivers on another shard get their entry when the credit arrives there
+        for receiver_name, cents in record.get("outbound_cents", ()):
+            moves.append((record["sender"], receiver_name, "transfer_out", -cents))
+    elif op == "transfer_in":
+        moves = [(record["receiver"], record["sender"], "transfer_in", record["cents"])]
+    elif op == "scheduled_transfers":
+        moves = []
+        for sender, receiver, cents in record["transfers_cents"]:
+            moves.append((sender, receiver, "transfer_out", -cents))
+            moves.append((receiver, sender, "transfer_in", cents))
+        for _, sender, items_cents in record.get("outbound", ()):
+            for receiver, cents in items_cents:
+                moves.append((sender, receiver, "transfer_out", -cents))
+    elif op == "bulk":
+        # Interest or a fee, one entry per account changed. Each account appears
+        # once, so its balance after the record is the balance after its entry.
+        ts = record.get("ts") or time.time()
+        kind = record["kind"]
+        return [
+            {"ts": ts, "account": name, "type": kind, "counterparty": None, "cents": cents, "balance_cents": balance_after(name)}
+            for name, cents in record["changes_cents"]
+        ]
+    else:
+        return []
+
+    totals: Dict[str, int] = {}
+    names: Dict[str, str] = {}
+    for name, _, _, cents in moves:
+        key = normalize_name(name)
+        totals[key] = totals.get(key, 0) + cents
+        names[key] = name
+    running = {key: balance_after(names[key]) - total for key, total in totals.items()}
+
+    ts = record.get("ts") or time.time()
+    entries = []
+    for name, counterparty, kind, cents in moves:
+        key = normalize_name(name)
+        running[key] += cents
+        entries.append({
+            "ts": ts,
+            "account": name,
+            "type": kind,
+            "counterparty": counterparty,
+            "cents": cents,
+            "balance_cents": running[key],
+        })
+    return entries
+
+
+def _entry_lines(entries: List[Dict[str, Any]], seq: int) -> List[bytes]:
+    """
+    The lines json.dumps would write for the entries of one record, without the
+    generic encoder: they share the timestamp and sequence number, so those are
+    formatted once into the line template.
+    """
+    template = '{"ts": %r, "account": %%s, "type": %%s, "counterparty": %%s, "cents": %%d, "balance_cents": %%d, "seq": %d}\n' % (
+        entries[0]["ts"], seq
+    )
+    return [
+        (template % (
+            encode_basestring_ascii(entry["account"]),
+            encode_basestring_ascii(entry["type"]),
+            "null" if entry["counterparty"] is None else encode_basestring_ascii(entry["counterparty"]),
+            entry["cents"],
+            entry["balance_cents"],
+        )).encode()
+        for entry in entries
+    ]
+
+
+class TransactionHistory:
+    """
+    Append-only statement log of the JSON backend, one JSON entry per line.
+
+    Entries are indexed in memory per account: the byte offset, length and
+    timestamp of each of its lines, in order. A page of the newest entries is
+    a slice of that index plus one positioned read per entry, so its cost does
+    not depend on how long the history is; date ranges are a binary search.
+
+    Every entry carries the journal sequence number it came from. Entries are
+    written after their journal record is durable, and appends are not fsynced:
+    after a crash, startup re-derives the entries of journal records that are
+    missing here, and compaction syncs this file before it drops any journal record.
+
+    The index is checkpointed to "<path>.idx" (see checkpoint()), so startup
+    parses only the entries written since the checkpoint, not the whole history.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.checkpoint_path = path + ".idx"
+        self._file = None
+        # Bytes of the history covered by the checkpoint file
+        self._checkpointed = 0
+        self._lock = threading.Lock()
+        # normalized name -> (offsets, lengths, timestamps)
+        self._index: Dict[str, Tuple[array, array, array]] = {}
+        # Sequence numbers present here that the snapshot doesn't cover yet
+        self._recent_seqs: Set[int] = set()
+        # Records up to this sequence number are in the snapshot, so their entries are already here
+        self._snapshot_seq = 0
+
+    def load(self, after_seq: int) -> None:
+        """Opens the history and indexes it. `after_seq` is the sequence number of the snapshot."""
+        with self._lock:
+            self.close()
+            self._index = {}
+            self._recent_seqs = set()
+            self._snapshot_seq = after_seq
+            self._file = open(self.path, "a+b")
+            offset = self._checkpointed = self._load_checkpoint(after_seq)
+            self._file.seek(offset)
+            for line in self._file:
+                if not line.endswith(b"\n"):
+                    # Torn by a crash mid-append; its record is still in the journal
+                    self._file.truncate(offset)
+                    break
+                entry = json.loads(line)
+                self._index_entry(entry, offset, len(line))
+                if entry["seq"] > after_seq:
+                    self._recent_seqs.add(entry["seq"])
+                offset += len(line)
+
+    def _load_checkpoint(self, after_seq: int) -> int:
+        """Loads the checkpointed index, if it matches the history. Returns the offset it covers (0 if none)."""
+        try:
+            with open(self.checkpoint_path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return 0
+        try:
+            header_end = data.index(b"\n")
+            header = json.loads(data[:header_end])
+            covered = header["covered"]
+            # A history that was replaced or cut short since makes the checkpoint useless
+            if header["version"] != CHECKPOINT_VERSION or header["byteorder"] != sys.byteorder:
+                return 0
+            if os.fstat(self._file.fileno()).st_size < covered or (
+                covered and os.pread(self._file.fileno(), 1, covered - 1) != b"\n"
+            ):
+                return 0
+            # The entry count of every account, in key order, then its offsets, lengths and timestamps back to back
+            keys = header["keys"]
+            position = header_end + 1
+            counts = array("q")
+            counts.frombytes(data[position:position + len(keys) * counts.itemsize])
+            position += len(keys) * counts.itemsize
+            total = sum(counts)
+            offsets, lengths, stamps = array("q"), array("I"), array("d")
+            for column in (offsets, lengths, stamps):
+                column.frombytes(data[position:position + total * column.itemsize])
+                position += total * column.itemsize
+            if len(counts) != len(keys) or position != len(data):
+                return 0
+        except (ValueError, KeyError, TypeError):
+            return 0
+        index = {}
+        start = 0
+        for key, count in zip(keys, counts):
+            end = start + count
+            index[key] = (offsets[start:end], lengths[start:end], stamps[start:end])
+            start = end
+        self._index = index
+        self._recent_seqs = {seq for seq in header["recent"] if seq > after_seq}
+        return covered
+
+    def checkpoint(self, force: bool = False) -> None:
+        """
+        Writes the index of every entry so far to the checkpoint file, once the
+        history has grown by CHECKPOINT_BYTES since the last one (or by anything
+        with `force`). Called by compaction, after the snapshot is written.
+        """
+        with self._lock:
+            if self._file is None:
+                return
+            covered = self._file.seek(0, os.SEEK_END)
+            grown = covered - self._checkpointed
+            if grown <= 0 or (not force and grown < CHECKPOINT_BYTES):
+                return
+            # The columns only grow: their first `count` items are what `covered` holds
+            accounts = [(key, columns, len(columns[0])) for key, columns in self._index.items()]
+            # Sequence numbers not yet covered by a snapshot (forget_through drops the others)
+            recent = sorted(self._recent_seqs)
+        # The checkpoint must never point past what is on disk
+        os.fsync(self._file.fileno())
+        header = {
+            "version": CHECKPOINT_VERSION,
+            "byteorder": sys.byteorder,
+            "covered": covered,
+            "recent": recent,
+            "keys": [key for key, _, _ in accounts],
+        }
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(json.dumps(header).encode() + b"\n")
+            f.write(array("q", [count for _, _, count in accounts]).tobytes())
+            for position in range(3):
+                f.writelines(columns[position][:count].tobytes() for _, columns, count in accounts)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+        self._checkpointed = covered
+
+    def _index_entry(self, entry: Dict[str, Any], offset: int, length: int) -> None:
+        key = normalize_name(entry["account"])
+        columns = self._index.get(key)
+        if columns is None:
+            columns = self._index[key] = (array("q"), array("I"), array("d"))
+        offsets, lengths, stamps = columns
+        offsets.append(offset)
+        lengths.append(length)
+        # Kept non-decreasing (the clock can step back) so date ranges can be bisected
+        stamps.append(max(entry["ts"], stamps[-1]) if stamps else entry["ts"])
+
+    def add(self, record: Dict[str, Any], balance_after: Callable[[str], int]) -> None:
+        """Appends the entries of a journal record, unless they are already here."""
+        with self._lock:
+            # A writer can get here after compaction already folded its record (and added its entries)
+            if record["seq"] <= self._snapshot_seq or record["seq"] in self._recent_seqs:
+                return
+            self._recent_seqs.add(record["seq"])
+            entries = history_entries(record, balance_after)
+            if not entries:
+                return
+            lines = _entry_lines(entries, record["seq"])
+            self._file.seek(0, os.SEEK_END)
+            offset = self._file.tell()
+            self._file.write(b"".join(lines))
+            self._file.flush()
+            # Indexed only once written, so page() never reads past the end of the file
+            for entry, line in zip(entries, lines):
+                self._index_entry(entry, offset, len(line))
+                offset += len(line)
+
+    def sync(self) -> None:
+        """Makes every entry written so far durable."""
+        with self._lock:
+            if self._file is not None:
+                os.fsync(self._file.fileno())
+
+    def forget_through(self, seq: int) -> None:
+        """Drops the dedup state of records now covered by the snapshot; add() skips them from now on."""
+        with self._lock:
+            self._snapshot_seq = max(self._snapshot_seq, seq)
+            self._recent_seqs = {recent for recent in self._recent_seqs if recent > seq}
+
+    def page(
+        self, name: str, before: Optional[int], start: Optional[float], end: Optional[float], limit: int
+    ) -> List[Dict[str, Any]]:
+        """
+        Returns up to `limit` entries of an account, newest first. Each entry's
+        "id" is its position in the account's history; `before` continues below it.
+        `start` and `end` bound the timestamps (inclusive).
+        """
+        columns = self._index.get(normalize_name(name))
+        if columns is None:
+            return []
+        offsets, lengths, stamps = columns
+        # Read once: appends only ever grow the arrays
+        count = len(stamps)
+        low = bisect_left(stamps, start, 0, count) if start is not None else 0
+        high = bisect_right(stamps, end, 0, count) if end is not None else count
+        if before is not None:
+            high = min(high, before)
+        fd = self._file.fileno()
+        entries = []
+        for position in range(high - 1, max(low, high - limit) - 1, -1):
+            entry = json.loads(os.pread(fd, lengths[position], offsets[position]))
+            entry["id"] = position
+            entries.append(entry)
+        return entries
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,108 @@
+import asyncio
+import hashlib
+import json
+import os
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from .cache import TTLCache
+from .sessions import check_session
+from .storage import normalize_name
+
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get("BANK_IDEMPOTENCY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_MAX_ENTRIES = int(os.environ.get("BANK_IDEMPOTENCY_MAX_ENTRIES", "100000"))
+MAX_KEY_LENGTH = 255
+
+
+class _Entry:
+    """The outcome of the first request with a key: pending until it completes."""
+
+    def __init__(self, fingerprint: str):
+        self.fingerprint = fingerprint
+        self.result: "asyncio.Future[Tuple[int, Any]]" = asyncio.get_running_loop().create_future()
+
+
+class IdempotencyStore:
+    """
+    Bounded map of idempotency keys to the response of the first request that used them.
+
+    Entries expire IDEMPOTENCY_TTL_SECONDS after they are created, and the least
+    recently used one is evicted when the store is full. A duplicate that arrives
+    while the original is still running waits for its response. Entries are
+    scoped by endpoint and account, so two clients can't collide on a key.
+    """
+
+    def __init__(self, ttl: float = IDEMPOTENCY_TTL_SECONDS, max_entries: int = IDEMPOTENCY_MAX_ENTRIES):
+        self._entries: TTLCache[_Entry] = TTLCache(ttl, max_entries)
+
+    async def run(
+        self,
+        key: Tuple[str, ...],
+        fingerprint: str,
+        operation: Callable[[], Awaitable[Dict[str, Any]]],
+    ) -> JSONResponse:
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry.fingerprint != fingerprint:
+                raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request.")
+            # shield: a client disconnecting from the duplicate must not cancel the shared result
+            status, body = await asyncio.shield(entry.result)
+            return JSONResponse(status_code=status, content=body, headers={"Idempotent-Replayed": "true"})
+
+        # No await between the lookup and this insert, so only one request can become the original
+        entry = _Entry(fingerprint)
+        self._entries.set(key, entry)
+        try:
+            status, body = 200, jsonable_encoder(await operation())
+        except HTTPException as e:
+            status, body = e.status_code, {"detail": jsonable_encoder(e.detail)}
+        except BaseException as e:
+            # Unexpected failure (or cancellation): let waiting duplicates and later retries try again
+            self._entries.pop(key)
+            entry.result.set_exception(e)
+            entry.result.exception()  # Marks it retrieved when no duplicate is waiting
+            raise
+        if status == 401 or status >= 500:
+            # Nothing was applied (bad session) or the outcome is unknown: a retry runs for real
+            self._entries.pop(key)
+        entry.result.set_result((status, body))
+        return JSONResponse(status_code=status, content=body)
+
+
+idempotency = IdempotencyStore()
+
+
+def request_fingerprint(request: BaseModel) -> str:
+    """A hash of the request body, so a key reused for a different request is detected."""
+    payload = json.dumps(jsonable_encoder(request), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+async def run_idempotent(
+    idempotency_key: Optional[str],
+    endpoint: str,
+    name: str,
+    request: BaseModel,
+    authorization: Optional[str],
+    operation: Callable[[], Awaitable[Dict[str, Any]]],
+):
+    """
+    Runs an endpoint's operation at most once per Idempotency-Key and returns its
+    response; replays return the stored response without touching storage.
+    Without a key the operation simply runs.
+    """
+    if idempotency_key is None:
+        return await operation()
+    if not 0 < len(idempotency_key) <= MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters.")
+    # A replay must be as authenticated as the original: a session token is checked
+    # up front (it costs no storage access); a PIN is part of the fingerprint
+    if authorization is not None:
+        try:
+            check_session(authorization, name)
+        except ValueError as e:
+            raise HTTPException(status_code=401, detail=str(e))
+    key = (endpoint, normalize_name(name), idempotency_key)
+    return await idempotency.run(key, request_fingerprint(request), operation)
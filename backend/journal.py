@@ -0,0 +1,203 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+from .metrics import BYTES_WRITTEN, JOURNAL_WRITE_SECONDS
+from .money import to_cents
+
+# Group commit batches concurrent journal writes into a single fsync
+GROUP_COMMIT = os.environ.get("BANK_GROUP_COMMIT", "0") == "1"
+GROUP_COMMIT_WINDOW_MS = float(os.environ.get("BANK_GROUP_COMMIT_WINDOW_MS", "2"))
+GROUP_COMMIT_MAX_BATCH = int(os.environ.get("BANK_GROUP_COMMIT_MAX_BATCH", "64"))
+
+
+def read_records(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Yields the records stored in a journal file, oldest first.
+
+    A torn last line (from a crash in the middle of an append) is ignored:
+    that record was never acknowledged to the caller.
+    """
+    try:
+        f = open(path, "r")
+    except FileNotFoundError:
+        return
+    with f:
+        for line in f:
+            if not line.endswith("\n"):
+                break
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                break
+
+
+# Journal records carry integer cents. Records written before balances were
+# kept in cents have a decimal "amount" / "items" instead.
+
+def record_cents(record: Dict[str, Any]) -> int:
+    return record["cents"] if "cents" in record else to_cents(record["amount"])
+
+
+def record_items_cents(record: Dict[str, Any]) -> List[Tuple[str, int]]:
+    if "items_cents" in record:
+        return record["items_cents"]
+    return [(name, to_cents(amount)) for name, amount in record["items"]]
+
+
+class Journal:
+    """
+    Append-only log of deposit and transfer records, one JSON object per line.
+
+    Every record gets an increasing sequence number and is flushed to disk
+    before its future completes, so an acknowledged operation survives a crash.
+
+    In group-commit mode, records submitted within GROUP_COMMIT_WINDOW_MS of
+    each other (up to GROUP_COMMIT_MAX_BATCH of them) are written by a
+    background flusher with a single write and fsync.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        group_commit: bool = GROUP_COMMIT,
+        window_ms: float = GROUP_COMMIT_WINDOW_MS,
+        max_batch: int = GROUP_COMMIT_MAX_BATCH,
+    ):
+        self.path = path
+        self.group_commit = group_commit
+        self.window = window_ms / 1000
+        self.max_batch = max(1, max_batch)
+        # `lock` orders records (sequence numbers, pending queue), `_write_lock`
+        # guards the file itself. When both are needed, `lock` is taken first.
+        self.lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._cond = threading.Condition(self.lock)
+        self._pending: List[Tuple[int, str, Future]] = []
+        self._flusher: Optional[threading.Thread] = None
+        self._closing = False
+        self._file = None
+        self.last_seq = 0
+        self.records_since_rotation = 0
+        self.batches_written = 0
+        self.records_written = 0
+
+    def open(self, last_seq: int) -> None:
+        """Opens the journal for appending, continuing after the given sequence number."""
+        with self.lock:
+            self.last_seq = last_seq
+            self.records_since_rotation = self._truncate_torn_tail()
+            self._file = open(self.path, "a")
+            self._closing = False
+            if self.group_commit:
+                self._flusher = threading.Thread(target=self._run_flusher, name="journal-flusher", daemon=True)
+                self._flusher.start()
+
+    def _truncate_torn_tail(self) -> int:
+        # Drop a partial last line so new records don't get glued onto it,
+        # and return how many complete records are already in the file
+        try:
+            with open(self.path, "rb+") as f:
+                content = f.read()
+                end = content.rfind(b"\n") + 1
+                if end != len(content):
+                    f.truncate(end)
+                return content.count(b"\n")
+        except FileNotFoundError:
+            return 0
+
+    def close(self) -> None:
+        """Writes any pending records and closes the journal."""
+        with self.lock:
+            self._closing = True
+            self._cond.notify()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+        with self._write_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def submit(self, record: Dict[str, Any]) -> Future:
+        """
+        Queues a record for appending and returns a future that completes with
+        its sequence number once the record is on disk.
+        """
+        future: Future = Future()
+        with self.lock:
+            seq = self.last_seq + 1
+            self.last_seq = seq
+            entry = (seq, json.dumps(dict(record, seq=seq)) + "\n", future)
+            if self.group_commit:
+                self._pending.append(entry)
+                self._cond.notify()
+                return future
+            self._write_batch([entry])
+        return future
+
+    def append(self, record: Dict[str, Any]) -> int:
+        """Durably appends a record and returns its sequence number."""
+        return self.submit(record).result()
+
+    def _run_flusher(self) -> None:
+        while True:
+            with self.lock:
+                while not self._pending and not self._closing:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                # Give concurrent writers a short window to join this batch
+                deadline = time.monotonic() + self.window
+                while len(self._pending) < self.max_batch and not self._closing:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._pending[:self.max_batch]
+                del self._pending[:self.max_batch]
+            self._write_batch(batch)
+
+    def _write_batch(self, batch: List[Tuple[int, str, Future]]) -> None:
+        payload = "".join(line for _, line, _ in batch)
+        with self._write_lock:
+            try:
+                with JOURNAL_WRITE_SECONDS.time():
+                    self._file.write(payload)
+                    self._file.flush()
+                    os.fsync(self._file.fileno())
+                BYTES_WRITTEN.inc(len(payload.encode()), file="journal")
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+                return
+            self.records_since_rotation += len(batch)
+            self.batches_written += 1
+            self.records_written += len(batch)
+        for seq, _, future in batch:
+            future.set_result(seq)
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns write counters, including the average number of records per fsync."""
+        return {
+            "group_commit": self.group_commit,
+            "batches_written": self.batches_written,
+            "records_written": self.records_written,
+            "average_batch_size": self.records_written / self.batches_written if self.batches_written else 0.0,
+        }
+
+    def rotate(self, rotated_path: str) -> Optional[str]:
+        """
+        Moves the current journal aside and starts a new, empty one.
+        Returns the path of the rotated file, or None if there was nothing to rotate.
+        """
+        with self._write_lock:
+            if self.records_since_rotation == 0:
+                return None
+            self._file.close()
+            os.replace(self.path, rotated_path)
+            self._file = open(self.path, "a")
+            self.records_since_rotation = 0
+            return rotated_path
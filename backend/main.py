@@ -1,14 +1,39 @@
-from fastapi import FastAPI, Response
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.routing import APIRoute
+from . import bank
+from . import metrics
+from . import profiling
 from . import authenticate_endpoint
 from . import deposit_endpoint
 from . import transfer_endpoint
 from . import user_endpoint
+from . import account_endpoint
+from . import admin_endpoint
+from .scheduler import SCHEDULER_ENABLED, scheduler
+from .sessions import SessionError, check_admin
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the accounts once at startup so the first request doesn't pay for it
+    bank.get_store().load()
+    if SCHEDULER_ENABLED:
+        # Runs missed while the API was down are due right away
+        scheduler.load(bank.get_store().schedules())
+        scheduler.start(bank.run_scheduled_transfers_async)
+    yield
+    await scheduler.stop()
+    # Fold the journal into database.json on a clean shutdown
+    bank.get_store().close()
 
 app = FastAPI(
     title="Banking System API",
     description="API for a simple banking system with authentication, deposit, and transfer functionalities.",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 # Add CORS middleware
@@ -22,10 +47,75 @@ app.add_middleware(
 )
 
 # Include the routers from the respective endpoint files
-app.include_router(authenticate_endpoint.router, prefix="/api/v1", tags=["Authentication"])
-app.include_router(deposit_endpoint.router, prefix="/api/v1", tags=["Transactions"])
-app.include_router(transfer_endpoint.router, prefix="/api/v1", tags=["Transactions"])
-app.include_router(user_endpoint.router, prefix="/api/v1", tags=["Users"])
+API_PREFIX = "/api/v1"
+ROUTERS = [
+    (authenticate_endpoint.router, "Authentication"),
+    (deposit_endpoint.router, "Transactions"),
+    (transfer_endpoint.router, "Transactions"),
+    (user_endpoint.router, "Users"),
+    (account_endpoint.router, "Accounts"),
+    (admin_endpoint.router, "Admin"),
+]
+for router, tag in ROUTERS:
+    app.include_router(router, prefix=API_PREFIX, tags=[tag])
+
+# Metric labels per endpoint function: the router's tag (e.g. "transactions") and the full route path
+_route_labels = {
+    route.endpoint: (tag.lower(), API_PREFIX + route.path)
+    for router, tag in ROUTERS
+    for route in router.routes
+    if isinstance(route, APIRoute)
+}
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Counts every request and records its latency, labelled by router (tag) and route."""
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        router, route = _route_labels.get(request.scope.get("endpoint")) or (
+            "other", getattr(request.scope.get("route"), "path", "unmatched")
+        )
+        metrics.HTTP_REQUESTS.inc(router=router, route=route, method=request.method, status=str(status))
+        metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, router=router, route=route)
+
+@app.middleware("http")
+async def profile_requests(request: Request, call_next):
+    """
+    Samples the stacks of requests selected for profiling (see backend/profiling.py):
+    those sending "X-Bank-Profile: <admin token>", a random BANK_PROFILE_SAMPLE_RATE
+    share, or, with BANK_PROFILE_SLOW_MS set, any request that turns out slower than that.
+    """
+    forced = False
+    if profiling.PROFILE_HEADER in request.headers:
+        try:
+            check_admin(request.headers[profiling.PROFILE_HEADER])
+            forced = True
+        except SessionError:
+            pass
+    reason = profiling.select(forced)
+    if reason is None:
+        return await call_next(request)
+    profile = profiling.begin(request.method, request.url.path, reason)
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        record = profiling.finish(profile, status, time.perf_counter() - started)
+        if record is not None:
+            await asyncio.get_running_loop().run_in_executor(None, profiling.save, record)
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Exposes request and storage metrics in the Prometheus text format."""
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4")
 
 @app.get("/favicon.ico", include_in_schema=False)
 async def favicon():
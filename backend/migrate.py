@@ -0,0 +1,57 @@
+"""
+Imports an existing database.json (including any journal written since its
+last snapshot) into a SQLite database for the sqlite storage backend, or into
+a shard directory for the sharded backend. Accounts and scheduled transfers are
+imported; statement history is not. The source is only read, and not while
+another process (e.g. the API) has it open.
+
+    python -m backend.migrate --source database.json --target bank.sqlite3
+    BANK_SHARDS=8 python -m backend.migrate --backend sharded --target shards
+"""
+import argparse
+import sys
+from .sharded_store import ShardedStore
+from .sqlite_store import SqliteStore
+from .storage import SHARD_DIR, SQLITE_FILE
+from .store import AccountStore
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", default="database.json", help="JSON database to import")
+    parser.add_argument("--backend", choices=("sqlite", "sharded"), default="sqlite", help="storage backend to import into")
+    parser.add_argument("--target", help=f"SQLite database to create or update (default {SQLITE_FILE}), "
+                        f"or shard directory to replace (default {SHARD_DIR})")
+    args = parser.parse_args(argv)
+    target_path = args.target or (SHARD_DIR if args.backend == "sharded" else SQLITE_FILE)
+
+    try:
+        table, _ = AccountStore(args.source).read()
+    except RuntimeError as e:
+        # The source is open in another process, e.g. the API
+        print(f"{parser.prog}: error: {e}", file=sys.stderr)
+        return 1
+    users = table.to_users()
+    schedules = table.all_schedules()
+
+    if args.backend == "sharded":
+        target = ShardedStore(target_path)
+        target.replace({"users": users})
+    else:
+        target = SqliteStore(target_path)
+        target.import_users(users)
+    # Those imported by an earlier run are already there
+    present = {schedule["id"] for schedule in target.schedules()}
+    new_schedules = [schedule for schedule in schedules if schedule["id"] not in present]
+    for schedule in new_schedules:
+        target.add_schedule(schedule)
+    count = len(target.names())
+    target.close()
+
+    print(f"Imported {len(users)} accounts and {len(new_schedules)} scheduled transfers from {args.source} "
+          f"into {target_path} ({count} accounts in total).")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,65 @@
+from decimal import Decimal, InvalidOperation
+from typing import Any, Union
+
+Amount = Union[Decimal, int, float, str]
+
+CENTS = Decimal("0.01")
+# Keeps every balance, and sums of them, well inside a signed 64-bit integer
+MAX_CENTS = 10 ** 17
+
+
+def to_cents(amount: Amount) -> int:
+    """
+    Converts an amount in major units (e.g. dollars) to integer cents.
+    Floats are read through their shortest repr, so 10.1 is exactly 1010 cents.
+    Raises ValueError for amounts with more than two decimal places.
+    """
+    try:
+        value = amount if isinstance(amount, Decimal) else Decimal(str(amount))
+    except InvalidOperation:
+        raise ValueError(f"Invalid amount: {amount}")
+    if not value.is_finite():
+        raise ValueError(f"Invalid amount: {amount}")
+    if abs(value) * 100 > MAX_CENTS:
+        raise ValueError("Amount is too large.")
+    if value != value.quantize(CENTS):
+        raise ValueError("Amount cannot have more than two decimal places.")
+    return int(value * 100)
+
+
+def from_cents(cents: int) -> Decimal:
+    """Converts integer cents to an exact Decimal amount in major units."""
+    return (Decimal(cents) / 100).quantize(CENTS)
+
+
+# A float prints back as the same decimal value only up to 15 significant digits
+FLOAT_EXACT_CENTS = 10 ** 15
+
+
+def to_json_number(cents: int) -> Union[int, float, str]:
+    """
+    Returns a JSON-serializable amount in major units. Below FLOAT_EXACT_CENTS the
+    float for a whole number of cents prints back as the same two-decimal value;
+    larger amounts with a fraction are written as an exact decimal string, which
+    to_cents reads back like a number.
+    """
+    if cents % 100 == 0:
+        return cents // 100
+    if abs(cents) < FLOAT_EXACT_CENTS:
+        return cents / 100
+    return str(from_cents(cents))
+
+
+def json_amounts(content: Any) -> Any:
+    """
+    Returns an API response with every Decimal amount (from from_cents), also in
+    nested dicts and lists, replaced by its to_json_number value. jsonable_encoder
+    would turn them into floats, which round amounts above FLOAT_EXACT_CENTS.
+    """
+    if isinstance(content, Decimal):
+        return to_json_number(int(content * 100))
+    if isinstance(content, dict):
+        return {key: json_amounts(value) for key, value in content.items()}
+    if isinstance(content, (list, tuple)):
+        return [json_amounts(value) for value in content]
+    return content
@@ -0,0 +1,65 @@
+import base64
+import hashlib
+import hmac
+import os
+from .cache import TTLCache
+
+# scrypt cost parameters: roughly 50-100 ms of CPU per hash
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+HASH_PREFIX = "scrypt$"
+
+# How long a successful PIN check is remembered, so repeated logins skip the hash
+VERIFY_CACHE_TTL_SECONDS = int(os.environ.get("BANK_PIN_CACHE_TTL_SECONDS", "60"))
+VERIFY_CACHE_MAX_ENTRIES = int(os.environ.get("BANK_PIN_CACHE_MAX_ENTRIES", "10000"))
+
+_verified: TTLCache[bool] = TTLCache(VERIFY_CACHE_TTL_SECONDS, VERIFY_CACHE_MAX_ENTRIES)
+
+
+def _scrypt(pin: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(pin.encode(), salt=salt, n=n, r=r, p=p, dklen=32)
+
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode()
+
+
+def hash_pin(pin: str) -> str:
+    """Returns a salted scrypt hash of a PIN, as stored in pin_number."""
+    salt = os.urandom(16)
+    digest = _scrypt(pin, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return f"{HASH_PREFIX}{SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64(salt)}${_b64(digest)}"
+
+
+def is_hashed(stored: str) -> bool:
+    """Whether a stored pin_number is a hash (anything else is a legacy plaintext PIN)."""
+    return stored.startswith(HASH_PREFIX)
+
+
+def _cache_key(stored: str, pin: str) -> bytes:
+    # Keyed by the stored value too, so changing a PIN invalidates old entries
+    return hashlib.sha256(f"{stored}\0{pin}".encode()).digest()
+
+
+def is_verified(stored: str, pin: str) -> bool:
+    """Whether this PIN was checked against this stored value recently. Costs no hashing."""
+    return _verified.get(_cache_key(stored, pin)) is not None
+
+
+def verify_pin(stored: str, pin: str) -> bool:
+    """
+    Checks a PIN against a stored pin_number (hash or legacy plaintext).
+    This is CPU heavy for hashes; callers on the event loop should run it in a pool.
+    """
+    if is_verified(stored, pin):
+        return True
+    if is_hashed(stored):
+        n, r, p, salt, digest = stored[len(HASH_PREFIX):].split("$")
+        candidate = _scrypt(pin, base64.b64decode(salt), int(n), int(r), int(p))
+        ok = hmac.compare_digest(candidate, base64.b64decode(digest))
+    else:
+        ok = hmac.compare_digest(stored.encode(), pin.encode())
+    if ok:
+        _verified.set(_cache_key(stored, pin), True)
+    return ok
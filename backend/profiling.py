@@ -0,0 +1,229 @@
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+# Off by default; can also be switched on at runtime through PUT /api/v1/admin/profiling
+PROFILING_ENABLED = os.environ.get("BANK_PROFILING", "0") == "1"
+# Fraction of requests profiled at random (0 = none)
+PROFILE_SAMPLE_RATE = float(os.environ.get("BANK_PROFILE_SAMPLE_RATE", "0"))
+# Keep the profile of any request slower than this (0 = off). Every request is sampled while this is set.
+PROFILE_SLOW_MS = float(os.environ.get("BANK_PROFILE_SLOW_MS", "0"))
+PROFILE_INTERVAL_MS = float(os.environ.get("BANK_PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.environ.get("BANK_PROFILE_DIR", "profiles")
+PROFILE_MAX_FILES = int(os.environ.get("BANK_PROFILE_MAX_FILES", "50"))
+# Requests sending this header are always profiled
+PROFILE_HEADER = "x-bank-profile"
+
+_ID_PATTERN = re.compile(r"^[0-9]+-[0-9]+$")
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def _is_idle(frame) -> bool:
+    # Pool and flusher threads parked on a condition variable carry no information
+    return frame.f_code.co_name == "wait" and frame.f_code.co_filename.endswith("threading.py")
+
+
+class Profile:
+    """Stack samples collected while one request was in flight."""
+
+    def __init__(self, method: str, path: str, reason: str):
+        self.method = method
+        self.path = path
+        self.reason = reason
+        self.started_at = time.time()
+        self.stacks: Counter = Counter()
+        self.samples = 0
+
+
+class Sampler:
+    """
+    A wall-clock sampling profiler. While at least one profile is active, a
+    background thread snapshots the stack of every thread each interval and adds
+    it, in collapsed-stack form ("thread;outer;...;inner"), to every active profile.
+
+    Sampling all threads (not just the event loop) is what makes the profiles
+    useful here: deposits and transfers run on the bank-io pool, and snapshot
+    writes run on the compaction thread.
+    """
+
+    def __init__(self, interval_ms: float = PROFILE_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self._active: List[Profile] = []
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, profile: Profile) -> None:
+        with self._lock:
+            self._active.append(profile)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="bank-profiler", daemon=True)
+                self._thread.start()
+            self._wake.notify()
+
+    def stop(self, profile: Profile) -> None:
+        with self._lock:
+            self._active.remove(profile)
+
+    def _run(self) -> None:
+        own_ident = threading.get_ident()
+        while True:
+            with self._lock:
+                while not self._active:
+                    self._wake.wait()
+                active = list(self._active)
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stacks = []
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident or (_is_idle(frame) and names.get(ident) != "MainThread"):
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                labels.append(names.get(ident, str(ident)))
+                stacks.append(";".join(reversed(labels)))
+            for profile in active:
+                profile.stacks.update(stacks)
+                profile.samples += 1
+            time.sleep(self.interval)
+
+
+_sampler = Sampler()
+_next_id = 0
+_id_lock = threading.Lock()
+
+
+def settings() -> Dict[str, Any]:
+    return {
+        "enabled": PROFILING_ENABLED,
+        "sample_rate": PROFILE_SAMPLE_RATE,
+        "slow_ms": PROFILE_SLOW_MS,
+        "interval_ms": _sampler.interval * 1000,
+        "max_files": PROFILE_MAX_FILES,
+    }
+
+
+def configure(enabled: Optional[bool] = None, sample_rate: Optional[float] = None, slow_ms: Optional[float] = None) -> Dict[str, Any]:
+    """Changes the profiling settings at runtime. Returns the new settings."""
+    global PROFILING_ENABLED, PROFILE_SAMPLE_RATE, PROFILE_SLOW_MS
+    if sample_rate is not None and not 0 <= sample_rate <= 1:
+        raise ValueError("sample_rate must be between 0 and 1.")
+    if slow_ms is not None and slow_ms < 0:
+        raise ValueError("slow_ms cannot be negative.")
+    if enabled is not None:
+        PROFILING_ENABLED = enabled
+    if sample_rate is not None:
+        PROFILE_SAMPLE_RATE = sample_rate
+    if slow_ms is not None:
+        PROFILE_SLOW_MS = slow_ms
+    return settings()
+
+
+def select(forced: bool) -> Optional[str]:
+    """Why a request should be sampled ("header", "sampled" or "slow"), or None to skip it."""
+    if not PROFILING_ENABLED:
+        return None
+    if forced:
+        return "header"
+    if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        return "sampled"
+    if PROFILE_SLOW_MS:
+        return "slow"
+    return None
+
+
+def begin(method: str, path: str, reason: str) -> Profile:
+    profile = Profile(method, path, reason)
+    _sampler.start(profile)
+    return profile
+
+
+def finish(profile: Profile, status: int, duration: float) -> Optional[Dict[str, Any]]:
+    """
+    Stops sampling a request. Returns the profile to save, or None when it was
+    only sampled for the latency threshold and turned out to be fast.
+    """
+    global _next_id
+    _sampler.stop(profile)
+    duration_ms = duration * 1000
+    if profile.reason == "slow" and duration_ms < PROFILE_SLOW_MS:
+        return None
+    with _id_lock:
+        _next_id += 1
+        profile_id = f"{int(profile.started_at * 1000)}-{_next_id}"
+    return {
+        "id": profile_id,
+        "method": profile.method,
+        "path": profile.path,
+        "status": status,
+        "reason": profile.reason,
+        "started_at": profile.started_at,
+        "duration_ms": round(duration_ms, 3),
+        "interval_ms": _sampler.interval * 1000,
+        "samples": profile.samples,
+        "stacks": dict(profile.stacks.most_common()),
+    }
+
+
+def save(record: Dict[str, Any]) -> None:
+    """Writes a profile to PROFILE_DIR, deleting the oldest ones beyond PROFILE_MAX_FILES."""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    with open(os.path.join(PROFILE_DIR, record["id"] + ".json"), "w") as f:
+        json.dump(record, f)
+    files = sorted(_profile_files(), key=_sort_key)
+    for name in files[:max(0, len(files) - PROFILE_MAX_FILES)]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, name))
+        except FileNotFoundError:
+            pass
+
+
+def _profile_files() -> List[str]:
+    try:
+        return [name for name in os.listdir(PROFILE_DIR) if _ID_PATTERN.match(name[:-5]) and name.endswith(".json")]
+    except FileNotFoundError:
+        return []
+
+
+def _sort_key(name: str):
+    started, _, seq = name[:-5].partition("-")
+    return int(started), int(seq)
+
+
+def list_profiles() -> List[Dict[str, Any]]:
+    """Summaries of the stored profiles, newest first."""
+    summaries = []
+    for name in sorted(_profile_files(), key=_sort_key, reverse=True):
+        try:
+            record = load(name[:-5])
+        except ValueError:
+            continue
+        record.pop("stacks")
+        summaries.append(record)
+    return summaries
+
+
+def load(profile_id: str) -> Dict[str, Any]:
+    if not _ID_PATTERN.match(profile_id):
+        raise ValueError(f"Profile '{profile_id}' not found.")
+    try:
+        with open(os.path.join(PROFILE_DIR, profile_id + ".json")) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        raise ValueError(f"Profile '{profile_id}' not found.")
+
+
+def to_folded(record: Dict[str, Any]) -> str:
+    """Renders a profile as collapsed stacks, the input format of flamegraph.pl and speedscope."""
+    return "".join(f"{stack} {count}\n" for stack, count in record["stacks"].items())
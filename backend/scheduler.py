@@ -0,0 +1,108 @@
+import asyncio
+import heapq
+import os
+import threading
+import time
+from typing import Dict, Any, Awaitable, Callable, Iterable, List, Optional, Tuple
+from .metrics import GaugeFunc
+
+# Run scheduled transfers inside the API process (set to 0 in extra workers of the same data)
+SCHEDULER_ENABLED = os.environ.get("BANK_SCHEDULER", "1") == "1"
+# How often due transfers are looked for, in seconds
+TICK_SECONDS = float(os.environ.get("BANK_SCHEDULER_TICK_SECONDS", "1"))
+# Most runs handed to the storage in one atomic batch
+MAX_BATCH = int(os.environ.get("BANK_SCHEDULER_MAX_BATCH", "10000"))
+
+
+class Scheduler:
+    """
+    Next due time of every scheduled transfer, in a heap, and the asyncio task
+    that hands the due ones to the bank in batches.
+
+    The heap only decides when to try: the storage checks each run against the
+    schedule it has persisted (see plan_schedule_runs), so a stale entry, e.g. of
+    a cancelled schedule or one that already ran before a restart, does nothing.
+    A schedule runs at most once per tick, so one that missed several occurrences
+    (while the API was down) catches up on them one tick at a time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (due, schedule id, sender)
+        self._heap: List[Tuple[float, str, str]] = []
+        self._task: Optional[asyncio.Task] = None
+        self._stopping: Optional[asyncio.Event] = None
+
+    def add(self, schedule: Dict[str, Any]) -> None:
+        """Queues a schedule's next run, unless it is finished."""
+        if schedule["next_due"] is None:
+            return
+        with self._lock:
+            heapq.heappush(self._heap, (schedule["next_due"], schedule["id"], schedule["sender"]))
+
+    def load(self, schedules: Iterable[Dict[str, Any]]) -> None:
+        """Replaces the queue with the next runs of these schedules (at startup)."""
+        heap = [
+            (schedule["next_due"], schedule["id"], schedule["sender"])
+            for schedule in schedules if schedule["next_due"] is not None
+        ]
+        heapq.heapify(heap)
+        with self._lock:
+            self._heap = heap
+
+    def due(self, now: float, limit: int) -> List[Dict[str, Any]]:
+        """Takes up to `limit` runs due by `now` off the queue, earliest first."""
+        runs = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now and len(runs) < limit:
+                due, schedule_id, sender = heapq.heappop(self._heap)
+                runs.append({"id": schedule_id, "sender": sender, "due": due})
+        return runs
+
+    def start(self, run: Callable[[List[Dict[str, Any]]], Awaitable[List[Dict[str, Any]]]]) -> None:
+        """Starts running due transfers on the current event loop through `run`."""
+        self._stopping = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run_due(run))
+
+    async def stop(self) -> None:
+        """Stops after the batch in progress, if any, is committed."""
+        if self._task is None:
+            return
+        self._stopping.set()
+        await self._task
+        self._task = None
+
+    async def _run_due(self, run: Callable[[List[Dict[str, Any]]], Awaitable[List[Dict[str, Any]]]]) -> None:
+        while not self._stopping.is_set():
+            await self.tick(run, time.time())
+            try:
+                await asyncio.wait_for(self._stopping.wait(), TICK_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    async def tick(self, run: Callable[[List[Dict[str, Any]]], Awaitable[List[Dict[str, Any]]]], now: float) -> None:
+        """Hands everything due by `now` to `run`, in batches of up to MAX_BATCH, running each schedule once."""
+        ran_this_tick = []
+        runs = self.due(now, MAX_BATCH)
+        while runs:
+            try:
+                ran = await run(runs)
+            except Exception:
+                # Queued again and retried on the next tick; the storage keeps runs from paying twice
+                for entry in runs:
+                    self.add({"id": entry["id"], "sender": entry["sender"], "next_due": entry["due"]})
+                break
+            ran_this_tick.extend(ran)
+            # After a full batch, what is still due runs without waiting for the next tick
+            runs = self.due(now, MAX_BATCH) if len(runs) == MAX_BATCH else []
+        # Queued again only now, so a missed occurrence that is already due waits for the next tick
+        for schedule in ran_this_tick:
+            self.add(schedule)
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+
+scheduler = Scheduler()
+
+GaugeFunc("bank_scheduled_transfers_queued", "Scheduled transfer runs waiting in the scheduler.", lambda: len(scheduler))
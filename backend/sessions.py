@@ -0,0 +1,78 @@
+import hmac
+import os
+import secrets
+from typing import Optional
+from .cache import TTLCache
+
+SESSION_TTL_SECONDS = int(os.environ.get("BANK_SESSION_TTL_SECONDS", "900"))
+SESSION_MAX_ENTRIES = int(os.environ.get("BANK_SESSION_MAX_ENTRIES", "100000"))
+# Shared secret for the /api/v1/admin endpoints; they are disabled while it is empty
+ADMIN_TOKEN = os.environ.get("BANK_ADMIN_TOKEN", "")
+
+
+class SessionError(ValueError):
+    """Raised when a session token is missing, unknown, expired or for another account."""
+
+
+class SessionCache:
+    """
+    Bounded in-memory map of session tokens to account names.
+
+    Tokens expire SESSION_TTL_SECONDS after they are issued. When the cache is
+    full, the least recently used token is evicted (its owner just logs in again).
+    """
+
+    def __init__(self, ttl: float = SESSION_TTL_SECONDS, max_entries: int = SESSION_MAX_ENTRIES):
+        self._tokens: TTLCache[str] = TTLCache(ttl, max_entries)
+
+    def issue(self, name: str) -> str:
+        """Creates a new token for an authenticated account."""
+        token = secrets.token_urlsafe(32)
+        self._tokens.set(token, name)
+        return token
+
+    def resolve(self, token: str) -> Optional[str]:
+        """Returns the account name of a live token, or None."""
+        return self._tokens.get(token)
+
+    def revoke(self, token: str) -> bool:
+        """Forgets a token. Returns whether it existed."""
+        return self._tokens.pop(token) is not None
+
+
+sessions = SessionCache()
+
+
+def bearer_token(authorization: Optional[str]) -> Optional[str]:
+    """Extracts the token from an "Authorization: Bearer <token>" header value."""
+    if not authorization:
+        return None
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token.strip():
+        raise SessionError("Authentication failed: Malformed Authorization header.")
+    return token.strip()
+
+
+def check_session(authorization: Optional[str], name: str) -> bool:
+    """
+    Checks the session in an Authorization header against an account name.
+    Returns False when no header was sent (the caller falls back to a PIN),
+    True when the session is live and belongs to that account, and raises otherwise.
+    """
+    token = bearer_token(authorization)
+    if token is None:
+        return False
+    session_name = sessions.resolve(token)
+    if session_name is None:
+        raise SessionError("Authentication failed: Session expired or invalid. Please log in again.")
+    if session_name.lower() != name.lower():
+        raise SessionError("Authentication failed: Session does not belong to this account.")
+    return True
+
+
+def check_admin(token: Optional[str]) -> None:
+    """Checks an X-Admin-Token header value against BANK_ADMIN_TOKEN."""
+    if not ADMIN_TOKEN:
+        raise SessionError("Admin API is disabled. Set BANK_ADMIN_TOKEN to enable it.")
+    if not token or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise SessionError("Authentication failed: Invalid admin token.")
@@ -0,0 +1,690 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+import uuid
+import zlib
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+from typing import Dict, Any, Callable, Iterator, List, Optional, Set, Tuple
+from .events import broker
+from .metrics import BYTES_WRITTEN, SHARD_FAILURES
+from .storage import (
+    SHARD_COUNT, SHARD_IDS, ShardNotOwnedError, Storage, normalize_name, plan_batch_transfer, plan_schedule_runs,
+)
+from .store import AccountStore, read_table, snapshot_file
+
+# How often credits sent by other processes, and hand-overs that failed, are looked for
+INBOX_POLL_MS = float(os.environ.get("BANK_SHARD_INBOX_POLL_MS", "100"))
+LAYOUT_FILE = "shards.json"
+
+logger = logging.getLogger(__name__)
+
+
+def shard_of(name: str, shard_count: int) -> int:
+    """The shard of an account: a hash of its normalized name that is the same in every process."""
+    return zlib.crc32(normalize_name(name).encode()) % shard_count
+
+
+def _entry_key(entry: Dict[str, Any]) -> Tuple[str, int, bool]:
+    return entry["txid"], entry["index"], entry.get("refund", False)
+
+
+class Inbox:
+    """
+    Credits sent to one shard by transfers from other shards, one JSON entry per line
+    in "shard-<n>.inbox".
+
+    Any process may append (under an exclusive file lock, fsynced before the sending
+    shard records the credit as handed over); only the process serving the shard
+    reads it, in order, and journals how many bytes it has applied, so every entry
+    is applied once. The file is append-only. A sender notes where the inbox ends
+    before it journals a debit; when it sends the credits again (after a crash or
+    a failed append), it looks them up from that position only.
+    """
+
+    def __init__(self, directory: str, shard: int):
+        self.path = os.path.join(directory, f"shard-{shard}.inbox")
+
+    @contextmanager
+    def locked(self) -> Iterator[None]:
+        with open(self.path + ".lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            yield  # Closing the file releases the lock
+
+    @staticmethod
+    def _complete(f) -> int:
+        """Drops a partial last line and returns the size. Called under the lock."""
+        size = f.seek(0, os.SEEK_END)
+        if size and os.pread(f.fileno(), 1, size - 1) != b"\n":
+            # A sender that crashed mid-append left a partial line; it never counted as sent
+            f.seek(0)
+            f.truncate(f.read().rfind(b"\n") + 1)
+            size = f.seek(0, os.SEEK_END)
+        return size
+
+    def end(self) -> int:
+        """The offset where the next entry will be appended."""
+        with self.locked(), open(self.path, "a+b") as f:
+            return self._complete(f)
+
+    def append(self, entries: List[Dict[str, Any]], present_from: Optional[int] = None) -> None:
+        """
+        Durably appends entries. With `present_from` (an end() taken before the
+        entries could have been sent), leaves out those already here after it.
+        """
+        with self.locked(), open(self.path, "a+b") as f:
+            if present_from is not None:
+                present = {_entry_key(entry) for entry, _, _ in self.read(present_from)}
+                entries = [entry for entry in entries if _entry_key(entry) not in present]
+            if not entries:
+                return
+            self._complete(f)
+            payload = "".join(json.dumps(entry) + "\n" for entry in entries).encode()
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        BYTES_WRITTEN.inc(len(payload), file="inbox")
+
+    def read(self, offset: int) -> List[Tuple[Dict[str, Any], int, int]]:
+        """Returns the complete entries after a byte offset, each with its start and end offsets."""
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return []
+        entries = []
+        with f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                entries.append((json.loads(line), offset, offset + len(line)))
+                offset += len(line)
+        return entries
+
+    def clear(self) -> None:
+        with self.locked():
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+
+class Shard(AccountStore):
+    """
+    One shard: a JSON store (snapshot, journal and history files, account locks)
+    holding the accounts that hash to it, plus the steps of cross-shard transfers.
+    """
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        # ShardedStore holds "shard-<n>.lock" for it
+        self.lock_path = None
+        # Inbox entries are applied one at a time, in file order
+        self.drain_lock = threading.Lock()
+
+    def transfer_out(
+        self,
+        sender_name: str,
+        items: List[Tuple[str, int]],
+        atomic: bool,
+        find_remote: Callable[[str], Optional[Dict[str, Any]]],
+        txid: str,
+        inbox_from: Dict[str, int],
+    ) -> Tuple[List[Dict[str, Any]], int, List[Tuple[str, int]]]:
+        """
+        Like transfer_batch, but receivers may be on other shards (`find_remote`
+        looks them up). Their amounts are debited here, in the same journal record as
+        the local items, and kept as outbound credits under `txid` until they are
+        handed over, with `inbox_from` (shard -> Inbox.end() before the debit).
+        Returns the results, the sender's new balance and the outbound items.
+        """
+        sender = self.get(sender_name)
+        if not sender:
+            raise ValueError("Transfer failed: Sender not found.")
+
+        local = {normalize_name(name): self.get(name) for name, _ in items}
+        with self.locked(sender["name"], *(user["name"] for user in local.values() if user)):
+            sender = self.get(sender_name)
+            results, accepted = plan_batch_transfer(
+                sender, items, lambda name: local[normalize_name(name)] or find_remote(name), atomic
+            )
+            items_cents = [(name, cents) for name, cents in accepted if normalize_name(name) in self._table.slots]
+            outbound = [(name, cents) for name, cents in accepted if normalize_name(name) not in self._table.slots]
+            if accepted:
+                record = {"op": "batch_transfer", "sender": sender["name"], "items_cents": items_cents}
+                if outbound:
+                    record.update(txid=txid, outbound_cents=outbound, inbox_from=inbox_from)
+                self.apply(record)
+            return results, self._table.balances[self._table.slot(sender_name)], outbound
+
+    def run_schedules_out(
+        self,
+        runs: List[Dict[str, Any]],
+        find_remote: Callable[[str], Optional[Dict[str, Any]]],
+        inbox_from: Dict[str, int],
+    ) -> Tuple[List[Dict[str, Any]], List[Tuple[str, str, List[Tuple[str, int]]]]]:
+        """
+        Like run_schedules, but receivers may be on other shards (`find_remote`
+        looks them up). Their amounts become outbound credits, one txid per sender,
+        journaled with the local transfers (see transfer_out for `inbox_from`).
+        Returns the updated schedules and the (txid, sender, items) to hand over.
+        """
+        self._ensure_loaded()
+        schedules = [self._table.schedule(run) for run in runs]
+        names = {
+            name for schedule in schedules if schedule
+            for name in (schedule["sender"], schedule["receiver"]) if normalize_name(name) in self._table.slots
+        }
+        with self.locked(*names):
+            updates, accepted = plan_schedule_runs(runs, self._table.schedule, lambda name: self.get(name) or find_remote(name))
+            if not updates:
+                return [], []
+            local = [item for item in accepted if normalize_name(item[1]) in self._table.slots]
+            remote: Dict[str, List[Tuple[str, int]]] = {}
+            for sender, receiver, cents in accepted:
+                if normalize_name(receiver) not in self._table.slots:
+                    remote.setdefault(sender, []).append((receiver, cents))
+            outbound = [(uuid.uuid4().hex, sender, items) for sender, items in remote.items()]
+            record = {"op": "scheduled_transfers", "transfers_cents": local, "schedules": updates}
+            if outbound:
+                record.update(outbound=outbound, inbox_from=inbox_from)
+            self.apply(record)
+            return [dict(self._table.schedule(update)) for update in updates], outbound
+
+    def outbound(self) -> Dict[str, Dict[str, Any]]:
+        """Outbound credits not handed over yet, by txid."""
+        self._ensure_loaded()
+        return dict(self._table.outbound)
+
+    def mark_sent(self, txid: str) -> None:
+        # Journaled before it's forgotten: until then, a restart hands the credits over again
+        self._note({"op": "transfer_sent", "txid": txid})
+
+    @property
+    def inbox_offset(self) -> int:
+        return self._table.inbox_offset
+
+    def receive(self, entry: Dict[str, Any], start: int, end: int) -> None:
+        """Applies one inbox credit; `start` and `end` are its offsets in the inbox."""
+        receiver = self.get(entry["receiver"])
+        with self.locked(receiver["name"]):
+            self.apply({
+                "op": "transfer_in",
+                "txid": entry["txid"],
+                "sender": entry["sender"],
+                "receiver": receiver["name"],
+                "cents": entry["cents"],
+                "inbox": [start, end],
+            })
+
+    def skip(self, start: int, end: int, refund: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Moves past an inbox entry that wasn't applied. A `refund` sending it back
+        ({"id", "entries", "inbox_from"}) is kept as an outbound credit until handed over.
+        """
+        record = {"op": "inbox_skip", "inbox": [start, end]}
+        if refund is not None:
+            record["refund"] = refund
+        self._note(record)
+
+    def _note(self, record: Dict[str, Any]) -> None:
+        self._ensure_loaded()
+        self.journal.append(record)
+        self._table.apply(record)
+
+
+class ShardedStore(Storage):
+    """
+    Storage backend that partitions accounts across SHARD_COUNT JSON stores by a
+    hash of the normalized name (see shard_of). Each shard has its own files in
+    `path` and its own locks, so shards never wait on each other.
+
+    A process serves the shards in SHARD_IDS (all by default) and holds an
+    exclusive lock file for each, so several workers can serve disjoint shards of
+    the same directory. Accounts of a shard served elsewhere raise ShardNotOwnedError.
+
+    A transfer within a shard is an ordinary shard transfer. Across shards it takes
+    three durable steps:
+      1. the sender's shard journals the debit together with the outbound credits
+         (the whole transfer is decided here);
+      2. the credits are appended to the receiving shards' inboxes;
+      3. the sender's shard journals that they were handed over.
+    The process serving a receiving shard applies its inbox in order and journals
+    its position, so each credit is applied exactly once. On startup, outbound
+    credits without step 3 are handed over again, skipping those already in the
+    inbox. A hand-over that fails while running (e.g. a full disk) doesn't fail the
+    transfer, whose debit stands: it is retried by the background poller. A credit
+    whose receiver no longer exists is sent back to the sender.
+    Until a credit is applied its amount is in flight: money is never created or
+    lost, but a reader may briefly see it on neither side.
+    """
+
+    in_memory = True
+
+    def __init__(self, path: str, shard_count: int = SHARD_COUNT, owned: Optional[List[int]] = SHARD_IDS):
+        self.path = path
+        self.shard_count = shard_count
+        self.owned: Set[int] = set(range(shard_count) if owned is None else owned)
+        if not self.owned <= set(range(shard_count)):
+            raise ValueError(f"Shard ids must be between 0 and {shard_count - 1}.")
+        self.shards: List[Optional[Shard]] = [
+            Shard(self._shard_path(shard)) if shard in self.owned else None
+            for shard in range(shard_count)
+        ]
+        self.inboxes = [Inbox(path, shard) for shard in range(shard_count)]
+        self._loaded = False
+        self._load_lock = threading.Lock()
+        self._ownership_files = []
+        # Names of shards served elsewhere, read from their snapshot: shard -> (mtime, sorted (key, name))
+        self._remote_directories: Dict[int, Tuple[float, List[Tuple[str, str]]]] = {}
+        self._poller: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        # Journaled outbound credits whose hand-over failed: (shard, txid), retried by the poller
+        self._unsent: Set[Tuple[int, str]] = set()
+        self._unsent_lock = threading.Lock()
+
+    # --- Startup and recovery ---
+
+    def load(self) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        self._check_layout()
+        for shard in sorted(self.owned):
+            f = open(os.path.join(self.path, f"shard-{shard}.lock"), "a")
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                f.close()
+                self._release()
+                raise RuntimeError(f"Shard {shard} in {self.path} is already served by another process.")
+            self._ownership_files.append(f)
+        for shard in self._owned_shards():
+            shard.load()
+        # Transfers interrupted between their debit and the hand-over of their credits
+        for index in sorted(self.owned):
+            for txid, outbound in self.shards[index].outbound().items():
+                self._hand_over(index, txid, outbound, resend=True)
+        for index in sorted(self.owned):
+            self._drain(index)
+        self._refresh_remote_directories()
+        self._loaded = True
+        self._stop.clear()
+        self._poller = threading.Thread(target=self._poll_inboxes, name="shard-inbox-poller", daemon=True)
+        self._poller.start()
+
+    def _check_layout(self) -> None:
+        layout_path = os.path.join(self.path, LAYOUT_FILE)
+        try:
+            with open(layout_path) as f:
+                shard_count = json.load(f)["shards"]
+        except FileNotFoundError:
+            with open(layout_path, "w") as f:
+                json.dump({"shards": self.shard_count}, f)
+            return
+        if shard_count != self.shard_count:
+            raise ValueError(
+                f"{self.path} holds {shard_count} shards but BANK_SHARDS is {self.shard_count}; resharding is not supported."
+            )
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        with self._load_lock:
+            if not self._loaded:
+                self.load()
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    # --- Routing ---
+
+    def shard_of(self, name: str) -> int:
+        return shard_of(name, self.shard_count)
+
+    def _owned_shards(self) -> List[Shard]:
+        return [shard for shard in self.shards if shard is not None]
+
+    def _shard(self, name: str) -> Shard:
+        """The shard of an account, which this process must serve."""
+        self._ensure_loaded()
+        index = self.shard_of(name)
+        shard = self.shards[index]
+        if shard is None:
+            raise ShardNotOwnedError(f"Account '{name}' is on shard {index}, which another worker serves.")
+        return shard
+
+    def _remote_directory(self, index: int) -> List[Tuple[str, str]]:
+        """
+        The (normalized name, name) pairs of a shard served elsewhere. Only reads
+        the copy kept by _refresh_remote_directories: lookups and name searches run
+        on the event loop, so they must not read or parse a snapshot.
+        """
+        cached = self._remote_directories.get(index)
+        return cached[1] if cached is not None else []
+
+    def _refresh_remote_directories(self) -> None:
+        """Re-reads the names of shards served elsewhere whose snapshot changed (at load and by the poller)."""
+        for index in range(self.shard_count):
+            if index in self.owned:
+                continue
+            path = self._shard_path(index)
+            try:
+                mtime = os.stat(snapshot_file(path)).st_mtime
+            except FileNotFoundError:
+                continue
+            cached = self._remote_directories.get(index)
+            if cached is None or cached[0] != mtime:
+                # Accounts are only added by replace(), which writes the snapshot
+                names = list(read_table(path)[0].names)
+                self._remote_directories[index] = (mtime, sorted((normalize_name(name), name) for name in names))
+
+    def _shard_path(self, index: int) -> str:
+        return os.path.join(self.path, f"shard-{index}.json")
+
+    def _find(self, name: str) -> Optional[Dict[str, Any]]:
+        """Looks an account up on any shard. For a shard served elsewhere only the name is known."""
+        index = self.shard_of(name)
+        if self.shards[index] is not None:
+            return self.shards[index].get(name)
+        directory = self._remote_directory(index)
+        key = normalize_name(name)
+        position = bisect_left(directory, (key, ""))
+        if position < len(directory) and directory[position][0] == key:
+            return {"name": directory[position][1]}
+        return None
+
+    # --- Reads ---
+
+    def get(self, name: str) -> Optional[Dict[str, Any]]:
+        return self._shard(name).get(name)
+
+    def balance(self, name: str) -> Optional[Tuple[int, int]]:
+        return self._shard(name).balance(name)
+
+    def version(self) -> int:
+        # Every shard's version only grows, so their sum does too
+        self._ensure_loaded()
+        return sum(shard.version() for shard in self._owned_shards())
+
+    def names(self) -> List[str]:
+        self._ensure_loaded()
+        names = []
+        for index, shard in enumerate(self.shards):
+            names.extend(shard.names() if shard is not None else [name for _, name in self._remote_directory(index)])
+        return names
+
+    def search_names(self, prefix: str = "", after: Optional[str] = None, limit: int = 50) -> List[str]:
+        self._ensure_loaded()
+        prefix = normalize_name(prefix)
+        found = []
+        for index, shard in enumerate(self.shards):
+            if shard is not None:
+                found.extend((normalize_name(name), name) for name in shard.search_names(prefix, after, limit))
+                continue
+            directory = self._remote_directory(index)
+            start = bisect_left(directory, (prefix, ""))
+            if after is not None:
+                start = max(start, bisect_right(directory, (after, "\U0010ffff")))
+            found.extend(entry for entry in directory[start:start + limit] if entry[0].startswith(prefix))
+        return [name for _, name in sorted(found)[:limit]]
+
+    def transactions(
+        self, name: str, before: Optional[int], start: Optional[float], end: Optional[float], limit: int
+    ) -> List[Dict[str, Any]]:
+        return self._shard(name).transactions(name, before, start, end, limit)
+
+    # --- Writes ---
+
+    def deposit(self, name: str, cents: int) -> int:
+        return self._shard(name).deposit(name, cents)
+
+    def set_pin(self, name: str, pin_number: str) -> None:
+        self._shard(name).set_pin(name, pin_number)
+
+    def schedules(self, name: Optional[str] = None) -> List[Dict[str, Any]]:
+        if name is not None:
+            return self._shard(name).schedules(name)
+        self._ensure_loaded()
+        return [schedule for shard in self._owned_shards() for schedule in shard.schedules()]
+
+    def add_schedule(self, schedule: Dict[str, Any]) -> None:
+        self._shard(schedule["sender"]).add_schedule(schedule)
+
+    def remove_schedule(self, sender_name: str, schedule_id: str) -> None:
+        self._shard(sender_name).remove_schedule(sender_name, schedule_id)
+
+    def run_schedules(self, runs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Runs each shard's part of the batch on its own, then hands over the credits to other shards."""
+        by_shard: Dict[int, List[Dict[str, Any]]] = {}
+        for run in runs:
+            by_shard.setdefault(self.shard_of(run["sender"]), []).append(run)
+        ran = []
+        for index, shard_runs in sorted(by_shard.items()):
+            shard = self._shard(shard_runs[0]["sender"])
+            schedules, outbound = shard.run_schedules_out(
+                shard_runs,
+                lambda name: self._find(name) if self.shard_of(name) != index else None,
+                self._inbox_ends(set(range(self.shard_count)) - {index}),
+            )
+            ran.extend(schedules)
+            targets = set()
+            for txid, sender, items in outbound:
+                targets |= self._try_hand_over(index, txid, {"sender": sender, "items_cents": items})
+            self._try_drain(targets)
+        return ran
+
+    def transfer(self, sender_name: str, receiver_name: str, cents: int) -> Tuple[int, Optional[int]]:
+        """
+        Moves an amount between two accounts. The receiver's new balance is None
+        when its shard is served by another process.
+        """
+        shard = self._shard(sender_name)
+        if self.shard_of(receiver_name) == self.shard_of(sender_name):
+            return shard.transfer(sender_name, receiver_name, cents)
+
+        if shard.get(sender_name) is None:
+            raise ValueError("Transfer failed: Sender not found.")
+        if self._find(receiver_name) is None:
+            raise ValueError("Transfer failed: Receiver not found.")
+        results, sender_cents = self.transfer_batch(sender_name, [(receiver_name, cents)], atomic=True)
+        if results[0]["status"] != "applied":
+            raise ValueError(results[0]["message"])
+        receiver = self.shards[self.shard_of(receiver_name)]
+        return sender_cents, receiver.balance(receiver_name)[0] if receiver is not None else None
+
+    def transfer_batch(
+        self, sender_name: str, items: List[Tuple[str, int]], atomic: bool
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        index = self.shard_of(sender_name)
+        shard = self._shard(sender_name)
+        if all(self.shard_of(name) == index for name, _ in items):
+            return shard.transfer_batch(sender_name, items, atomic)
+
+        txid = uuid.uuid4().hex
+        results, sender_cents, outbound = shard.transfer_out(
+            sender_name,
+            items,
+            atomic,
+            lambda name: self._find(name) if self.shard_of(name) != index else None,
+            txid,
+            self._inbox_ends({self.shard_of(name) for name, _ in items} - {index}),
+        )
+        if outbound:
+            sender = shard.get(sender_name)["name"]
+            # Served here too: credit them before returning, like a local transfer
+            self._try_drain(self._try_hand_over(index, txid, {"sender": sender, "items_cents": outbound}))
+        return results, sender_cents
+
+    def _inbox_ends(self, targets: Set[int]) -> Dict[str, int]:
+        """Where the inboxes of these shards end, noted before a debit so a resend can skip what was sent."""
+        return {str(target): self.inboxes[target].end() for target in sorted(targets)}
+
+    def _hand_over(self, index: int, txid: str, outbound: Dict[str, Any], resend: bool = False) -> Set[int]:
+        """
+        Appends a transfer's outbound credits to the receivers' inboxes, then records
+        them as sent. `outbound` has "sender" and "items_cents", or the ready "entries"
+        of a refund. A resend leaves out the credits that reached an inbox after
+        the position noted in its "inbox_from" (the whole inbox if it has none).
+        """
+        entries = outbound.get("entries") or [
+            {"txid": txid, "index": position, "sender": outbound["sender"], "receiver": receiver, "cents": cents}
+            for position, (receiver, cents) in enumerate(outbound["items_cents"])
+        ]
+        by_shard: Dict[int, List[Dict[str, Any]]] = {}
+        for entry in entries:
+            by_shard.setdefault(self.shard_of(entry["receiver"]), []).append(entry)
+        inbox_from = outbound.get("inbox_from") or {}
+        for target, target_entries in by_shard.items():
+            self.inboxes[target].append(target_entries, inbox_from.get(str(target), 0) if resend else None)
+        self.shards[index].mark_sent(txid)
+        return set(by_shard)
+
+    def _try_hand_over(self, index: int, txid: str, outbound: Dict[str, Any]) -> Set[int]:
+        """
+        Hands over the credits of a debit that is already journaled. If that fails,
+        the debit still stands: the hand-over is left to the poller and no shard is returned.
+        """
+        try:
+            return self._hand_over(index, txid, outbound)
+        except Exception:
+            SHARD_FAILURES.inc(operation="hand_over")
+            logger.exception("Handing over transfer %s from shard %d failed; retrying in the background", txid, index)
+            with self._unsent_lock:
+                self._unsent.add((index, txid))
+            return set()
+
+    def _try_drain(self, targets: Set[int]) -> None:
+        """Applies the credits just sent to shards served here; what fails is left to the poller."""
+        for target in sorted(targets):
+            if self.shards[target] is not None:
+                try:
+                    self._drain(target)
+                except Exception:
+                    SHARD_FAILURES.inc(operation="drain")
+                    logger.exception("Applying the inbox of shard %d failed; retrying in the background", target)
+
+    def unsent_hand_overs(self) -> int:
+        """Debited cross-shard transfers whose hand-over failed and waits for the poller."""
+        with self._unsent_lock:
+            return len(self._unsent)
+
+    def _retry_unsent(self) -> None:
+        with self._unsent_lock:
+            unsent = sorted(self._unsent)
+        for index, txid in unsent:
+            outbound = self.shards[index].outbound().get(txid)
+            if outbound is not None:
+                # Resent: the failed attempt may have reached some inboxes
+                self._hand_over(index, txid, outbound, resend=True)
+            with self._unsent_lock:
+                self._unsent.discard((index, txid))
+
+    def _drain(self, index: int) -> None:
+        """Applies the credits waiting in the inbox of a shard served here."""
+        shard = self.shards[index]
+        with shard.drain_lock:
+            for entry, start, end in self.inboxes[index].read(shard.inbox_offset):
+                if shard.get(entry["receiver"]) is not None:
+                    shard.receive(entry, start, end)
+                    self._notify(shard, entry["receiver"])
+                    continue
+                # The receiver is gone: return the money, unless this already is a return
+                if entry.get("refund"):
+                    shard.skip(start, end)
+                    continue
+                refund = dict(entry, sender=entry["receiver"], receiver=entry["sender"], refund=True)
+                refund_id = f"refund-{entry['txid']}-{entry['index']}"
+                outbound = {"entries": [refund], "inbox_from": self._inbox_ends({self.shard_of(refund["receiver"])})}
+                # Journaled with the skip as an outbound credit, so a crash before it's sent can't lose it
+                shard.skip(start, end, dict(outbound, id=refund_id))
+                # Applied by the receiving shard's own drain, never from inside this one
+                self._try_hand_over(index, refund_id, outbound)
+
+    @staticmethod
+    def _notify(shard: Shard, name: str) -> None:
+        # Credits from other processes don't pass through bank.py, which feeds the balance events
+        if broker.has_subscribers(name):
+            broker.publish(name, *shard.balance(name))
+
+    def _poll_inboxes(self) -> None:
+        # Retries failing since an earlier poll: a lasting failure (e.g. a full disk) is logged once, not every poll
+        failing: Set[str] = set()
+        while not self._stop.wait(INBOX_POLL_MS / 1000):
+            # What fails is kept for the next poll (or for startup if the process stops first)
+            attempts = [("hand_over", "Resending failed hand-overs", self._retry_unsent)]
+            attempts += [
+                ("drain", f"Applying the inbox of shard {index}", lambda index=index: self._drain(index))
+                for index in sorted(self.owned)
+            ]
+            for operation, description, attempt in attempts:
+                try:
+                    attempt()
+                except Exception:
+                    SHARD_FAILURES.inc(operation=operation)
+                    if description not in failing:
+                        failing.add(description)
+                        logger.exception("%s: failed, retrying every %g ms", description, INBOX_POLL_MS)
+                else:
+                    if description in failing:
+                        failing.discard(description)
+                        logger.warning("%s: works again", description)
+            try:
+                self._refresh_remote_directories()
+            except Exception:
+                # E.g. a snapshot being replaced: the previous names stay until the next poll
+                pass
+
+    # --- Whole database ---
+
+    def apply_bulk(self, rule: Dict[str, Any], dry_run: bool) -> Dict[str, int]:
+        """
+        Applies the rule shard by shard; each shard's change is atomic on its own.
+        Credits in flight between shards are on no account while it runs.
+        """
+        self._ensure_loaded()
+        self._require_all_shards()
+        totals: Dict[str, int] = {}
+        for shard in self.shards:
+            for key, value in shard.apply_bulk(rule, dry_run).items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def _require_all_shards(self) -> None:
+        if len(self.owned) < self.shard_count:
+            raise ShardNotOwnedError("This operation needs every shard, and other workers serve some of them.")
+
+    def data(self) -> Dict[str, Any]:
+        self._ensure_loaded()
+        self._require_all_shards()
+        return {"users": [user for shard in self._owned_shards() for user in shard.data()["users"]]}
+
+    def replace(self, data: Dict[str, Any]) -> None:
+        """Replaces every shard's accounts; credits still in flight are dropped with the old data."""
+        self._ensure_loaded()
+        self._require_all_shards()
+        users: List[List[Dict[str, Any]]] = [[] for _ in range(self.shard_count)]
+        for user in data.get("users", []):
+            users[self.shard_of(user["name"])].append(user)
+        for index, shard in enumerate(self.shards):
+            with shard.drain_lock:
+                self.inboxes[index].clear()
+                shard.replace({"users": users[index]})
+
+    def close(self) -> None:
+        if not self._loaded:
+            return
+        self._stop.set()
+        if self._poller is not None:
+            self._poller.join()
+            self._poller = None
+        for shard in self._owned_shards():
+            shard.close()
+        self._release()
+        self._loaded = False
+
+    def _release(self) -> None:
+        for f in self._ownership_files:
+            f.close()
+        self._ownership_files = []
@@ -0,0 +1,442 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple
+from .history import history_entries
+from .money import to_cents, to_json_number
+from .storage import (
+    Storage, apply_schedule_update, bulk_changes, bulk_summary, plan_batch_transfer, plan_schedule_runs,
+)
+from .store import normalize_name
+
+POOL_SIZE = int(os.environ.get("BANK_SQLITE_POOL_SIZE", "8"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS accounts (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    name_key TEXT NOT NULL,
+    pin_number TEXT NOT NULL,
+    balance_cents INTEGER NOT NULL,
+    -- meta.version of the last write that touched the account
+    version INTEGER NOT NULL DEFAULT 0
+);
+CREATE UNIQUE INDEX IF NOT EXISTS accounts_name_key ON accounts (name_key);
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER PRIMARY KEY,
+    account_key TEXT NOT NULL,
+    ts REAL NOT NULL,
+    type TEXT NOT NULL,
+    counterparty TEXT,
+    cents INTEGER NOT NULL,
+    balance_cents INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS transactions_account ON transactions (account_key, id);
+CREATE TABLE IF NOT EXISTS meta (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    version INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (id, version) VALUES (0, 0);
+CREATE TABLE IF NOT EXISTS schedules (
+    id TEXT PRIMARY KEY,
+    sender_key TEXT NOT NULL,
+    -- The schedule as JSON (see Storage.schedules)
+    schedule TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS schedules_sender ON schedules (sender_key);
+"""
+
+
+class SqliteStore(Storage):
+    """
+    SQLite storage backend.
+
+    The database runs in WAL mode so readers never wait for the writer, and
+    connections are reused from a fixed-size pool. Every deposit or transfer is
+    a single transaction; the insufficient-funds check is part of the UPDATE
+    itself, so concurrent writers (threads or processes) can't overdraw an account.
+    """
+
+    def __init__(self, path: str, pool_size: int = POOL_SIZE):
+        self.path = path
+        self.pool_size = pool_size
+        self._pool: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        self._loaded = False
+        self._load_lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def _connect(self) -> sqlite3.Connection:
+        # isolation_level=None: transactions are started explicitly with BEGIN
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, timeout=5.0)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=FULL")
+        return conn
+
+    def load(self) -> None:
+        with self._load_lock:
+            if self._loaded:
+                return
+            conn = self._connect()
+            self._upgrade_schema(conn)
+            conn.executescript(SCHEMA)
+            self._pool.put(conn)
+            for _ in range(self.pool_size - 1):
+                self._pool.put(self._connect())
+            self._loaded = True
+
+    @staticmethod
+    def _upgrade_schema(conn: sqlite3.Connection) -> None:
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(accounts)")}
+        if not columns:
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        # Databases created before balances were kept in cents have a REAL bank_balance column
+        if "bank_balance" in columns:
+            conn.execute("ALTER TABLE accounts ADD COLUMN balance_cents INTEGER NOT NULL DEFAULT 0")
+            conn.execute("UPDATE accounts SET balance_cents = CAST(ROUND(bank_balance * 100) AS INTEGER)")
+            conn.execute("ALTER TABLE accounts DROP COLUMN bank_balance")
+        if "version" not in columns:
+            conn.execute("ALTER TABLE accounts ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        conn.execute("COMMIT")
+
+    @contextmanager
+    def _connection(self) -> Iterator[sqlite3.Connection]:
+        if not self._loaded:
+            self.load()
+        conn = self._pool.get()
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        with self._connection() as conn:
+            # IMMEDIATE takes the write lock up front instead of failing to upgrade later
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def get(self, name: str) -> Optional[Dict[str, Any]]:
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT name, pin_number, balance_cents FROM accounts WHERE name_key = ?",
+                (normalize_name(name),),
+            ).fetchone()
+        return dict(row) if row else None
+
+    def balance(self, name: str) -> Optional[Tuple[int, int]]:
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT balance_cents, version FROM accounts WHERE name_key = ?",
+                (normalize_name(name),),
+            ).fetchone()
+        return (row["balance_cents"], row["version"]) if row else None
+
+    def version(self) -> int:
+        with self._connection() as conn:
+            return conn.execute("SELECT version FROM meta").fetchone()["version"]
+
+    def names(self) -> List[str]:
+        with self._connection() as conn:
+            return [row["name"] for row in conn.execute("SELECT name FROM accounts ORDER BY id")]
+
+    def search_names(self, prefix: str = "", after: Optional[str] = None, limit: int = 50) -> List[str]:
+        # A range scan on the name_key index: every key with the prefix sorts
+        # between the prefix itself and the prefix followed by the highest code point
+        prefix = normalize_name(prefix)
+        with self._connection() as conn:
+            rows = conn.execute(
+                "SELECT name FROM accounts WHERE name_key >= ? AND name_key < ? AND name_key > ? "
+                "ORDER BY name_key LIMIT ?",
+                (prefix, prefix + "\U0010ffff", after if after is not None else "", limit),
+            ).fetchall()
+        return [row["name"] for row in rows]
+
+    def deposit(self, name: str, cents: int) -> int:
+        with self._transaction() as conn:
+            row = conn.execute(
+                "UPDATE accounts SET balance_cents = balance_cents + ? WHERE name_key = ? RETURNING name, balance_cents",
+                (cents, normalize_name(name)),
+            ).fetchall()
+            if not row:
+                raise ValueError("Deposit failed: User not found.")
+            balance = row[0]["balance_cents"]
+            self._record_history(conn, {"op": "deposit", "name": row[0]["name"], "cents": cents}, lambda _: balance)
+            self._bump_version(conn, [name])
+            return balance
+
+    def transfer(self, sender_name: str, receiver_name: str, cents: int) -> Tuple[int, int]:
+        with self._transaction() as conn:
+            sender = conn.execute(
+                "UPDATE accounts SET balance_cents = balance_cents - ? "
+                "WHERE name_key = ? AND balance_cents >= ? RETURNING name, balance_cents",
+                (cents, normalize_name(sender_name), cents),
+            ).fetchall()
+            if not sender:
+                # The conditional UPDATE matched nothing: find out why
+                if not self._exists(conn, sender_name):
+                    raise ValueError("Transfer failed: Sender not found.")
+                if not self._exists(conn, receiver_name):
+                    raise ValueError("Transfer failed: Receiver not found.")
+                raise ValueError("Transfer failed: Insufficient funds.")
+            receiver = conn.execute(
+                "UPDATE accounts SET balance_cents = balance_cents + ? WHERE name_key = ? RETURNING name, balance_cents",
+                (cents, normalize_name(receiver_name)),
+            ).fetchall()
+            if not receiver:
+                raise ValueError("Transfer failed: Receiver not found.")
+            balances = {normalize_name(row["name"]): row["balance_cents"] for row in (sender[0], receiver[0])}
+            self._record_history(
+                conn,
+                {"op": "transfer", "sender": sender[0]["name"], "receiver": receiver[0]["name"], "cents": cents},
+                lambda name: balances[normalize_name(name)],
+            )
+            self._bump_version(conn, [sender_name, receiver_name])
+            return sender[0]["balance_cents"], receiver[0]["balance_cents"]
+
+    def transfer_batch(
+        self, sender_name: str, items: List[Tuple[str, int]], atomic: bool
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        # The write lock taken by BEGIN IMMEDIATE makes the reads below a consistent view
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT name, balance_cents FROM accounts WHERE name_key = ?", (normalize_name(sender_name),)
+            ).fetchone()
+            if row is None:
+                raise ValueError("Transfer failed: Sender not found.")
+            sender = dict(row)
+
+            receivers = {}
+            keys = list({normalize_name(name) for name, _ in items})
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT name, name_key FROM accounts WHERE name_key IN ({','.join('?' * len(chunk))})", chunk
+                )
+                receivers.update((row["name_key"], dict(row)) for row in rows)
+
+            results, accepted = plan_batch_transfer(
+                sender, items, lambda name: receivers.get(normalize_name(name)), atomic
+            )
+            if accepted:
+                total = sum(cents for _, cents in accepted)
+                conn.execute(
+                    "UPDATE accounts SET balance_cents = balance_cents - ? WHERE name_key = ?",
+                    (total, normalize_name(sender_name)),
+                )
+                conn.executemany(
+                    "UPDATE accounts SET balance_cents = balance_cents + ? WHERE name_key = ?",
+                    ((cents, normalize_name(name)) for name, cents in accepted),
+                )
+                self._record_history(
+                    conn,
+                    {"op": "batch_transfer", "sender": sender["name"], "items_cents": accepted},
+                    lambda name: self._balance(conn, name),
+                )
+                self._bump_version(conn, [sender_name] + [name for name, _ in accepted])
+            balance = conn.execute(
+                "SELECT balance_cents FROM accounts WHERE name_key = ?", (normalize_name(sender_name),)
+            ).fetchone()["balance_cents"]
+            return results, balance
+
+    def apply_bulk(self, rule: Dict[str, Any], dry_run: bool) -> Dict[str, int]:
+        # One write transaction: every balance is read and updated under the write lock
+        with self._transaction() as conn:
+            rows = conn.execute("SELECT name, balance_cents FROM accounts ORDER BY id").fetchall()
+            balances = [row["balance_cents"] for row in rows]
+            changes = bulk_changes(balances, rule)
+            summary = bulk_summary(balances, changes)
+            if summary["changed"] and not dry_run:
+                changed = [(rows[i]["name"], cents) for i, cents in enumerate(changes) if cents]
+                conn.executemany(
+                    "UPDATE accounts SET balance_cents = balance_cents + ? WHERE name_key = ?",
+                    ((cents, normalize_name(name)) for name, cents in changed),
+                )
+                after = {normalize_name(rows[i]["name"]): balance + changes[i] for i, balance in enumerate(balances)}
+                self._record_history(
+                    conn, {"op": "bulk", **rule, "changes_cents": changed}, lambda name: after[normalize_name(name)]
+                )
+                self._bump_version(conn, [name for name, _ in changed])
+            return summary
+
+    def schedules(self, name: Optional[str] = None) -> List[Dict[str, Any]]:
+        with self._connection() as conn:
+            if name is None:
+                rows = conn.execute("SELECT schedule FROM schedules")
+            else:
+                rows = conn.execute("SELECT schedule FROM schedules WHERE sender_key = ?", (normalize_name(name),))
+            return [json.loads(row["schedule"]) for row in rows]
+
+    def add_schedule(self, schedule: Dict[str, Any]) -> None:
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO schedules (id, sender_key, schedule) VALUES (?, ?, ?)",
+                (schedule["id"], normalize_name(schedule["sender"]), json.dumps(schedule)),
+            )
+
+    def remove_schedule(self, sender_name: str, schedule_id: str) -> None:
+        with self._transaction() as conn:
+            deleted = conn.execute(
+                "DELETE FROM schedules WHERE id = ? AND sender_key = ?", (schedule_id, normalize_name(sender_name))
+            ).rowcount
+            if not deleted:
+                raise ValueError("Scheduled transfer not found.")
+
+    def run_schedules(self, runs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # The transfers and the schedules' progress commit together, so a run is never half done
+        with self._transaction() as conn:
+            schedules = {}
+            ids = list({run["id"] for run in runs})
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                rows = conn.execute(f"SELECT schedule FROM schedules WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+                schedules.update((schedule["id"], schedule) for schedule in map(json.loads, (row["schedule"] for row in rows)))
+
+            accounts = {}
+            keys = list({normalize_name(name) for schedule in schedules.values() for name in (schedule["sender"], schedule["receiver"])})
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT name, name_key, balance_cents FROM accounts WHERE name_key IN ({','.join('?' * len(chunk))})", chunk
+                )
+                accounts.update((row["name_key"], {"name": row["name"], "balance_cents": row["balance_cents"]}) for row in rows)
+
+            updates, accepted = plan_schedule_runs(
+                runs, lambda run: schedules.get(run["id"]), lambda name: accounts.get(normalize_name(name))
+            )
+            if not updates:
+                return []
+            for sender, receiver, cents in accepted:
+                accounts[normalize_name(sender)]["balance_cents"] -= cents
+                accounts[normalize_name(receiver)]["balance_cents"] += cents
+            conn.executemany(
+                "UPDATE accounts SET balance_cents = balance_cents + ? WHERE name_key = ?",
+                ((sign * cents, normalize_name(name)) for sender, receiver, cents in accepted
+                 for sign, name in ((-1, sender), (1, receiver))),
+            )
+            record = {"op": "scheduled_transfers", "transfers_cents": accepted}
+            self._record_history(conn, record, lambda name: accounts[normalize_name(name)]["balance_cents"])
+            if accepted:
+                self._bump_version(conn, [name for sender, receiver, _ in accepted for name in (sender, receiver)])
+
+            ran = []
+            for update in updates:
+                schedule = schedules[update["id"]]
+                apply_schedule_update(schedule, update, record["ts"])
+                ran.append(schedule)
+            conn.executemany(
+                "UPDATE schedules SET schedule = ? WHERE id = ?",
+                ((json.dumps(schedule), schedule["id"]) for schedule in ran),
+            )
+            return ran
+
+    def set_pin(self, name: str, pin_number: str) -> None:
+        with self._transaction() as conn:
+            updated = conn.execute(
+                "UPDATE accounts SET pin_number = ? WHERE name_key = ?", (pin_number, normalize_name(name))
+            ).rowcount
+            if not updated:
+                raise ValueError("User not found.")
+
+    def transactions(
+        self, name: str, before: Optional[int], start: Optional[float], end: Optional[float], limit: int
+    ) -> List[Dict[str, Any]]:
+        with self._connection() as conn:
+            rows = conn.execute(
+                "SELECT id, ts, type, counterparty, cents, balance_cents FROM transactions "
+                "WHERE account_key = ? AND id < ? AND ts >= ? AND ts <= ? ORDER BY id DESC LIMIT ?",
+                (
+                    normalize_name(name),
+                    before if before is not None else 2 ** 63 - 1,
+                    start if start is not None else float("-inf"),
+                    end if end is not None else float("inf"),
+                    limit,
+                ),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    @staticmethod
+    def _record_history(conn: sqlite3.Connection, record: Dict[str, Any], balance_after) -> None:
+        # Part of the same transaction as the balance change it describes
+        record["ts"] = time.time()
+        conn.executemany(
+            "INSERT INTO transactions (account_key, ts, type, counterparty, cents, balance_cents) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                (normalize_name(entry["account"]), entry["ts"], entry["type"], entry["counterparty"],
+                 entry["cents"], entry["balance_cents"])
+                for entry in history_entries(record, balance_after)
+            ),
+        )
+
+    @staticmethod
+    def _bump_version(conn: sqlite3.Connection, names: Iterable[str]) -> None:
+        """Moves to the next version and stamps it on the accounts this write touched."""
+        version = conn.execute("UPDATE meta SET version = version + 1 RETURNING version").fetchall()[0]["version"]
+        conn.executemany(
+            "UPDATE accounts SET version = ? WHERE name_key = ?",
+            ((version, key) for key in {normalize_name(name) for name in names}),
+        )
+
+    @staticmethod
+    def _balance(conn: sqlite3.Connection, name: str) -> int:
+        return conn.execute(
+            "SELECT balance_cents FROM accounts WHERE name_key = ?", (normalize_name(name),)
+        ).fetchone()["balance_cents"]
+
+    @staticmethod
+    def _exists(conn: sqlite3.Connection, name: str) -> bool:
+        return conn.execute(
+            "SELECT 1 FROM accounts WHERE name_key = ?", (normalize_name(name),)
+        ).fetchone() is not None
+
+    def data(self) -> Dict[str, Any]:
+        with self._connection() as conn:
+            rows = conn.execute("SELECT name, pin_number, balance_cents FROM accounts ORDER BY id")
+            return {"users": [
+                {"name": row["name"], "pin_number": row["pin_number"], "bank_balance": to_json_number(row["balance_cents"])}
+                for row in rows
+            ]}
+
+    def replace(self, data: Dict[str, Any]) -> None:
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM accounts")
+            self._insert(conn, data.get("users", []))
+            self._bump_version(conn, [user["name"] for user in data.get("users", [])])
+
+    def import_users(self, users: Iterable[Dict[str, Any]]) -> None:
+        """Inserts accounts, overwriting any existing account with the same name."""
+        users = list(users)
+        with self._transaction() as conn:
+            self._insert(conn, users)
+            self._bump_version(conn, [user["name"] for user in users])
+
+    @staticmethod
+    def _insert(conn: sqlite3.Connection, users: Iterable[Dict[str, Any]]) -> None:
+        conn.executemany(
+            "INSERT INTO accounts (name, name_key, pin_number, balance_cents) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (name_key) DO UPDATE SET "
+            "name = excluded.name, pin_number = excluded.pin_number, balance_cents = excluded.balance_cents",
+            (
+                (user["name"], normalize_name(user["name"]), user["pin_number"], to_cents(user["bank_balance"]))
+                for user in users
+            ),
+        )
+
+    def close(self) -> None:
+        while not self._pool.empty():
+            self._pool.get().close()
+        self._loaded = False
@@ -0,0 +1,337 @@
+import calendar
+import os
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Dict, Any, Callable, List, Optional, Sequence, Tuple
+from .money import MAX_CENTS, from_cents
+
+# Which backend holds the accounts: "json" (database.json + journal), "sqlite" or "sharded"
+STORAGE_BACKEND = os.environ.get("BANK_STORAGE", "json")
+SQLITE_FILE = os.environ.get("BANK_SQLITE_FILE", "bank.sqlite3")
+# The sharded backend keeps one JSON store per shard in this directory
+SHARD_DIR = os.environ.get("BANK_SHARD_DIR", "shards")
+SHARD_COUNT = int(os.environ.get("BANK_SHARDS", "4"))
+# Shards this process serves, e.g. "0,1" (empty = all). Each shard is served by one process at a time.
+SHARD_IDS = [int(shard) for shard in os.environ.get("BANK_SHARD_IDS", "").split(",") if shard.strip()] or None
+# How often a scheduled transfer can repeat (None: it runs once)
+SCHEDULE_INTERVALS = ("daily", "weekly", "monthly")
+
+
+def normalize_name(name: str) -> str:
+    """Returns the key used to index an account name (names are case-insensitive)."""
+    return name.lower()
+
+
+class ShardNotOwnedError(ValueError):
+    """Raised when an account lives on a shard that another process serves."""
+
+
+class Storage(ABC):
+    """
+    Interface of an account storage backend.
+
+    Backends look accounts up by case-insensitive name and raise ValueError with
+    a user-facing message when an operation is refused. All amounts and balances
+    are integer cents; account records have "name", "pin_number" and
+    "balance_cents". Amount validation (positive amounts, no self-transfers) is
+    done by bank.py before calling them.
+    """
+
+    path: str
+    # True when reads are answered from memory and are cheap enough to run on the event loop
+    in_memory: bool = False
+
+    @property
+    @abstractmethod
+    def loaded(self) -> bool:
+        """Whether load() has run."""
+
+    @abstractmethod
+    def load(self) -> None:
+        """Opens the storage and makes the accounts available."""
+
+    @abstractmethod
+    def get(self, name: str) -> Optional[Dict[str, Any]]:
+        """Returns the account record for a name, or None if there is no such account."""
+
+    @abstractmethod
+    def balance(self, name: str) -> Optional[Tuple[int, int]]:
+        """
+        Returns the committed balance of an account and its version, or None if
+        there is no such account. The version changes only when a deposit or
+        transfer touches the account. Never waits for writers.
+        """
+
+    @abstractmethod
+    def version(self) -> int:
+        """Returns the version of the latest committed change; it grows with every commit."""
+
+    @abstractmethod
+    def names(self) -> List[str]:
+        """Returns the names of all accounts."""
+
+    @abstractmethod
+    def search_names(self, prefix: str = "", after: Optional[str] = None, limit: int = 50) -> List[str]:
+        """
+        Returns up to `limit` account names, sorted case-insensitively, whose
+        lower-cased form starts with `prefix` and sorts after the lower-cased name `after`.
+        """
+
+    @abstractmethod
+    def transactions(
+        self, name: str, before: Optional[int], start: Optional[float], end: Optional[float], limit: int
+    ) -> List[Dict[str, Any]]:
+        """
+        Returns up to `limit` statement entries of an account, newest first, each with
+        "id", "ts", "type", "counterparty", "cents" (signed) and "balance_cents".
+        `before` is the "id" to continue below; `start` and `end` bound "ts" (inclusive).
+        """
+
+    @abstractmethod
+    def deposit(self, name: str, cents: int) -> int:
+        """Adds an amount to an account and returns the new balance."""
+
+    @abstractmethod
+    def transfer(self, sender_name: str, receiver_name: str, cents: int) -> Tuple[int, int]:
+        """Moves an amount between two accounts and returns both new balances."""
+
+    @abstractmethod
+    def transfer_batch(
+        self, sender_name: str, items: List[Tuple[str, int]], atomic: bool
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Moves amounts from one sender to many receivers in one persistence step.
+        Returns the per-item results (see plan_batch_transfer) and the sender's new balance.
+        """
+
+    @abstractmethod
+    def apply_bulk(self, rule: Dict[str, Any], dry_run: bool) -> Dict[str, int]:
+        """
+        Applies a bulk rule (see bulk_changes) to every account as one atomic
+        change, validated and computed against one consistent view of all balances.
+        Returns the totals (see bulk_summary); with dry_run nothing is changed.
+        """
+
+    @abstractmethod
+    def schedules(self, name: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Returns the scheduled transfers sent by an account, or all of them. Each
+        schedule has "id", "sender", "receiver", "cents", "start", "interval",
+        "end", "occurrence" (runs so far), "next_due" (None once it's finished),
+        "applied", "failed" and "last_run". Times are UNIX timestamps.
+        """
+
+    @abstractmethod
+    def add_schedule(self, schedule: Dict[str, Any]) -> None:
+        """Stores a new scheduled transfer; bank.py has validated it."""
+
+    @abstractmethod
+    def remove_schedule(self, sender_name: str, schedule_id: str) -> None:
+        """Deletes a scheduled transfer of an account. Raises ValueError if it has no such schedule."""
+
+    @abstractmethod
+    def run_schedules(self, runs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Runs due scheduled transfers ({"id", "sender", "due"} each) as one atomic
+        batch: the transfers and the progress of every schedule are persisted in one
+        step (see plan_schedule_runs). Returns the schedules that ran, updated.
+        """
+
+    @abstractmethod
+    def set_pin(self, name: str, pin_number: str) -> None:
+        """Replaces the stored pin_number (normally a hash) of an account."""
+
+    @abstractmethod
+    def data(self) -> Dict[str, Any]:
+        """Returns the whole database content in the database.json layout."""
+
+    @abstractmethod
+    def replace(self, data: Dict[str, Any]) -> None:
+        """Replaces the whole database content with data in the database.json layout."""
+
+    @abstractmethod
+    def close(self) -> None:
+        """Flushes and releases the storage."""
+
+
+def plan_batch_transfer(
+    sender: Dict[str, Any],
+    items: List[Tuple[str, int]],
+    find_receiver: Callable[[str], Optional[Dict[str, Any]]],
+    atomic: bool,
+) -> Tuple[List[Dict[str, Any]], List[Tuple[str, int]]]:
+    """
+    Validates batch transfer items in order against the sender's running balance,
+    with the same rules as a single transfer.
+
+    Returns one result per item and the (receiver name, cents) pairs to apply.
+    When atomic is set and any item fails, nothing is applied.
+    """
+    results = []
+    accepted = []
+    balance = sender["balance_cents"]
+    for receiver_name, cents in items:
+        receiver = find_receiver(receiver_name)
+        amount = from_cents(cents)
+        if cents <= 0:
+            error = "Transfer amount must be positive."
+        elif receiver_name.lower() == sender["name"].lower():
+            error = "Sender and receiver cannot be the same person."
+        elif not receiver:
+            error = "Transfer failed: Receiver not found."
+        elif balance < cents:
+            error = "Transfer failed: Insufficient funds."
+        else:
+            error = None
+
+        if error:
+            results.append({"receiver_name": receiver_name, "amount": amount, "status": "failed", "message": error})
+            continue
+        balance -= cents
+        accepted.append((receiver["name"], cents))
+        results.append({"receiver_name": receiver["name"], "amount": amount, "status": "applied"})
+
+    if atomic and len(accepted) != len(items):
+        for result in results:
+            if result["status"] == "applied":
+                result["status"] = "not_applied"
+        accepted = []
+    return results, accepted
+
+
+def schedule_due(schedule: Dict[str, Any], occurrence: int) -> Optional[float]:
+    """
+    The due time of a schedule's occurrence (counting from 0), or None if it has
+    none: it doesn't repeat, or that time is past its "end". Occurrences are counted
+    from the first due time, so a monthly transfer on the 31st falls on the last
+    day of shorter months and is back on the 31st afterwards.
+    """
+    if occurrence == 0:
+        return schedule["start"]
+    interval = schedule["interval"]
+    if interval is None:
+        return None
+    start = datetime.fromtimestamp(schedule["start"], timezone.utc)
+    if interval == "daily":
+        due = start + timedelta(days=occurrence)
+    elif interval == "weekly":
+        due = start + timedelta(weeks=occurrence)
+    else:
+        year, month = divmod(start.month - 1 + occurrence, 12)
+        year, month = start.year + year, month + 1
+        due = start.replace(year=year, month=month, day=min(start.day, calendar.monthrange(year, month)[1]))
+    end = schedule["end"]
+    return None if end is not None and due.timestamp() > end else due.timestamp()
+
+
+def plan_schedule_runs(
+    runs: List[Dict[str, Any]],
+    find_schedule: Callable[[Dict[str, Any]], Optional[Dict[str, Any]]],
+    find_account: Callable[[str], Optional[Dict[str, Any]]],
+) -> Tuple[List[Dict[str, Any]], List[Tuple[str, str, int]]]:
+    """
+    Checks due runs of scheduled transfers in order, with the rules of a transfer,
+    against the running balances of the accounts involved.
+
+    A run whose schedule is gone, or isn't due at the run's "due" time any more
+    because that occurrence already ran, is dropped: handing the same run over
+    twice (e.g. again after a restart) can't pay twice.
+    Returns one update per remaining run, which apply_schedule_update records on
+    its schedule, and the (sender, receiver, cents) transfers to apply.
+    """
+    balances: Dict[str, int] = {}
+    planned = set()
+    updates = []
+    accepted = []
+    for run in runs:
+        schedule = find_schedule(run)
+        if schedule is None or schedule["next_due"] != run["due"] or schedule["id"] in planned:
+            continue
+        planned.add(schedule["id"])
+        sender = find_account(schedule["sender"])
+        receiver = find_account(schedule["receiver"])
+        cents = schedule["cents"]
+        if not sender:
+            error = "Transfer failed: Sender not found."
+        elif not receiver:
+            error = "Transfer failed: Receiver not found."
+        elif balances.get(normalize_name(sender["name"]), sender["balance_cents"]) < cents:
+            error = "Transfer failed: Insufficient funds."
+        else:
+            error = None
+            sender_key = normalize_name(sender["name"])
+            balances[sender_key] = balances.get(sender_key, sender["balance_cents"]) - cents
+            # An account on a shard served elsewhere has no balance here, and can't be a sender in this batch
+            if "balance_cents" in receiver:
+                receiver_key = normalize_name(receiver["name"])
+                balances[receiver_key] = balances.get(receiver_key, receiver["balance_cents"]) + cents
+            accepted.append((sender["name"], receiver["name"], cents))
+        updates.append({
+            "id": schedule["id"],
+            "sender": schedule["sender"],
+            "due": run["due"],
+            "next_due": schedule_due(schedule, schedule["occurrence"] + 1),
+            "status": "failed" if error else "applied",
+            "message": error,
+        })
+    return updates, accepted
+
+
+def apply_schedule_update(schedule: Dict[str, Any], update: Dict[str, Any], ts: float, sign: int = 1) -> None:
+    """Records a run on its schedule and moves it to its next occurrence (sign=-1 undoes that)."""
+    schedule["occurrence"] += sign
+    schedule["applied" if update["status"] == "applied" else "failed"] += sign
+    schedule["next_due"] = update["next_due"] if sign > 0 else update["due"]
+    if sign > 0:
+        schedule["last_run"] = {"due": update["due"], "ts": ts, "status": update["status"], "message": update["message"]}
+
+
+def bulk_changes(balances: Sequence[int], rule: Dict[str, Any]) -> List[int]:
+    """
+    Computes the change of every balance under a bulk rule, in one pass over the
+    balance column and in integer cents.
+
+    "interest" adds balance * rate, with the rate (a decimal string) taken as an
+    exact fraction and the result rounded half up to the cent. "fee" takes
+    "cents" from each balance, but never more than the balance. Only balances
+    between "min_balance_cents" and "max_balance_cents" (inclusive, when set) change.
+    """
+    low = rule.get("min_balance_cents", -MAX_CENTS)
+    high = rule.get("max_balance_cents", MAX_CENTS)
+    if rule["kind"] == "interest":
+        numerator, denominator = Decimal(rule["rate"]).as_integer_ratio()
+        # round(b * n / d) half up, as (2bn + d) // 2d
+        numerator, half, denominator = 2 * numerator, denominator, 2 * denominator
+        return [(b * numerator + half) // denominator if low <= b <= high else 0 for b in balances]
+    if rule["kind"] == "fee":
+        fee = rule["cents"]
+        return [-(fee if b >= fee else b) if low <= b <= high else 0 for b in balances]
+    raise ValueError(f"Unknown bulk operation: {rule['kind']}")
+
+
+def bulk_summary(balances: Sequence[int], changes: Sequence[int]) -> Dict[str, int]:
+    """The totals of a bulk change: accounts, accounts changed, and the balance total before and after."""
+    before = sum(balances)
+    change = sum(changes)
+    return {
+        "accounts": len(changes),
+        "changed": len(changes) - changes.count(0),
+        "before_cents": before,
+        "change_cents": change,
+        "after_cents": before + change,
+    }
+
+
+def open_storage(backend: str, json_path: str, sqlite_path: str, shard_dir: str = SHARD_DIR) -> Storage:
+    """Creates the storage backend selected by name."""
+    if backend == "json":
+        from .store import AccountStore
+        return AccountStore(json_path)
+    if backend == "sqlite":
+        from .sqlite_store import SqliteStore
+        return SqliteStore(sqlite_path)
+    if backend == "sharded":
+        from .sharded_store import ShardedStore
+        return ShardedStore(shard_dir)
+    raise ValueError(f"Unknown storage backend: {backend}")
@@ -0,0 +1,762 @@
+import fcntl
+import json
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+from decimal import Decimal
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple
+from .history import TransactionHistory
+from .journal import Journal, read_records, record_cents, record_items_cents
+from .metrics import BYTES_WRITTEN, SNAPSHOT_LOAD_SECONDS, SNAPSHOT_WRITE_SECONDS
+from .money import to_cents, to_json_number
+from .storage import (
+    Storage, apply_schedule_update, bulk_changes, bulk_summary, normalize_name, plan_batch_transfer, plan_schedule_runs,
+)
+
+COMPACT_EVERY = 1000  # journal records between two snapshot compactions
+SNAPSHOT_FOLD_EVERY = 1024  # changed accounts a published Snapshot overlays before it is folded
+# Format of the snapshots written by compaction: "json" (database.json) or "binary" (database.snap, memory-mapped at startup)
+SNAPSHOT_FORMAT = os.environ.get("BANK_SNAPSHOT_FORMAT", "json")
+
+
+def write_database_file(path: str, data: Dict[str, Any]) -> None:
+    """
+    Writes the given data to a database file.
+    The content goes to a temporary file first and is then renamed over the
+    original, so a crash never leaves a truncated database behind.
+    """
+    tmp_path = path + ".tmp"
+    with SNAPSHOT_WRITE_SECONDS.time():
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+            BYTES_WRITTEN.inc(f.tell(), file="snapshot")
+        os.replace(tmp_path, path)
+
+
+def read_snapshot(path: str) -> Dict[str, Any]:
+    """
+    Reads a snapshot for startup. A missing file is an empty database, but a
+    corrupt one is an error: silently starting from nothing would lose every account.
+    Amounts are parsed as Decimal so they convert to cents exactly.
+    """
+    try:
+        with SNAPSHOT_LOAD_SECONDS.time(), open(path, "r") as f:
+            data = json.load(f, parse_float=Decimal)
+    except FileNotFoundError:
+        data = {}
+    data.setdefault("users", [])
+    data.setdefault("seq", 0)
+    return data
+
+
+def _schedule_times_as_float(schedule: Dict[str, Any]) -> Dict[str, Any]:
+    # read_snapshot parses them as Decimal; runs are matched to schedules by exact due time
+    schedule = dict(schedule)
+    for field in ("start", "end", "next_due", "created"):
+        if schedule.get(field) is not None:
+            schedule[field] = float(schedule[field])
+    if schedule.get("last_run"):
+        schedule["last_run"] = dict(schedule["last_run"], due=float(schedule["last_run"]["due"]), ts=float(schedule["last_run"]["ts"]))
+    return schedule
+
+
+def binary_snapshot_path(path: str) -> str:
+    return os.path.splitext(path)[0] + ".snap"
+
+
+def snapshot_file(path: str) -> str:
+    """
+    The snapshot to load for a database path: its JSON file or its binary ".snap"
+    file, whichever was written last (so switching BANK_SNAPSHOT_FORMAT either way
+    picks up the latest data). Returns the JSON path when neither exists.
+    """
+    candidates = []
+    for candidate in (path, binary_snapshot_path(path)):
+        try:
+            candidates.append((os.stat(candidate).st_mtime_ns, candidate))
+        except FileNotFoundError:
+            pass
+    return max(candidates)[1] if candidates else path
+
+
+def read_table(path: str) -> Tuple["AccountTable", int]:
+    """Loads the latest snapshot of a database path. Returns the table and the journal seq it covers."""
+    file = snapshot_file(path)
+    if file != path:
+        from .binary_snapshot import read_binary_snapshot
+        return read_binary_snapshot(file)
+    snapshot = read_snapshot(file)
+    return AccountTable.from_snapshot(snapshot), snapshot["seq"]
+
+
+def write_table(path: str, table: "AccountTable", seq: int) -> None:
+    """Writes a table as the snapshot of a database path, in SNAPSHOT_FORMAT."""
+    if SNAPSHOT_FORMAT == "binary":
+        from .binary_snapshot import write_binary_snapshot
+        write_binary_snapshot(binary_snapshot_path(path), table, seq)
+    else:
+        write_database_file(path, table.to_snapshot(seq))
+
+
+class AccountTable:
+    """
+    Column-oriented account storage: one list of names, one of PINs and an
+    array of 64-bit balances in cents, plus a dict from normalized name to slot.
+    An account costs a few pointers and 8 bytes instead of a whole dict.
+    """
+
+    def __init__(self):
+        self.names: List[str] = []
+        self.pins: List[str] = []
+        self.balances = array("q")
+        self.slots: Dict[str, int] = {}
+        # Normalized names in sorted order, built on the first directory search
+        self._sorted_keys: Optional[List[str]] = None
+        # Only used by shards (backend/sharded_store.py): credits to other shards that
+        # were debited here but not handed over yet (txid -> sender and items), and
+        # how many bytes of this shard's inbox have been applied
+        self.outbound: Dict[str, Dict[str, Any]] = {}
+        self.inbox_offset = 0
+        # Scheduled transfers by normalized sender name, then by id
+        self.schedules: Dict[str, Dict[str, Dict[str, Any]]] = {}
+
+    @classmethod
+    def from_users(cls, users: List[Dict[str, Any]]) -> "AccountTable":
+        table = cls()
+        for user in users:
+            table.add(user["name"], user["pin_number"], to_cents(user["bank_balance"]))
+        return table
+
+    @classmethod
+    def from_snapshot(cls, snapshot: Dict[str, Any]) -> "AccountTable":
+        table = cls.from_users(snapshot["users"])
+        table.outbound = dict(snapshot.get("outbound", {}))
+        table.inbox_offset = snapshot.get("inbox_offset", 0)
+        table.add_schedules(_schedule_times_as_float(schedule) for schedule in snapshot.get("schedules", ()))
+        return table
+
+    def to_snapshot(self, seq: int) -> Dict[str, Any]:
+        """Returns the snapshot content covering the journal up to `seq`."""
+        snapshot = {"users": self.to_users(), "seq": seq}
+        # Left out when unused, so an unsharded database.json keeps its layout
+        if self.outbound:
+            snapshot["outbound"] = self.outbound
+        if self.inbox_offset:
+            snapshot["inbox_offset"] = self.inbox_offset
+        if self.schedules:
+            snapshot["schedules"] = self.all_schedules()
+        return snapshot
+
+    def add_schedules(self, schedules: Iterable[Dict[str, Any]]) -> None:
+        for schedule in schedules:
+            self.schedules.setdefault(normalize_name(schedule["sender"]), {})[schedule["id"]] = dict(schedule)
+
+    def schedule(self, run: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """The schedule a run or update refers to (by "sender" and "id"), or None."""
+        return self.schedules.get(normalize_name(run["sender"]), {}).get(run["id"])
+
+    def all_schedules(self) -> List[Dict[str, Any]]:
+        return [schedule for by_id in self.schedules.values() for schedule in by_id.values()]
+
+    def add(self, name: str, pin_number: str, balance_cents: int) -> int:
+        key = normalize_name(name)
+        slot = self.slots.get(key)
+        if slot is None:
+            slot = len(self.names)
+            self.slots[key] = slot
+            self._sorted_keys = None
+            self.names.append(name)
+            self.pins.append(pin_number)
+            self.balances.append(balance_cents)
+        else:
+            # Like the old dict index, a later duplicate wins
+            self.names[slot] = name
+            self.pins[slot] = pin_number
+            self.balances[slot] = balance_cents
+        return slot
+
+    def slot(self, name: str) -> Optional[int]:
+        return self.slots.get(normalize_name(name))
+
+    def balance(self, name: str) -> int:
+        return self.balances[self.slots[normalize_name(name)]]
+
+    def touched_slots(self, record: Dict[str, Any]) -> List[int]:
+        """The slots of the accounts whose balance a journal record changes."""
+        op = record["op"]
+        if op == "deposit":
+            names = [record["name"]]
+        elif op == "transfer":
+            names = [record["sender"], record["receiver"]]
+        elif op == "batch_transfer":
+            names = [record["sender"]] + [name for name, _ in record_items_cents(record)]
+        elif op == "transfer_in":
+            names = [record["receiver"]]
+        elif op == "bulk":
+            names = [name for name, _ in record["changes_cents"]]
+        elif op == "scheduled_transfers":
+            names = [name for sender, receiver, _ in record["transfers_cents"] for name in (sender, receiver)]
+            names += [sender for _, sender, _ in record.get("outbound", ())]
+        else:
+            names = []
+        return [self.slots[normalize_name(name)] for name in names]
+
+    def record(self, slot: int) -> Dict[str, Any]:
+        return {"name": self.names[slot], "pin_number": self.pins[slot], "balance_cents": self.balances[slot]}
+
+    def search(self, prefix: str, after: Optional[str], limit: int) -> List[str]:
+        """
+        Returns up to `limit` names whose normalized form starts with `prefix`,
+        in sorted order, starting after the normalized name `after`.
+        """
+        keys = self._sorted_keys
+        if keys is None:
+            keys = self._sorted_keys = sorted(self.slots)
+        prefix = normalize_name(prefix)
+        start = bisect_left(keys, prefix)
+        if after is not None:
+            start = max(start, bisect_right(keys, after))
+        names = []
+        for key in keys[start:start + limit]:
+            if not key.startswith(prefix):
+                break
+            names.append(self.names[self.slots[key]])
+        return names
+
+    def to_users(self) -> List[Dict[str, Any]]:
+        """Returns the accounts in the database.json layout."""
+        return [
+            {"name": name, "pin_number": pin, "bank_balance": to_json_number(cents)}
+            for name, pin, cents in zip(self.names, self.pins, self.balances)
+        ]
+
+    def apply(self, record: Dict[str, Any], sign: int = 1) -> None:
+        """Applies a journal record (sign=-1 undoes a balance change)."""
+        op = record["op"]
+        if op == "deposit":
+            self.balances[self.slots[normalize_name(record["name"])]] += sign * record_cents(record)
+        elif op == "transfer":
+            cents = sign * record_cents(record)
+            self.balances[self.slots[normalize_name(record["sender"])]] -= cents
+            self.balances[self.slots[normalize_name(record["receiver"])]] += cents
+        elif op == "batch_transfer":
+            sender = self.slots[normalize_name(record["sender"])]
+            for receiver_name, cents in record_items_cents(record):
+                self.balances[sender] -= sign * cents
+                self.balances[self.slots[normalize_name(receiver_name)]] += sign * cents
+            # Items for accounts of other shards are only debited here
+            for _, cents in record.get("outbound_cents", ()):
+                self.balances[sender] -= sign * cents
+            if "outbound_cents" in record:
+                if sign > 0:
+                    self.outbound[record["txid"]] = {
+                        "sender": record["sender"],
+                        "items_cents": record["outbound_cents"],
+                        "inbox_from": record.get("inbox_from"),
+                    }
+                else:
+                    self.outbound.pop(record["txid"], None)
+        elif op == "transfer_in":
+            self.balances[self.slots[normalize_name(record["receiver"])]] += sign * record["cents"]
+            start, end = record["inbox"]
+            self.inbox_offset = end if sign > 0 else start
+        elif op == "bulk":
+            balances, slots = self.balances, self.slots
+            for name, cents in record["changes_cents"]:
+                balances[slots[normalize_name(name)]] += sign * cents
+        elif op == "scheduled_transfers":
+            for sender, receiver, cents in record["transfers_cents"]:
+                self.balances[self.slots[normalize_name(sender)]] -= sign * cents
+                self.balances[self.slots[normalize_name(receiver)]] += sign * cents
+            # Shards only: credits to accounts of other shards, one outbound transfer per sender
+            for txid, sender, items_cents in record.get("outbound", ()):
+                for _, cents in items_cents:
+                    self.balances[self.slots[normalize_name(sender)]] -= sign * cents
+                if sign > 0:
+                    self.outbound[txid] = {"sender": sender, "items_cents": items_cents, "inbox_from": record.get("inbox_from")}
+                else:
+                    self.outbound.pop(txid, None)
+            for update in record["schedules"]:
+                apply_schedule_update(self.schedule(update), update, record.get("ts") or 0, sign)
+        elif op == "schedule_add":
+            self.add_schedules([record["schedule"]])
+        elif op == "schedule_remove":
+            by_id = self.schedules.get(normalize_name(record["sender"]), {})
+            by_id.pop(record["id"], None)
+            if not by_id:
+                self.schedules.pop(normalize_name(record["sender"]), None)
+        elif op == "transfer_sent":
+            self.outbound.pop(record["txid"], None)
+        elif op == "inbox_skip":
+            self.inbox_offset = record["inbox"][1]
+            refund = record.get("refund")
+            if refund is not None:
+                # The skipped credit, sent back as an outbound credit of this shard
+                self.outbound[refund["id"]] = {"entries": refund["entries"], "inbox_from": refund["inbox_from"]}
+        elif op == "set_pin":
+            self.pins[self.slots[normalize_name(record["name"])]] = record["pin_number"]
+        else:
+            raise ValueError(f"Unknown journal operation: {op}")
+
+
+class Snapshot:
+    """
+    An immutable view of the committed balances, read without any lock.
+
+    `base` is a frozen copy of the balance column (with `base_versions`, the
+    version at which each account last changed) and `overlay` maps the slots
+    changed since then to their (balance, version). Writers never modify a
+    Snapshot: after each commit they publish a new one (copying only the
+    overlay) and swap it in with a single assignment, so a reader sees a
+    transfer either entirely or not at all. Once the overlay grows past
+    SNAPSHOT_FOLD_EVERY entries it is folded into fresh copies of the base.
+    """
+
+    __slots__ = ("version", "slots", "base", "base_versions", "overlay")
+
+    def __init__(
+        self,
+        version: int,
+        slots: Dict[str, int],
+        base: array,
+        base_versions: array,
+        overlay: Dict[int, Tuple[int, int]],
+    ):
+        self.version = version
+        # Shared with the AccountTable: slots are only ever added while a table is built
+        self.slots = slots
+        self.base = base
+        self.base_versions = base_versions
+        self.overlay = overlay
+
+    @classmethod
+    def of_table(cls, table: AccountTable, version: int) -> "Snapshot":
+        """A first snapshot of a table, with every account at `version`."""
+        return cls(version, table.slots, array("q", table.balances), array("q", [version]) * len(table.balances), {})
+
+    def balance(self, name: str) -> Optional[Tuple[int, int]]:
+        """Returns an account's balance and the version of its last change, or None."""
+        slot = self.slots.get(normalize_name(name))
+        if slot is None:
+            return None
+        changed = self.overlay.get(slot)
+        return (self.base[slot], self.base_versions[slot]) if changed is None else changed
+
+    def publish(self, changes: Dict[int, int]) -> "Snapshot":
+        """Returns the next version, with the given slot balances changed."""
+        version = self.version + 1
+        changed = {slot: (cents, version) for slot, cents in changes.items()}
+        if len(self.overlay) + len(changed) <= SNAPSHOT_FOLD_EVERY:
+            return Snapshot(version, self.slots, self.base, self.base_versions, {**self.overlay, **changed})
+        base, base_versions = array("q", self.base), array("q", self.base_versions)
+        for overlay in (self.overlay, changed):
+            for slot, (cents, changed_at) in overlay.items():
+                base[slot] = cents
+                base_versions[slot] = changed_at
+        return Snapshot(version, self.slots, base, base_versions, {})
+
+
+class AccountStore(Storage):
+    """
+    JSON storage backend. Keeps every account in memory in an AccountTable.
+
+    The snapshot (the database file) is parsed once, on first use, and the
+    journal written since that snapshot is replayed on top of it. Mutations are
+    appended to the journal as small records, and a background thread folds the
+    journal back into the snapshot every COMPACT_EVERY records.
+
+    From load to close the store holds an exclusive lock on "<base>.lock", so a
+    second process (e.g. python -m backend.bulk next to the API) can't open it too.
+    """
+
+    in_memory = True
+
+    def __init__(self, path: str, compact_every: int = COMPACT_EVERY):
+        self.path = path
+        self.compact_every = compact_every
+        base = os.path.splitext(path)[0]
+        self.journal = Journal(base + ".journal")
+        self._rotated_path = base + ".journal.compacting"
+        self.history = TransactionHistory(base + ".history")
+        # None when the caller locks the files itself (see Shard)
+        self.lock_path: Optional[str] = base + ".lock"
+        self._lock_file = None
+        self._table = AccountTable()
+        self._snapshot = Snapshot.of_table(self._table, 0)
+        self._publish_lock = threading.Lock()
+        self._loaded = False
+        self._load_lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self._compactor: Optional[threading.Thread] = None
+        self._account_locks: Dict[str, threading.Lock] = {}
+        # Operations holding account locks, and whether a whole-table operation wants them to drain
+        self._gate = threading.Condition()
+        self._active = 0
+        self._exclusive = False
+
+    def load(self) -> None:
+        """Rebuilds the accounts from the last snapshot plus the journal tail."""
+        with self._compact_lock:
+            self._acquire()
+            try:
+                table, seq = read_table(self.path)
+                self.history.load(seq)
+                for record in self._journal_tail(seq):
+                    table.apply(record)
+                    # Fills in entries lost if we crashed between the journal and history writes
+                    self.history.add(record, table.balance)
+                    seq = record["seq"]
+            except Exception:
+                self._release()
+                raise
+            self._table = table
+            # Versions continue from the journal position, so they keep growing across restarts
+            self._snapshot = Snapshot.of_table(table, seq)
+            self.journal.close()
+            self.journal.open(seq)
+            self._loaded = True
+
+    def read(self) -> Tuple[AccountTable, int]:
+        """
+        Reads the accounts (the snapshot plus the journal tail) under the store's
+        lock without loading the store, so nothing is compacted or rewritten: e.g.
+        the source of a migration. Returns the table and the last journal seq.
+        """
+        with self._compact_lock:
+            # Kept if this process already holds it (the store is loaded)
+            held = self._lock_file is not None
+            self._acquire()
+            try:
+                table, seq = read_table(self.path)
+                for record in self._journal_tail(seq):
+                    table.apply(record)
+                    seq = record["seq"]
+                return table, seq
+            finally:
+                if not held:
+                    self._release()
+
+    def _journal_tail(self, seq: int) -> Iterator[Dict[str, Any]]:
+        # A rotated journal left by an interrupted compaction comes before the live one
+        for path in (self._rotated_path, self.journal.path):
+            for record in read_records(path):
+                if record["seq"] > seq:
+                    seq = record["seq"]
+                    yield record
+
+    def _acquire(self) -> None:
+        if self.lock_path is None or self._lock_file is not None:
+            # Not locked here, or already held (load again in the same process)
+            return
+        f = open(self.lock_path, "a")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            raise RuntimeError(f"{self.path} is already in use by another process.")
+        self._lock_file = f
+
+    def _release(self) -> None:
+        if self._lock_file is not None:
+            # Closing the file releases the lock
+            self._lock_file.close()
+            self._lock_file = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def _publish(self, slots: List[int]) -> None:
+        # Called under the locks of these accounts, once their change is durable
+        balances = self._table.balances
+        with self._publish_lock:
+            self._snapshot = self._snapshot.publish({slot: balances[slot] for slot in slots})
+
+    def snapshot(self) -> Snapshot:
+        """The latest published Snapshot. Holding on to it gives a consistent view."""
+        self._ensure_loaded()
+        return self._snapshot
+
+    def balance(self, name: str) -> Optional[Tuple[int, int]]:
+        return self.snapshot().balance(name)
+
+    def version(self) -> int:
+        return self.snapshot().version
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        with self._load_lock:
+            if not self._loaded:
+                self.load()
+
+    def get(self, name: str) -> Optional[Dict[str, Any]]:
+        """Returns the account record for a name, or None if there is no such account."""
+        self._ensure_loaded()
+        slot = self._table.slot(name)
+        return self._table.record(slot) if slot is not None else None
+
+    def names(self) -> List[str]:
+        """Returns the names of all accounts, in file order."""
+        self._ensure_loaded()
+        return list(self._table.names)
+
+    def search_names(self, prefix: str = "", after: Optional[str] = None, limit: int = 50) -> List[str]:
+        self._ensure_loaded()
+        return self._table.search(prefix, after, limit)
+
+    def transactions(
+        self, name: str, before: Optional[int], start: Optional[float], end: Optional[float], limit: int
+    ) -> List[Dict[str, Any]]:
+        self._ensure_loaded()
+        return self.history.page(name, before, start, end, limit)
+
+    @contextmanager
+    def locked(self, *names: str) -> Iterator[None]:
+        """
+        Holds the locks of the given accounts. Locks are always taken in sorted
+        key order, so two transfers can never wait on each other in a cycle, and
+        operations on unrelated accounts don't wait at all.
+        """
+        with self._gate:
+            while self._exclusive:
+                self._gate.wait()
+            self._active += 1
+        keys = sorted({normalize_name(name) for name in names})
+        locks = [self._account_locks.setdefault(key, threading.Lock()) for key in keys]
+        for lock in locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+            with self._gate:
+                self._active -= 1
+                if not self._active:
+                    self._gate.notify_all()
+
+    @contextmanager
+    def exclusive(self) -> Iterator[None]:
+        """
+        Holds every account at once: new operations wait at locked(), and this
+        waits for the running ones to finish. Meant for rare whole-table changes.
+        """
+        with self._gate:
+            while self._exclusive:
+                self._gate.wait()
+            self._exclusive = True
+            while self._active:
+                self._gate.wait()
+        try:
+            yield
+        finally:
+            with self._gate:
+                self._exclusive = False
+                self._gate.notify_all()
+
+    def data(self) -> Dict[str, Any]:
+        """Returns the in-memory database content in the database.json layout."""
+        self._ensure_loaded()
+        return {"users": self._table.to_users()}
+
+    def apply(self, record: Dict[str, Any]) -> None:
+        """
+        Journals a validated deposit/transfer record and applies it in memory.
+        Returns once the record is durable; with group commit that is when its batch is flushed.
+        """
+        self._ensure_loaded()
+        record["ts"] = time.time()
+        # Applied in memory right away so the next operation validates against it,
+        # while the journal write can be batched with other callers
+        durable = self.journal.submit(record)
+        self._table.apply(record)
+        try:
+            seq = durable.result()
+        except Exception:
+            self._table.apply(record, sign=-1)
+            raise
+        # Still under the account locks, so each account's entries are appended in order
+        self.history.add(dict(record, seq=seq), self._table.balance)
+        self._publish(self._table.touched_slots(record))
+        if self.journal.records_since_rotation >= self.compact_every:
+            self._start_compaction()
+
+    def deposit(self, name: str, cents: int) -> int:
+        self._ensure_loaded()
+        slot = self._table.slot(name)
+        if slot is None:
+            raise ValueError("Deposit failed: User not found.")
+
+        account_name = self._table.names[slot]
+        with self.locked(account_name):
+            self.apply({"op": "deposit", "name": account_name, "cents": cents})
+            return self._table.balances[slot]
+
+    def transfer(self, sender_name: str, receiver_name: str, cents: int) -> Tuple[int, int]:
+        self._ensure_loaded()
+        sender = self._table.slot(sender_name)
+        receiver = self._table.slot(receiver_name)
+
+        if sender is None:
+            raise ValueError("Transfer failed: Sender not found.")
+        if receiver is None:
+            raise ValueError("Transfer failed: Receiver not found.")
+
+        balances = self._table.balances
+        names = self._table.names
+        # Only the two accounts involved are locked, so transfers between other
+        # accounts proceed in parallel
+        with self.locked(names[sender], names[receiver]):
+            if balances[sender] < cents:
+                raise ValueError("Transfer failed: Insufficient funds.")
+
+            self.apply({
+                "op": "transfer",
+                "sender": names[sender],
+                "receiver": names[receiver],
+                "cents": cents,
+            })
+            return balances[sender], balances[receiver]
+
+    def transfer_batch(
+        self, sender_name: str, items: List[Tuple[str, int]], atomic: bool
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        sender = self.get(sender_name)
+        if not sender:
+            raise ValueError("Transfer failed: Sender not found.")
+
+        receivers = {normalize_name(name): self.get(name) for name, _ in items}
+        with self.locked(sender["name"], *(user["name"] for user in receivers.values() if user)):
+            # Re-read under the locks: the balance may have moved since the lookup above
+            sender = self.get(sender_name)
+            results, accepted = plan_batch_transfer(
+                sender, items, lambda name: receivers[normalize_name(name)], atomic
+            )
+            if accepted:
+                # The whole batch is a single journal record
+                self.apply({"op": "batch_transfer", "sender": sender["name"], "items_cents": accepted})
+            return results, self._table.balances[self._table.slot(sender_name)]
+
+    def apply_bulk(self, rule: Dict[str, Any], dry_run: bool) -> Dict[str, int]:
+        self._ensure_loaded()
+        with self.exclusive():
+            changes = bulk_changes(self._table.balances, rule)
+            summary = bulk_summary(self._table.balances, changes)
+            if summary["changed"] and not dry_run:
+                # One journal record with every account's change, so replaying it needs no rule logic
+                names = self._table.names
+                changed = [(names[slot], cents) for slot, cents in enumerate(changes) if cents]
+                self.apply({"op": "bulk", **rule, "changes_cents": changed})
+            return summary
+
+    def schedules(self, name: Optional[str] = None) -> List[Dict[str, Any]]:
+        self._ensure_loaded()
+        if name is None:
+            schedules = self._table.all_schedules()
+        else:
+            schedules = list(self._table.schedules.get(normalize_name(name), {}).values())
+        return [dict(schedule) for schedule in schedules]
+
+    def add_schedule(self, schedule: Dict[str, Any]) -> None:
+        self._ensure_loaded()
+        with self.locked(schedule["sender"]):
+            # Like a PIN change: journaled before it's applied, so nothing needs undoing
+            self.journal.append({"op": "schedule_add", "schedule": schedule})
+            self._table.add_schedules([schedule])
+
+    def remove_schedule(self, sender_name: str, schedule_id: str) -> None:
+        self._ensure_loaded()
+        with self.locked(sender_name):
+            schedule = self._table.schedule({"sender": sender_name, "id": schedule_id})
+            if schedule is None:
+                raise ValueError("Scheduled transfer not found.")
+            record = {"op": "schedule_remove", "sender": schedule["sender"], "id": schedule_id}
+            self.journal.append(record)
+            self._table.apply(record)
+
+    def run_schedules(self, runs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        self._ensure_loaded()
+        schedules = [self._table.schedule(run) for run in runs]
+        names = {name for schedule in schedules if schedule for name in (schedule["sender"], schedule["receiver"])}
+        with self.locked(*names):
+            updates, accepted = plan_schedule_runs(runs, self._table.schedule, self.get)
+            if updates:
+                # The transfers and the schedules' progress are one journal record: a run is never half done
+                self.apply({"op": "scheduled_transfers", "transfers_cents": accepted, "schedules": updates})
+            return [dict(self._table.schedule(update)) for update in updates]
+
+    def set_pin(self, name: str, pin_number: str) -> None:
+        self._ensure_loaded()
+        slot = self._table.slot(name)
+        if slot is None:
+            raise ValueError("User not found.")
+
+        account_name = self._table.names[slot]
+        with self.locked(account_name):
+            # Written before the in-memory change: a PIN update can't be undone like a balance one
+            self.journal.append({"op": "set_pin", "name": account_name, "pin_number": pin_number})
+            self._table.pins[slot] = pin_number
+
+    def replace(self, data: Dict[str, Any]) -> None:
+        """Replaces the whole database content and persists it as a new snapshot."""
+        self._ensure_loaded()
+        table = AccountTable.from_users(data.get("users", []))
+        # Operations holding account locks work with slots of the current table: let them finish first
+        with self.exclusive(), self._compact_lock, self.journal.lock:
+            # Scheduled transfers aren't part of the database.json layout: they stay
+            table.schedules = self._table.schedules
+            # Every record journaled so far is superseded by this snapshot
+            write_table(self.path, table, self.journal.last_seq)
+            self._table = table
+            with self._publish_lock:
+                self._snapshot = Snapshot.of_table(table, self._snapshot.version + 1)
+
+    def _start_compaction(self) -> None:
+        if self._compactor is not None and self._compactor.is_alive():
+            return
+        self._compactor = threading.Thread(target=self.compact, name="journal-compactor", daemon=True)
+        self._compactor.start()
+
+    def compact(self) -> None:
+        """Folds the journal into a new snapshot and starts an empty journal."""
+        with self._compact_lock:
+            # A rotated journal left behind by an interrupted compaction goes first
+            if os.path.exists(self._rotated_path):
+                self._fold(self._rotated_path)
+            if self.journal.rotate(self._rotated_path):
+                self._fold(self._rotated_path)
+
+    def _fold(self, journal_path: str) -> None:
+        # Works on a fresh copy read from disk so the live accounts are never touched
+        table, seq = read_table(self.path)
+        for record in read_records(journal_path):
+            if record["seq"] > seq:
+                table.apply(record)
+                # Usually already there; covers a record whose writer hasn't got to its history entries yet
+                self.history.add(record, table.balance)
+                seq = record["seq"]
+        # The journal records are about to be dropped: their history entries must be on disk first
+        self.history.sync()
+        write_table(self.path, table, seq)
+        self.history.forget_through(seq)
+        self.history.checkpoint()
+        os.remove(journal_path)
+
+    def close(self) -> None:
+        """Compacts whatever is left in the journal and closes it."""
+        if not self._loaded:
+            return
+        if self._compactor is not None:
+            self._compactor.join()
+        self.compact()
+        self.journal.close()
+        # So the next startup doesn't parse what was written since the last checkpoint
+        self.history.checkpoint(force=True)
+        self.history.close()
+        self._release()
@@ -1,43 +1,129 @@
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
+from decimal import Decimal
+from typing import List, Literal, Optional
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel, Field
 from . import bank
+from .idempotency import run_idempotent
+from .money import json_amounts
+from .sessions import SessionError, check_session
+from .storage import ShardNotOwnedError
 
 router = APIRouter()
 
 class TransferRequest(BaseModel):
     sender_name: str
-    sender_pin_number: str
+    # Not needed when a session token is sent in the Authorization header
+    sender_pin_number: Optional[str] = None
     receiver_name: str
-    amount: float
+    # Exact decimal amount with at most two decimal places (a JSON number or string)
+    amount: Decimal
+
+class BatchTransferItem(BaseModel):
+    receiver_name: str
+    # Exact decimal amount with at most two decimal places (a JSON number or string)
+    amount: Decimal
+
+class BatchTransferRequest(BaseModel):
+    sender_name: str
+    sender_pin_number: Optional[str] = None
+    items: List[BatchTransferItem] = Field(min_length=1, max_length=10000)
+    # "all_or_nothing": any invalid item rejects the whole batch
+    # "best_effort": valid items are applied, invalid ones are reported
+    mode: Literal["all_or_nothing", "best_effort"] = "all_or_nothing"
+
+async def authenticate_sender(sender_name: str, sender_pin_number: Optional[str], authorization: Optional[str]) -> None:
+    """Authenticates the sender with a session token if one was sent, or with the PIN otherwise."""
+    if check_session(authorization, sender_name):
+        return
+    if sender_pin_number is None:
+        raise SessionError("Authentication failed: Provide the sender PIN or a session token.")
+    await bank.authenticate_async(sender_name, sender_pin_number)
 
 @router.post("/bank-transfer")
-async def transfer_funds(request: TransferRequest):
+async def transfer_funds(
+    request: TransferRequest,
+    authorization: Optional[str] = Header(None),
+    idempotency_key: Optional[str] = Header(None),
+):
     """
-    Handles transferring funds from one user to another after authenticating the sender.
+    Handles transferring funds from one user to another after authenticating the sender
+    (by session token or PIN).
+    With an Idempotency-Key header, retries of the same request return the first response instead of transferring again.
     Returns a success message and the new balances for both users, or an error message on failure.
     """
-    try:
-        # 1. Authenticate sender
-        authenticated = bank.authenticate(request.sender_name, request.sender_pin_number)
-        if not authenticated:
-            # This case is unlikely if bank.authenticate raises ValueError, but included for safety
-            raise ValueError("Authentication failed for sender.")
-
-        # 2. Perform the transfer (deducts from sender, adds to receiver)
-        bank.transfer(request.sender_name, request.receiver_name, request.amount)
-        
-        # 3. Get updated balances
-        sender_new_balance = bank.get_balance(request.sender_name)
-        receiver_new_balance = bank.get_balance(request.receiver_name)
+    async def transfer():
+        try:
+            # 1. Authenticate sender
+            await authenticate_sender(request.sender_name, request.sender_pin_number, authorization)
+
+            # 2. Perform the transfer (deducts from sender, adds to receiver)
+            await bank.transfer_async(request.sender_name, request.receiver_name, request.amount)
+
+            # 3. Get updated balances
+            sender_new_balance = await bank.get_balance_async(request.sender_name)
+            try:
+                receiver_new_balance = await bank.get_balance_async(request.receiver_name)
+            except ShardNotOwnedError:
+                # The receiver's shard is served by another worker, which applies the credit
+                receiver_new_balance = None
+
+            return {
+                "message": "Transfer successful.",
+                "sender_new_balance": json_amounts(sender_new_balance),
+                "receiver_new_balance": json_amounts(receiver_new_balance)
+            }
+        except SessionError as e:
+            raise HTTPException(status_code=401, detail=str(e))
+        except ValueError as e:
+            # Catches errors from both authenticate() and transfer()
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
+
+    return await run_idempotent(idempotency_key, "bank-transfer", request.sender_name, request, authorization, transfer)
+
+
+@router.post("/bank-transfer/batch")
+async def transfer_funds_batch(
+    request: BatchTransferRequest,
+    authorization: Optional[str] = Header(None),
+    idempotency_key: Optional[str] = Header(None),
+):
+    """
+    Transfers funds from one authenticated sender to many receivers (e.g. payroll).
+    The sender is authenticated once and the whole batch is persisted in one step.
+    With an Idempotency-Key header, retries of the same batch return the first response instead of paying again.
+    Returns a result for every item and the sender's new balance.
+    """
+    async def transfer_batch():
+        try:
+            await authenticate_sender(request.sender_name, request.sender_pin_number, authorization)
+
+            outcome = await bank.transfer_batch_async(
+                request.sender_name,
+                [(item.receiver_name, item.amount) for item in request.items],
+                atomic=request.mode == "all_or_nothing",
+            )
+        except SessionError as e:
+            raise HTTPException(status_code=401, detail=str(e))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
+
+        if request.mode == "all_or_nothing" and outcome["failed"]:
+            raise HTTPException(status_code=400, detail=jsonable_encoder({
+                "message": "Batch transfer rejected: no transfers were applied.",
+                "results": json_amounts(outcome["results"]),
+            }))
 
         return {
-            "message": "Transfer successful.",
-            "sender_new_balance": sender_new_balance,
-            "receiver_new_balance": receiver_new_balance
+            "message": "Batch transfer processed.",
+            "mode": request.mode,
+            **json_amounts(outcome),
         }
-    except ValueError as e:
-        # Catches errors from both authenticate() and transfer()
-        raise HTTPException(status_code=400, detail=str(e))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
 
+    return await run_idempotent(
+        idempotency_key, "bank-transfer/batch", request.sender_name, request, authorization, transfer_batch
+    )
@@ -1,16 +1,21 @@
-from fastapi import APIRouter, HTTPException
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Query
 from . import bank
 
 router = APIRouter()
 
 @router.get("/users")
-async def get_users():
+async def get_users(
+    prefix: str = Query("", max_length=100),
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=1000),
+):
     """
-    Retrieves a list of all user names.
+    Retrieves one page of user names, sorted case-insensitively.
+    `prefix` keeps only the names starting with it (case-insensitive). Pass the
+    returned `next_cursor` as `cursor` to get the next page; it is null on the last page.
     """
     try:
-        user_names = bank.get_all_user_names()
-        return {"users": user_names}
+        return await bank.search_user_names_async(prefix, cursor, limit)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
-
@@ -0,0 +1,264 @@
+"""
+Load-testing benchmark for the banking API.
+
+Drives backend.main:app in-process through an ASGI client, or a running
+uvicorn server, with a weighted mix of /authenticate, /deposit,
+/bank-transfer and /users requests, and reports throughput and
+p50/p95/p99 latency per endpoint.
+
+    # In-process, against generated databases of 10 and 10,000 accounts
+    python -m benchmarks.api_bench --sizes 10,10000 --output results.json
+
+    # Against a running server (start it on a database made with --prepare)
+    python -m benchmarks.api_bench --prepare /tmp/bench --sizes 100000
+    cd /tmp/bench/100000 && uvicorn backend.main:app --port 8000
+    python -m benchmarks.api_bench --url http://127.0.0.1:8000 --sizes 100000
+
+    # Flag regressions against a stored baseline (exit code 1 on regression)
+    python -m benchmarks.api_bench --sizes 10,10000 --save-baseline benchmarks/baseline.json
+    python -m benchmarks.api_bench --sizes 10,10000 --baseline benchmarks/baseline.json
+
+Requires httpx.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+DEFAULT_MIX = "authenticate=1,deposit=4,transfer=4,users=1"
+PIN = "1234"
+
+
+def parse_mix(text: str) -> Dict[str, int]:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ("authenticate", "deposit", "transfer", "users"):
+            raise SystemExit(f"Unknown operation in --mix: {name}")
+        mix[name] = int(weight or 1)
+    return mix
+
+
+def account_name(i: int) -> str:
+    return f"user{i:07d}"
+
+
+def write_database(path: str, accounts: int) -> None:
+    """Writes a database.json with the given number of accounts, all with the same PIN."""
+    from backend.pins import hash_pin
+    # One hash shared by every account: hashing a million PINs would take hours
+    pin_hash = hash_pin(PIN)
+    with open(path, "w") as f:
+        f.write('{"users": [\n')
+        for i in range(accounts):
+            separator = ",\n" if i else ""
+            f.write(f'{separator}{{"name": "{account_name(i)}", "pin_number": "{pin_hash}", "bank_balance": 1000000}}')
+        f.write('\n], "seq": 0}\n')
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> Dict[str, Any]:
+    values = sorted(latencies)
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "throughput_rps": len(values) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(values, 0.50) * 1000,
+        "p95_ms": percentile(values, 0.95) * 1000,
+        "p99_ms": percentile(values, 0.99) * 1000,
+    }
+
+
+async def run_load(client: httpx.AsyncClient, accounts: int, mix: Dict[str, int], requests: int, concurrency: int, seed: int) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    operations = [name for name, weight in mix.items() for _ in range(weight)]
+    plan = [rng.choice(operations) for _ in range(requests)]
+
+    # Log a pool of senders in once, so transfers and deposits use session tokens like the frontend
+    tokens: Dict[str, str] = {}
+    for i in rng.sample(range(accounts), min(accounts, concurrency)):
+        response = await client.post("/api/v1/authenticate", json={"name": account_name(i), "pin_number": PIN})
+        tokens[account_name(i)] = response.json()["session_token"]
+    senders = list(tokens)
+
+    latencies: Dict[str, List[float]] = {name: [] for name in mix}
+    errors: Dict[str, int] = {name: 0 for name in mix}
+    queue: "asyncio.Queue[str]" = asyncio.Queue()
+    for operation in plan:
+        queue.put_nowait(operation)
+
+    async def worker(worker_id: int) -> None:
+        local_rng = random.Random(seed * 1000 + worker_id)
+        while True:
+            try:
+                operation = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            sender = local_rng.choice(senders)
+            headers = {"Authorization": f"Bearer {tokens[sender]}"}
+            if operation == "authenticate":
+                request = client.post("/api/v1/authenticate", json={"name": account_name(local_rng.randrange(accounts)), "pin_number": PIN})
+            elif operation == "deposit":
+                request = client.post("/api/v1/deposit", json={"name": sender, "amount": "1.00"}, headers=headers)
+            elif operation == "transfer":
+                receiver = account_name(local_rng.randrange(accounts))
+                if receiver == sender:
+                    receiver = account_name((int(sender[4:]) + 1) % accounts)
+                request = client.post(
+                    "/api/v1/bank-transfer",
+                    json={"sender_name": sender, "receiver_name": receiver, "amount": "0.01"},
+                    headers=headers,
+                )
+            else:
+                # A directory search, as typed into the frontend's search boxes
+                prefix = account_name(local_rng.randrange(accounts))[:7]
+                request = client.get("/api/v1/users", params={"prefix": prefix, "limit": 20})
+            started = time.perf_counter()
+            try:
+                response = await request
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            latencies[operation].append(time.perf_counter() - started)
+            if not ok:
+                errors[operation] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    return {
+        "overall": summarize(all_latencies, sum(errors.values()), elapsed),
+        "endpoints": {name: summarize(latencies[name], errors[name], elapsed) for name in mix},
+    }
+
+
+async def bench_in_process(workdir: str, accounts: int, args: argparse.Namespace) -> Dict[str, Any]:
+    from backend import bank
+    from backend.main import app
+
+    database = os.path.join(workdir, str(accounts), "database.json")
+    os.makedirs(os.path.dirname(database), exist_ok=True)
+    write_database(database, accounts)
+    bank.DATABASE_FILE = database
+    started = time.perf_counter()
+    bank.get_store().load()
+    load_seconds = time.perf_counter() - started
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        result = await run_load(client, accounts, parse_mix(args.mix), args.requests, args.concurrency, args.seed)
+    bank.get_store().close()
+    result["startup_load_seconds"] = load_seconds
+    return result
+
+
+async def bench_remote(url: str, accounts: int, args: argparse.Namespace) -> Dict[str, Any]:
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=None, limits=limits) as client:
+        return await run_load(client, accounts, parse_mix(args.mix), args.requests, args.concurrency, args.seed)
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Returns a description of every metric that regressed by more than the tolerance."""
+    regressions = []
+    for size, run in results["runs"].items():
+        base_run = baseline.get("runs", {}).get(size)
+        if not base_run:
+            continue
+        for scope, metrics in [("overall", run["overall"])] + list(run["endpoints"].items()):
+            base = base_run["overall"] if scope == "overall" else base_run["endpoints"].get(scope)
+            if not base:
+                continue
+            if metrics["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+                regressions.append(f"{size} accounts, {scope}: throughput {metrics['throughput_rps']:.0f} rps (baseline {base['throughput_rps']:.0f})")
+            if metrics["p99_ms"] > base["p99_ms"] * (1 + tolerance):
+                regressions.append(f"{size} accounts, {scope}: p99 {metrics['p99_ms']:.2f} ms (baseline {base['p99_ms']:.2f})")
+    return regressions
+
+
+def print_report(results: Dict[str, Any]) -> None:
+    for size, run in results["runs"].items():
+        print(f"\n{size} accounts" + (f" (startup load {run['startup_load_seconds']:.2f}s)" if "startup_load_seconds" in run else ""))
+        print(f"  {'endpoint':<14}{'requests':>9}{'errors':>8}{'rps':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+        for scope, metrics in [("overall", run["overall"])] + list(run["endpoints"].items()):
+            print(
+                f"  {scope:<14}{metrics['requests']:>9}{metrics['errors']:>8}{metrics['throughput_rps']:>10.0f}"
+                f"{metrics['p50_ms']:>9.2f}{metrics['p95_ms']:>9.2f}{metrics['p99_ms']:>9.2f}"
+            )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10,1000,100000", help="comma-separated account counts")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"weighted operation mix (default {DEFAULT_MIX})")
+    parser.add_argument("--requests", type=int, default=2000, help="requests per database size")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--url", help="benchmark a running server instead of the app in-process")
+    parser.add_argument("--prepare", metavar="DIR", help="only write DIR/<size>/database.json files for --url runs")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="compare against a results file and exit 1 on regressions")
+    parser.add_argument("--save-baseline", help="write the results to this file as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed regression (default 0.10 = 10%%)")
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    if args.prepare:
+        for size in sizes:
+            os.makedirs(os.path.join(args.prepare, str(size)), exist_ok=True)
+            write_database(os.path.join(args.prepare, str(size), "database.json"), size)
+        print(f"Wrote databases for {sizes} under {args.prepare}")
+        return 0
+
+    results: Dict[str, Any] = {
+        "target": args.url or "in-process",
+        "mix": args.mix,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "python": platform.python_version(),
+        "runs": {},
+    }
+    workdir = tempfile.mkdtemp(prefix="bank-bench-")
+    for size in sizes:
+        if args.url:
+            run = asyncio.run(bench_remote(args.url, size, args))
+        else:
+            run = asyncio.run(bench_in_process(workdir, size, args))
+        results["runs"][str(size)] = run
+
+    print_report(results)
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\nRegressions against baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print("\nNo regressions against baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,32 @@
+import json
+import threading
+import time
+from decimal import Decimal
 import streamlit as st
 import requests
 
 # Base URL for the FastAPI backend
 BASE_URL = "http://127.0.0.1:8000/api/v1"
 
-@st.cache_data(ttl=30)  # Cache the user list for 30 seconds
-def get_user_list():
-    """Fetches the list of user names from the backend."""
+# How many matching names the search boxes show
+SEARCH_LIMIT = 20
+# Statement entries per page
+STATEMENT_PAGE_SIZE = 20
+# How often the balance display reads the latest pushed balance (no request is made)
+BALANCE_REFRESH_SECONDS = 1
+# How often the balance is polled instead while the event stream is down
+BALANCE_POLL_SECONDS = 5
+# The backend sends a keep-alive every 15 seconds, so a longer silence means a dead connection
+STREAM_READ_TIMEOUT = 45
+
+def money(amount) -> Decimal:
+    """An amount from the API: a JSON number, or an exact string when too large for a float."""
+    return Decimal(str(amount))
+
+def search_users(prefix):
+    """Fetches the first user names starting with a prefix (case-insensitive) from the backend."""
     try:
-        response = requests.get(f"{BASE_URL}/users")
+        response = requests.get(f"{BASE_URL}/users", params={"prefix": prefix, "limit": SEARCH_LIMIT})
         response.raise_for_status()
         return response.json().get("users", [])
     except requests.exceptions.RequestException:
@@ -18,7 +36,8 @@ def login_page():
     """Displays the login page and handles authentication."""
     with st.container(border=True):
         st.header("Login to Your Bank Account")
-        user_list = get_user_list()
+        search = st.text_input("Search Your Name", key="login_name_search", placeholder="Type the first letters of your name")
+        user_list = search_users(search)
 
         if user_list is None:
             st.error(
@@ -27,7 +46,7 @@ def login_page():
             )
             name = st.text_input("Name", key="login_name", disabled=True)
         elif not user_list:
-            st.warning("No users found in the database.")
+            st.warning("No users match your search." if search else "No users found in the database.")
             name = st.text_input("Name", key="login_name", disabled=True)
         else:
             name = st.selectbox("Select Your Name", options=[""] + user_list, key="login_name_select")
@@ -51,6 +70,7 @@ def login_page():
                     st.session_state["authenticated"] = True
                     st.session_state["name"] = name
                     st.session_state["balance"] = data.get("bank_balance")
+                    st.session_state["session_token"] = data.get("session_token")
                     st.success("Login successful!")
                     st.rerun()
                 else:
@@ -62,18 +82,123 @@ def login_page():
             except Exception as e:
                 st.error(f"An unexpected error occurred: {e}")
 
+def auth_headers():
+    """Returns the Authorization header for the logged-in user's session."""
+    return {"Authorization": f"Bearer {st.session_state.get('session_token', '')}"}
+
+class BalanceListener:
+    """
+    Follows the account's balance event stream on a background thread and keeps the
+    latest (balance, version). Reconnects after a failure, resuming from the last
+    event; stops when asked to or when the backend rejects the session.
+    """
+
+    def __init__(self, name, token):
+        self.name = name
+        self.token = token
+        self.latest = None
+        self.connected = False
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="balance-listener", daemon=True)
+        self._thread.start()
+
+    def is_alive(self):
+        return self._thread.is_alive()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        last_event_id = None
+        while not self._stopped.is_set():
+            headers = {"Authorization": f"Bearer {self.token}", "Accept": "text/event-stream"}
+            if last_event_id is not None:
+                headers["Last-Event-ID"] = last_event_id
+            try:
+                with requests.get(
+                    f"{BASE_URL}/accounts/{self.name}/events",
+                    headers=headers,
+                    stream=True,
+                    timeout=(5, STREAM_READ_TIMEOUT),
+                ) as response:
+                    if response.status_code == 401:
+                        return  # Logged out or expired
+                    if response.status_code == 200:
+                        self.connected = True
+                        for line in response.iter_lines(decode_unicode=True):
+                            if self._stopped.is_set():
+                                return
+                            if line.startswith("id:"):
+                                last_event_id = line[3:].strip()
+                            elif line.startswith("data:"):
+                                event = json.loads(line[5:])
+                                self.latest = (event["balance"], event["version"])
+            except requests.exceptions.RequestException:
+                pass
+            self.connected = False
+            self._stopped.wait(BALANCE_POLL_SECONDS)
+
+def poll_balance():
+    """Fetches the balance unless it is unchanged (the backend answers 304 with no body then)."""
+    headers = auth_headers()
+    if st.session_state.get("balance_etag"):
+        headers["If-None-Match"] = st.session_state["balance_etag"]
+    st.session_state["balance_polled_at"] = time.monotonic()
+    try:
+        response = requests.get(f"{BASE_URL}/accounts/{st.session_state['name']}/balance", headers=headers, timeout=5)
+        if response.status_code == 200:
+            st.session_state["balance"] = response.json().get("balance")
+            st.session_state["balance_etag"] = response.headers.get("ETag")
+    except requests.exceptions.RequestException:
+        pass  # Keep showing the last known balance
+
+@st.fragment(run_every=BALANCE_REFRESH_SECONDS)
+def balance_display():
+    """
+    Shows the balance, kept current by the backend's balance event stream so incoming
+    transfers appear. Only this fragment reruns, and it makes no request while the
+    stream is up; while it is down, the balance is polled every few seconds instead.
+    """
+    listener = st.session_state.get("balance_listener")
+    if listener is None or not listener.is_alive():
+        listener = BalanceListener(st.session_state["name"], st.session_state.get("session_token", ""))
+        st.session_state["balance_listener"] = listener
+    latest = listener.latest
+    if listener.connected and latest is not None:
+        balance, version = latest
+        # Copied only when a new event arrived, so it doesn't undo a balance set by a deposit or transfer
+        if version > st.session_state.get("balance_version", -1):
+            st.session_state["balance"] = balance
+            st.session_state["balance_version"] = version
+    elif time.monotonic() - st.session_state.get("balance_polled_at", 0) >= BALANCE_POLL_SECONDS:
+        poll_balance()
+    st.subheader(f"Your current balance is: ${money(st.session_state.get('balance', 0)):.2f}")
+
 def main_app():
     """Displays the main application interface after login."""
     st.header(f"Welcome, {st.session_state['name']}!")
-    st.subheader(f"Your current balance is: ${st.session_state.get('balance', 0):.2f}")
+    balance_display()
 
     if st.button("Logout"):
+        try:
+            # Revoke the session on the backend so the token can't be reused
+            requests.post(f"{BASE_URL}/logout", headers=auth_headers())
+        except requests.exceptions.RequestException:
+            pass
+        if "balance_listener" in st.session_state:
+            st.session_state["balance_listener"].stop()
         for key in list(st.session_state.keys()):
             del st.session_state[key]
         st.rerun()
 
     st.markdown("---")
 
+    # --- Statement Section ---
+    with st.expander("📄 Statement", expanded=False):
+        statement_section()
+
+    st.markdown("---")
+
     # --- Deposit Section ---
     with st.expander("💰 Make a Deposit", expanded=True):
         st.subheader("Deposit Funds")
@@ -86,11 +211,13 @@ def main_app():
             try:
                 response = requests.post(
                     f"{BASE_URL}/deposit",
-                    json={"name": st.session_state["name"], "amount": deposit_amount}
+                    json={"name": st.session_state["name"], "amount": deposit_amount},
+                    headers=auth_headers(),
                 )
                 response.raise_for_status()
                 data = response.json()
                 st.session_state["balance"] = data.get("new_balance")
+                st.session_state["statement_cursors"] = [None]  # Show the new entry
                 st.success(data.get("message"))
                 st.rerun()
             except requests.exceptions.HTTPError as e:
@@ -100,12 +227,19 @@ def main_app():
 
     st.markdown("---")
 
+    # --- Scheduled Transfers Section ---
+    with st.expander("🗓️ Scheduled Transfers", expanded=False):
+        scheduled_transfers_section()
+
+    st.markdown("---")
+
     # --- Bank Transfer Section ---
     with st.expander("💸 Bank Transfer", expanded=True):
         st.subheader("Transfer Funds")
         st.write(f"You are sending from: **{st.session_state['name']}**")
         
-        user_list = get_user_list()
+        search = st.text_input("Search Receiver", key="receiver_name_search", placeholder="Type the first letters of the receiver's name")
+        user_list = search_users(search)
 
         if user_list is None:
             st.warning("Cannot fetch user list. Bank transfers are currently unavailable.")
@@ -114,15 +248,14 @@ def main_app():
         receivers_list = [user for user in user_list if user != st.session_state["name"]]
 
         if not receivers_list:
-            st.warning("No other users available to transfer to.")
+            st.warning("No other users match your search." if search else "No other users available to transfer to.")
             return
 
         receiver_name = st.selectbox("Select Receiver", options=receivers_list, key="receiver_name_select")
-        sender_pin = st.text_input("Confirm Your PIN", type="password", key="transfer_pin_input")
         transfer_amount = st.number_input("Amount to Transfer", min_value=0.01, step=0.01, format="%.2f", key="transfer_amount_input")
 
         if st.button("Transfer", key="transfer_button"):
-            if not sender_pin or not receiver_name or transfer_amount <= 0:
+            if not receiver_name or transfer_amount <= 0:
                 st.warning("Please fill in all transfer details correctly.")
                 return
                 
@@ -131,19 +264,20 @@ def main_app():
                     f"{BASE_URL}/bank-transfer",
                     json={
                         "sender_name": st.session_state["name"],
-                        "sender_pin_number": sender_pin,
                         "receiver_name": receiver_name,
                         "amount": transfer_amount,
-                    }
+                    },
+                    headers=auth_headers(),
                 )
                 response.raise_for_status()
                 data = response.json()
 
                 st.session_state["balance"] = data.get("sender_new_balance")
+                st.session_state["statement_cursors"] = [None]  # Show the new entry
 
                 st.success(data.get("message"))
-                st.info(f"Your new balance: ${data.get('sender_new_balance'):.2f}")
-                st.info(f"Receiver ({receiver_name})'s new balance: ${data.get('receiver_new_balance'):.2f}")
+                st.info(f"Your new balance: ${money(data.get('sender_new_balance')):.2f}")
+                st.info(f"Receiver ({receiver_name})'s new balance: ${money(data.get('receiver_new_balance')):.2f}")
 
                 st.toast("Updating your balance...")
                 import time
@@ -155,6 +289,142 @@ def main_app():
             except requests.exceptions.RequestException as e:
                 st.error(f"Failed to connect to the backend: {e}")
 
+def scheduled_transfers_section():
+    """Lets the user schedule one-off or recurring transfers and lists the existing ones."""
+    st.subheader("Schedule a Transfer")
+    search = st.text_input("Search Receiver", key="schedule_receiver_search", placeholder="Type the first letters of the receiver's name")
+    user_list = search_users(search)
+    receivers_list = [user for user in (user_list or []) if user != st.session_state["name"]]
+    if user_list is None:
+        st.warning("Cannot fetch user list. Scheduling is currently unavailable.")
+    elif not receivers_list:
+        st.warning("No other users match your search." if search else "No other users available to transfer to.")
+    else:
+        receiver_name = st.selectbox("Select Receiver", options=receivers_list, key="schedule_receiver_select")
+        amount = st.number_input("Amount", min_value=0.01, step=0.01, format="%.2f", key="schedule_amount_input")
+        date_col, time_col = st.columns(2)
+        with date_col:
+            first_date = st.date_input("First transfer on", key="schedule_date_input")
+        with time_col:
+            first_time = st.time_input("At (UTC)", key="schedule_time_input")
+        repeat = st.selectbox("Repeat", options=["Once", "Daily", "Weekly", "Monthly"], key="schedule_repeat_select")
+        end_date = None
+        if repeat != "Once" and st.checkbox("Stop after a date", key="schedule_end_checkbox"):
+            end_date = st.date_input("Last transfer on or before", key="schedule_end_input")
+
+        if st.button("Schedule", key="schedule_button"):
+            json_body = {
+                "receiver_name": receiver_name,
+                "amount": amount,
+                "first_due": f"{first_date.isoformat()}T{first_time.isoformat()}",
+                "interval": None if repeat == "Once" else repeat.lower(),
+                "end": f"{end_date.isoformat()}T23:59:59" if end_date else None,
+            }
+            try:
+                response = requests.post(
+                    f"{BASE_URL}/accounts/{st.session_state['name']}/scheduled-transfers",
+                    json=json_body,
+                    headers=auth_headers(),
+                )
+                response.raise_for_status()
+                st.success("Transfer scheduled.")
+            except requests.exceptions.HTTPError as e:
+                st.error(f"Scheduling failed: {e.response.json().get('detail', 'Unknown error')}")
+            except requests.exceptions.RequestException as e:
+                st.error(f"Failed to connect to the backend: {e}")
+
+    st.subheader("Your Scheduled Transfers")
+    try:
+        response = requests.get(
+            f"{BASE_URL}/accounts/{st.session_state['name']}/scheduled-transfers",
+            headers=auth_headers(),
+        )
+        response.raise_for_status()
+        schedules = response.json().get("scheduled_transfers", [])
+    except requests.exceptions.HTTPError as e:
+        st.error(f"Could not load your scheduled transfers: {e.response.json().get('detail', 'Unknown error')}")
+        return
+    except requests.exceptions.RequestException as e:
+        st.error(f"Failed to connect to the backend: {e}")
+        return
+
+    if not schedules:
+        st.info("No scheduled transfers.")
+        return
+    for schedule in schedules:
+        info_col, cancel_col = st.columns([4, 1])
+        with info_col:
+            next_due = schedule["next_due"][:16].replace("T", " ") if schedule["next_due"] else "finished"
+            st.write(
+                f"**${money(schedule['amount']):.2f}** to **{schedule['receiver_name']}**, "
+                f"{schedule['interval'] or 'once'} — next: {next_due} "
+                f"({schedule['applied']} sent, {schedule['failed']} failed)"
+            )
+            last_run = schedule["last_run"]
+            if last_run and last_run["status"] == "failed":
+                st.caption(f"Last run failed: {last_run['message']}")
+        with cancel_col:
+            if st.button("Cancel", key=f"schedule_cancel_{schedule['id']}"):
+                try:
+                    requests.delete(
+                        f"{BASE_URL}/accounts/{st.session_state['name']}/scheduled-transfers/{schedule['id']}",
+                        headers=auth_headers(),
+                    ).raise_for_status()
+                    st.rerun()
+                except requests.exceptions.HTTPError as e:
+                    st.error(f"Cancel failed: {e.response.json().get('detail', 'Unknown error')}")
+                except requests.exceptions.RequestException as e:
+                    st.error(f"Failed to connect to the backend: {e}")
+
+def statement_section():
+    """Shows the account's statement one page at a time, newest first."""
+    st.subheader("Statement")
+    # Cursors of the pages shown so far; the last one is the current page (None = newest)
+    cursors = st.session_state.setdefault("statement_cursors", [None])
+
+    params = {"limit": STATEMENT_PAGE_SIZE}
+    if cursors[-1] is not None:
+        params["cursor"] = cursors[-1]
+    try:
+        response = requests.get(
+            f"{BASE_URL}/accounts/{st.session_state['name']}/transactions",
+            params=params,
+            headers=auth_headers(),
+        )
+        response.raise_for_status()
+        data = response.json()
+    except requests.exceptions.HTTPError as e:
+        st.error(f"Could not load the statement: {e.response.json().get('detail', 'Unknown error')}")
+        return
+    except requests.exceptions.RequestException as e:
+        st.error(f"Failed to connect to the backend: {e}")
+        return
+
+    transactions = data.get("transactions", [])
+    if not transactions:
+        st.info("No transactions yet.")
+    else:
+        st.table([
+            {
+                "Date": entry["timestamp"][:19].replace("T", " "),
+                "Type": entry["type"].replace("_", " ").title(),
+                "Counterparty": entry["counterparty"] or "",
+                "Amount": f"{money(entry['amount']):+.2f}",
+                "Balance": f"{money(entry['balance']):.2f}",
+            }
+            for entry in transactions
+        ])
+
+    newer_col, older_col = st.columns(2)
+    with newer_col:
+        if st.button("Newer", key="statement_newer", disabled=len(cursors) == 1):
+            cursors.pop()
+            st.rerun()
+    with older_col:
+        if st.button("Older", key="statement_older", disabled=data.get("next_cursor") is None):
+            cursors.append(data["next_cursor"])
+            st.rerun()
+
 def main():
     st.set_page_config(layout="wide", page_title="Gemini Bank")
 
@@ -0,0 +1,125 @@
+"""
+Concurrency stress check for backend/bank.py.
+
+Runs random transfers between a set of accounts from many threads and checks
+that no money was created or lost, both in memory and after reloading the
+database from disk. With the JSON backend, a reader thread also sums every
+published snapshot while the transfers run: none may show a transfer half-applied.
+
+    python -m scripts.stress_transfers --accounts 50 --threads 16 --transfers 500
+
+The storage backend is picked from BANK_STORAGE like the API does. tests/ calls
+run() with small numbers.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+from typing import Any, Dict, Optional
+
+from backend import bank
+from backend.money import from_cents
+from backend.storage import open_storage
+
+
+def run(accounts: int = 50, threads: int = 16, transfers: int = 500, seed: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Runs the check in a new temporary directory and returns what it counted;
+    "ok" is False if money was created or lost.
+    """
+    rng = random.Random(seed)
+    workdir = tempfile.mkdtemp(prefix="bank-stress-")
+    bank.DATABASE_FILE = os.path.join(workdir, "database.json")
+    bank.SQLITE_FILE = os.path.join(workdir, "bank.sqlite3")
+    bank.SHARD_DIR = os.path.join(workdir, "shards")
+    names = [f"user{i}" for i in range(accounts)]
+    bank.save_db({"users": [
+        {"name": name, "pin_number": "0000", "bank_balance": rng.randint(0, 1000)} for name in names
+    ]})
+    expected_total = sum(bank.get_balance(name) for name in names)
+
+    completed = [0]
+    rejected = [0]
+    counter_lock = threading.Lock()
+
+    def worker(seed: int) -> None:
+        local_rng = random.Random(seed)
+        for _ in range(transfers):
+            sender, receiver = local_rng.sample(names, 2)
+            try:
+                bank.transfer(sender, receiver, local_rng.randint(1, 200))
+                outcome = completed
+            except ValueError:
+                outcome = rejected
+            with counter_lock:
+                outcome[0] += 1
+
+    expected_cents = sum(bank.get_store().balance(name)[0] for name in names)
+    snapshot_reads = [0]
+    torn_reads = [0]
+    writers_done = threading.Event()
+
+    def reader() -> None:
+        while not writers_done.is_set():
+            snapshot = bank.get_store().snapshot()
+            if sum(snapshot.balance(name)[0] for name in names) != expected_cents:
+                torn_reads[0] += 1
+            snapshot_reads[0] += 1
+
+    workers = [threading.Thread(target=worker, args=(rng.random(),)) for _ in range(threads)]
+    reader_thread = threading.Thread(target=reader) if hasattr(bank.get_store(), "snapshot") else None
+    for thread in workers:
+        thread.start()
+    if reader_thread:
+        reader_thread.start()
+    for thread in workers:
+        thread.join()
+    writers_done.set()
+    if reader_thread:
+        reader_thread.join()
+
+    balances = [bank.get_balance(name) for name in names]
+    bank.get_store().close()
+    reloaded = open_storage(bank.STORAGE_BACKEND, bank.DATABASE_FILE, bank.SQLITE_FILE, bank.SHARD_DIR)
+    reloaded_balances = [from_cents(reloaded.get(name)["balance_cents"]) for name in names]
+    reloaded.close()
+
+    return {
+        "workdir": workdir,
+        "applied": completed[0],
+        "rejected": rejected[0],
+        "expected_total": expected_total,
+        "total": sum(balances),
+        "reloaded_total": sum(reloaded_balances),
+        "snapshot_reads": snapshot_reads[0] if reader_thread else None,
+        "torn_reads": torn_reads[0],
+        "ok": (
+            sum(balances) == expected_total
+            and reloaded_balances == balances
+            and min(balances) >= 0
+            and torn_reads[0] == 0
+        ),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--accounts", type=int, default=50)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--transfers", type=int, default=500, help="transfers per thread")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    result = run(args.accounts, args.threads, args.transfers, args.seed)
+    print(f"{result['applied']} transfers applied, {result['rejected']} rejected, working directory {result['workdir']}")
+    print(f"expected total {result['expected_total']}, in memory {result['total']}, reloaded {result['reloaded_total']}")
+    if result["snapshot_reads"] is not None:
+        print(f"{result['snapshot_reads']} snapshot reads, {result['torn_reads']} with a wrong total")
+    print("OK" if result["ok"] else "FAILED: money was created or lost")
+    return 0 if result["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,18 @@
+from backend.binary_snapshot import read_binary_snapshot, write_binary_snapshot
+from backend.store import AccountTable
+
+
+def test_adding_an_account_to_a_mapped_table(tmp_path):
+    path = str(tmp_path / "database.snap")
+    users = [{"name": name, "pin_number": "0000", "bank_balance": 10} for name in ("Ali", "Mona", "Saif")]
+    write_binary_snapshot(path, AccountTable.from_users(users), 7)
+    table, seq = read_binary_snapshot(path)
+    assert seq == 7
+    table.pins[table.slot("mona")] = "1234"
+
+    slot = table.add("Maya", "4321", 500)
+    assert table.slot("MAYA") == slot
+    assert table.balance("Maya") == 500
+    assert table.pins[table.slot("Mona")] == "1234"
+    assert table.search("m", None, 10) == ["Maya", "Mona"]
+    assert [user["name"] for user in table.to_users()] == ["Ali", "Mona", "Saif", "Maya"]
@@ -0,0 +1,16 @@
+from backend.history import TransactionHistory
+
+
+def test_record_folded_by_compaction_is_not_added_again(tmp_path):
+    history = TransactionHistory(str(tmp_path / "database.history"))
+    history.load(0)
+    record = {"op": "deposit", "name": "user0", "cents": 500, "ts": 1.0, "seq": 1}
+    # Compaction folds the record before its writer gets to the history ...
+    history.add(record, lambda name: 1500)
+    history.forget_through(1)
+    # ... then the writer adds it with the balance of a later state of the table
+    history.add(record, lambda name: 2000)
+
+    entries = history.page("user0", None, None, None, 10)
+    assert [(entry["cents"], entry["balance_cents"]) for entry in entries] == [(500, 1500)]
+    history.close()
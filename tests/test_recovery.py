@@ -0,0 +1,118 @@
+import time
+from backend.sharded_store import Inbox, ShardedStore
+from backend.store import AccountStore
+
+NAMES = [f"user{i}" for i in range(20)]
+
+
+def crash(store):
+    """Stops a store without closing it, like a killed process: only what is on disk is left."""
+    if isinstance(store, ShardedStore):
+        store._stop.set()
+        store._poller.join()
+        for shard in store._owned_shards():
+            crash(shard)
+    else:
+        if store._compactor is not None:
+            store._compactor.join()
+        store.journal.close()
+    store._release()
+
+
+def total(store):
+    return sum(store.balance(name)[0] for name in NAMES)
+
+
+def test_truncated_journal_drops_only_the_torn_record(tmp_path):
+    path = str(tmp_path / "database.json")
+    store = AccountStore(path, compact_every=1000)
+    store.replace({"users": [{"name": name, "pin_number": "0000", "bank_balance": 10} for name in NAMES]})
+    store.transfer("user0", "user1", 100)
+    store.transfer("user0", "user2", 200)
+    before = [store.balance(name)[0] for name in NAMES]
+    store.transfer("user1", "user3", 300)
+    crash(store)
+
+    # A crash in the middle of the last append leaves half a line
+    journal = str(tmp_path / "database.journal")
+    with open(journal, "rb+") as f:
+        content = f.read()
+        last = content.rstrip(b"\n").rfind(b"\n") + 1
+        f.truncate(last + (len(content) - last) // 2)
+
+    store = AccountStore(path, compact_every=1000)
+    store.load()
+    assert [store.balance(name)[0] for name in NAMES] == before
+    # New records go after the last complete one
+    store.transfer("user1", "user3", 300)
+    store.close()
+
+    store = AccountStore(path)
+    store.load()
+    assert store.balance("user3")[0] == 1300
+    assert total(store) == 20000
+    store.close()
+
+
+def _sharded(path):
+    store = ShardedStore(path, 4)
+    store.load()
+    store.replace({"users": [{"name": name, "pin_number": "0000", "bank_balance": 10} for name in NAMES]})
+    sender = "user0"
+    receiver = next(name for name in NAMES if store.shard_of(name) != store.shard_of(sender))
+    return store, sender, receiver
+
+
+def _failing_append(monkeypatch, failing):
+    append = Inbox.append
+
+    def maybe_fail(self, entries, present_from=None):
+        if failing[0]:
+            raise OSError("No space left on device")
+        return append(self, entries, present_from)
+
+    monkeypatch.setattr(Inbox, "append", maybe_fail)
+
+
+def test_failed_inbox_append_is_retried_while_running(tmp_path, monkeypatch):
+    store, sender, receiver = _sharded(str(tmp_path))
+    failing = [True]
+    _failing_append(monkeypatch, failing)
+
+    # The debit is journaled, so the transfer doesn't fail
+    sender_cents, _ = store.transfer(sender, receiver, 300)
+    assert sender_cents == 700
+    assert total(store) == 19700
+    assert store.unsent_hand_overs() == 1
+
+    failing[0] = False
+    deadline = time.monotonic() + 5
+    while total(store) != 20000 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert store.balance(receiver)[0] == 1300
+    assert all(not shard.outbound() for shard in store.shards)
+    assert store.unsent_hand_overs() == 0
+    store.close()
+
+
+def test_failed_inbox_append_is_handed_over_after_a_crash(tmp_path, monkeypatch):
+    store, sender, receiver = _sharded(str(tmp_path))
+    failing = [True]
+    _failing_append(monkeypatch, failing)
+    store.transfer(sender, receiver, 300)
+    crash(store)
+
+    failing[0] = False
+    store = ShardedStore(str(tmp_path), 4)
+    store.load()
+    assert store.balance(sender)[0] == 700
+    assert store.balance(receiver)[0] == 1300
+    assert all(not shard.outbound() for shard in store.shards)
+    store.close()
+
+    # Handed over once: a second restart doesn't credit it again
+    store = ShardedStore(str(tmp_path), 4)
+    store.load()
+    assert store.balance(receiver)[0] == 1300
+    assert total(store) == 20000
+    store.close()
@@ -0,0 +1,58 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+import pytest
+from backend import bank, scheduler as scheduler_module
+from backend.scheduler import Scheduler
+
+DAY = 24 * 3600
+NOW = 1_700_000_000.0
+
+
+def _ticks(schedules, count):
+    """Steps a Scheduler over these schedules one tick per second; returns the batches handed over in each tick."""
+    scheduler = Scheduler()
+    scheduler.load(schedules)
+    ticks = []
+
+    async def run(runs):
+        ticks[-1].append([entry["id"] for entry in runs])
+        return [{"id": entry["id"], "sender": entry["sender"], "next_due": entry["due"] + DAY} for entry in runs]
+
+    async def main():
+        for second in range(count):
+            ticks.append([])
+            await scheduler.tick(run, NOW + second)
+
+    asyncio.run(main())
+    return ticks
+
+
+def _back_dated(count, days):
+    return [{"id": f"s{i}", "sender": f"user{i}", "next_due": NOW - days * DAY} for i in range(count)]
+
+
+def test_back_dated_schedule_runs_once_per_tick():
+    ticks = _ticks(_back_dated(1, 30), 33)
+    # The 30 missed daily occurrences and today's, one per tick, then nothing until tomorrow
+    assert ticks == [[["s0"]]] * 31 + [[], []]
+
+
+def test_full_batches_still_run_each_schedule_once_per_tick(monkeypatch):
+    monkeypatch.setattr(scheduler_module, "MAX_BATCH", 2)
+    ticks = _ticks(_back_dated(5, 30), 2)
+    # A full batch doesn't wait for the next tick, but no schedule runs twice in one
+    assert ticks[0] == [["s0", "s1"], ["s2", "s3"], ["s4"]]
+    assert ticks[1] == ticks[0]
+
+
+def test_schedule_in_the_past_is_refused(tmp_path, monkeypatch):
+    monkeypatch.setattr(bank, "STORAGE_BACKEND", "json")
+    monkeypatch.setattr(bank, "DATABASE_FILE", str(tmp_path / "database.json"))
+    bank.save_db({"users": [{"name": name, "pin_number": "0000", "bank_balance": 10} for name in ("user0", "user1")]})
+    try:
+        with pytest.raises(ValueError, match="past"):
+            bank.schedule_transfer("user0", "user1", 5, datetime.now(timezone.utc) - timedelta(hours=1))
+        bank.schedule_transfer("user0", "user1", 5, datetime.now(timezone.utc) + timedelta(hours=1))
+        assert len(bank.list_schedules("user0")) == 1
+    finally:
+        bank.get_store().close()
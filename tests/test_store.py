@@ -0,0 +1,20 @@
+import threading
+from backend.store import AccountStore
+
+
+def test_replace_waits_for_operations_holding_account_locks(tmp_path):
+    store = AccountStore(str(tmp_path / "database.json"))
+    store.replace({"users": [{"name": "user0", "pin_number": "0000", "bank_balance": 10}]})
+    replacing = threading.Thread(target=store.replace, args=({"users": [{"name": "user1", "pin_number": "0000", "bank_balance": 20}]},))
+
+    with store.locked("user0"):
+        replacing.start()
+        replacing.join(0.2)
+        # Still the table this operation started with
+        assert replacing.is_alive()
+        assert store.balance("user0")[0] == 1000
+    replacing.join()
+
+    assert store.balance("user0") is None
+    assert store.balance("user1")[0] == 2000
+    store.close()
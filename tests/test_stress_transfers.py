@@ -0,0 +1,17 @@
+import pytest
+from backend import bank
+from scripts.stress_transfers import run
+
+
+@pytest.mark.parametrize("backend", ["json", "sqlite", "sharded"])
+def test_transfers_conserve_money(monkeypatch, backend):
+    monkeypatch.setattr(bank, "STORAGE_BACKEND", backend)
+    # run() points these at its temporary directory; put them back afterwards
+    for name in ("DATABASE_FILE", "SQLITE_FILE", "SHARD_DIR"):
+        monkeypatch.setattr(bank, name, getattr(bank, name))
+    result = run(accounts=10, threads=4, transfers=50, seed=1)
+    assert result["applied"] > 0
+    assert result["total"] == result["expected_total"]
+    assert result["reloaded_total"] == result["expected_total"]
+    assert result["torn_reads"] == 0
+    assert result["ok"]